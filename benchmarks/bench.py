@@ -0,0 +1,367 @@
+"""Benchmark harness for mcp-pandoc.
+
+Runs ``convert-contents`` through ``handle_call_tool`` across every fixture
+input format in ``tests/fixtures`` and every output format, at several
+synthetic input sizes, with and without filters, a defaults file and a
+reference document. It records latency percentiles per case, throughput at
+several concurrency levels and the peak RSS of the benchmark process and its
+pandoc children into a JSON file.
+
+Usage::
+
+    python benchmarks/bench.py run --output baseline.json
+    python benchmarks/bench.py compare baseline.json            # runs again with the baseline's options
+    python benchmarks/bench.py compare baseline.json --current current.json --threshold 0.15
+    python benchmarks/bench.py compare baseline.json --driver pypandoc  # same matrix, other pandoc driver
+
+``compare`` exits with status 1 when a case got slower, throughput dropped or
+peak RSS grew by more than the threshold.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import pypandoc  # noqa: E402
+
+from mcp_pandoc import cache, driver, pdf_engines, pool, results, server  # noqa: E402
+
+FIXTURE_DIR = os.path.join(ROOT, "tests", "fixtures")
+# Fixture extension -> pandoc writer used to build scaled copies
+INPUTS = {
+    "md": "markdown", "html": "html", "docx": "docx", "epub": "epub", "ipynb": "ipynb",
+    "odt": "odt", "rst": "rst", "tex": "latex", "txt": "plain",
+}
+OUTPUTS = {
+    "markdown": "md", "html": "html", "docx": "docx", "rst": "rst", "latex": "tex",
+    "epub": "epub", "txt": "txt", "ipynb": "ipynb", "odt": "odt", "pdf": "pdf",
+}
+VARIANTS = ("plain", "filters", "defaults", "reference_doc")
+DEFAULT_SIZES = (1, 50, 500)
+DEFAULT_REPEAT = 3
+DEFAULT_CONCURRENCY = (1, 4, 16)
+DEFAULT_THRESHOLD = 0.2
+# Latency changes smaller than this are noise, whatever the ratio
+MIN_DELTA_SECONDS = 0.005
+
+NOOP_FILTER = """#!{python}
+from pandocfilters import toJSONFilter
+
+
+def noop(key, value, format, meta):
+    return None
+
+
+if __name__ == "__main__":
+    toJSONFilter(noop)
+"""
+DEFAULTS_YAML = "number-sections: true\nmetadata:\n  title: Benchmark\n"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Return the ``fraction`` percentile of ``values`` by linear interpolation."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples: list[float]) -> dict:
+    """Return latency statistics in seconds for a list of samples."""
+    return {
+        "runs": len(samples),
+        "min": round(min(samples), 4),
+        "mean": round(statistics.fmean(samples), 4),
+        "p50": round(percentile(samples, 0.5), 4),
+        "p90": round(percentile(samples, 0.9), 4),
+        "p99": round(percentile(samples, 0.99), 4),
+    }
+
+
+def peak_rss_kib() -> dict:
+    """Return the peak RSS of this process and of its largest waited-for child, in KiB."""
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 if sys.platform == "darwin" else 1
+    return {
+        "server": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale,
+    }
+
+
+def build_inputs(work_dir: str, sizes: list[int], inputs: list[str]) -> dict[tuple[str, int], str]:
+    """Return the input file for every (fixture extension, size) pair.
+
+    Size 1 is the fixture itself; larger sizes repeat the fixture's markdown
+    rendering that many times and write it back in the fixture's format.
+    """
+    files = {}
+    for extension in inputs:
+        fixture = os.path.join(FIXTURE_DIR, f"test.{extension}")
+        markdown = None
+        for size in sizes:
+            if size == 1:
+                files[extension, size] = fixture
+                continue
+            if markdown is None:
+                # pypandoc can't infer a reader from .txt; pandoc reads plain text as markdown
+                markdown = pypandoc.convert_file(fixture, "markdown", format="markdown" if extension == "txt" else None)
+            scaled = os.path.join(work_dir, f"input-x{size}.{extension}")
+            body = "\n\n".join(f"# Part {index}\n\n{markdown}" for index in range(size))
+            pypandoc.convert_text(body, INPUTS[extension], format="markdown", outputfile=scaled,
+                                  extra_args=["--standalone"])
+            files[extension, size] = scaled
+    return files
+
+
+def build_assets(work_dir: str) -> dict[str, str]:
+    """Write the filter, defaults file and reference document used by the feature variants."""
+    noop_filter = os.path.join(work_dir, "noop_filter.py")
+    with open(noop_filter, "w") as f:
+        f.write(NOOP_FILTER.format(python=sys.executable))
+    os.chmod(noop_filter, 0o755)  # noqa: S103 - the filter must be executable for pandoc
+    defaults = os.path.join(work_dir, "defaults.yaml")
+    with open(defaults, "w") as f:
+        f.write(DEFAULTS_YAML)
+    reference_doc = os.path.join(work_dir, "reference.docx")
+    with open(reference_doc, "wb") as f:
+        f.write(subprocess.run(  # noqa: S603 - pandoc from pypandoc
+            [pypandoc.get_pandoc_path(), "--print-default-data-file", "reference.docx"],
+            capture_output=True, check=True,
+        ).stdout)
+    return {"filters": noop_filter, "defaults": defaults, "reference_doc": reference_doc}
+
+
+def case_arguments(input_file: str, output_format: str, variant: str, assets: dict, out_dir: str) -> dict:
+    """Build the convert-contents arguments for one benchmark case."""
+    arguments = {
+        "input_file": input_file,
+        "output_format": output_format,
+        "output_file": os.path.join(out_dir, f"out.{OUTPUTS[output_format]}"),
+    }
+    if variant == "filters":
+        arguments["filters"] = [assets["filters"]]
+    elif variant == "defaults":
+        arguments["defaults_file"] = assets["defaults"]
+    elif variant == "reference_doc":
+        arguments["reference_doc"] = assets["reference_doc"]
+    return arguments
+
+
+async def call(arguments: dict) -> float:
+    """Run one conversion through the MCP tool handler and return its latency in seconds."""
+    started = time.perf_counter()
+    await server.handle_call_tool("convert-contents", arguments)
+    return time.perf_counter() - started
+
+
+async def run_matrix(options: argparse.Namespace, work_dir: str) -> dict:
+    """Time every input x output x size x variant case."""
+    inputs = build_inputs(work_dir, options.sizes, options.inputs)
+    assets = build_assets(work_dir)
+    cases = {}
+    for (extension, size), input_file in inputs.items():
+        for output_format in options.outputs:
+            if OUTPUTS[output_format] == extension:
+                continue
+            for variant in options.variants:
+                if variant == "reference_doc" and output_format != "docx":
+                    continue
+                name = f"{extension}->{output_format}/x{size}/{variant}"
+                out_dir = tempfile.mkdtemp(dir=work_dir)
+                arguments = case_arguments(input_file, output_format, variant, assets, out_dir)
+                try:
+                    # One untimed run warms pandoc and the filesystem cache
+                    await call(arguments)
+                    samples = [await call(arguments) for _ in range(options.repeat)]
+                except Exception as e:
+                    cases[name] = {"error": str(e).splitlines()[0][:200]}
+                    continue
+                cases[name] = summarize(samples)
+                print(f"{name:45} p50 {cases[name]['p50']:.4f}s", file=sys.stderr)
+    return cases
+
+
+async def run_throughput(options: argparse.Namespace, work_dir: str) -> dict:
+    """Measure conversions per second for a scaled markdown input at each concurrency level."""
+    size = max(options.sizes)
+    input_file = build_inputs(work_dir, [size], ["md"])["md", size]
+    throughput = {}
+    for output_format in ("html", "docx"):
+        for concurrency in options.concurrency:
+            jobs = max(concurrency * 4, 16)
+            out_dirs = [tempfile.mkdtemp(dir=work_dir) for _ in range(concurrency)]
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies = []
+
+            async def job(index: int, fmt: str = output_format, dirs: list[str] = out_dirs,
+                          gate: asyncio.Semaphore = semaphore, samples: list[float] = latencies) -> None:
+                async with gate:
+                    arguments = case_arguments(input_file, fmt, "plain", {}, dirs[index % len(dirs)])
+                    arguments["output_file"] = arguments["output_file"].replace("out.", f"out{index}.")
+                    samples.append(await call(arguments))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(job(index) for index in range(jobs)))
+            elapsed = time.perf_counter() - started
+            name = f"md->{output_format}/x{size}/c{concurrency}"
+            throughput[name] = {
+                "jobs": jobs,
+                "seconds": round(elapsed, 4),
+                "per_second": round(jobs / elapsed, 3),
+                "p50": round(percentile(latencies, 0.5), 4),
+                "p99": round(percentile(latencies, 0.99), 4),
+            }
+            print(f"{name:45} {throughput[name]['per_second']:.2f}/s", file=sys.stderr)
+    return throughput
+
+
+def run_benchmarks(options: argparse.Namespace) -> dict:
+    """Run the whole suite and return the JSON-serializable report."""
+    # Measure conversions, not cache hits; keep every output on disk so nothing is paged
+    cache.configure(directory=None)
+    os.environ.pop("MCP_PANDOC_CACHE_DIR", None)
+    results.configure(page_chars=0)
+    pool.configure(max_workers=options.workers, max_queue=max(options.concurrency, default=1) * 4)
+    driver.configure(driver=options.driver)
+    if "pdf" in options.outputs and not pdf_engines.installed_engines():
+        print("No PDF engine installed; skipping pdf outputs", file=sys.stderr)
+        options.outputs = [fmt for fmt in options.outputs if fmt != "pdf"]
+
+    work_dir = tempfile.mkdtemp(prefix="mcp-pandoc-bench-")
+    started = time.perf_counter()
+    try:
+        # The report may go to stdout, so keep the server's own output off it
+        with contextlib.redirect_stdout(sys.stderr):
+            cases = asyncio.run(run_matrix(options, work_dir))
+            throughput = asyncio.run(run_throughput(options, work_dir)) if options.concurrency else {}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "seconds": round(time.perf_counter() - started, 1),
+            "pandoc": pypandoc.get_pandoc_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "options": {
+                "inputs": options.inputs, "outputs": options.outputs, "sizes": options.sizes,
+                "variants": options.variants, "repeat": options.repeat,
+                "concurrency": options.concurrency, "workers": pool.get_pool().max_workers,
+                "driver": driver.get_driver(),
+            },
+        },
+        "cases": cases,
+        "throughput": throughput,
+        "peak_rss_kib": peak_rss_kib(),
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> list[str]:
+    """Return one message per regression of ``current`` against ``baseline`` beyond ``threshold``."""
+    regressions = []
+    for name, before in baseline.get("cases", {}).items():
+        after = current.get("cases", {}).get(name)
+        if after is None or "error" in before:
+            continue
+        if "error" in after:
+            regressions.append(f"{name}: now fails ({after['error']})")
+            continue
+        if after["p50"] > before["p50"] * (1 + threshold) and after["p50"] - before["p50"] > MIN_DELTA_SECONDS:
+            regressions.append(f"{name}: p50 {before['p50']:.4f}s -> {after['p50']:.4f}s")
+    for name, before in baseline.get("throughput", {}).items():
+        after = current.get("throughput", {}).get(name)
+        if after is not None and after["per_second"] < before["per_second"] * (1 - threshold):
+            regressions.append(f"{name}: {before['per_second']}/s -> {after['per_second']}/s")
+    for process, before in baseline.get("peak_rss_kib", {}).items():
+        after = current.get("peak_rss_kib", {}).get(process)
+        if after is not None and after > before * (1 + threshold):
+            regressions.append(f"peak RSS ({process}): {before} KiB -> {after} KiB")
+    return regressions
+
+
+def _list(kind):
+    return lambda value: [kind(item) for item in value.split(",") if item]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse the harness command line."""
+    parser = argparse.ArgumentParser(description="Benchmark mcp-pandoc conversions")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks and write a JSON report")
+    run.add_argument("--output", default="-", help="report path (default: stdout)")
+    compare_parser = commands.add_parser("compare", help="compare a report against a baseline")
+    compare_parser.add_argument("baseline", help="baseline report")
+    compare_parser.add_argument("--current", help="report to compare (default: run the benchmarks again)")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help=f"relative change counted as a regression (default: {DEFAULT_THRESHOLD})")
+
+    for command in (run, compare_parser):
+        command.add_argument("--inputs", type=_list(str), default=list(INPUTS),
+                             help="comma-separated fixture extensions (default: all)")
+        command.add_argument("--outputs", type=_list(str), default=list(OUTPUTS),
+                             help="comma-separated output formats (default: all; pdf needs an engine)")
+        command.add_argument("--sizes", type=_list(int), default=list(DEFAULT_SIZES),
+                             help="comma-separated input scale factors (default: 1,50,500)")
+        command.add_argument("--variants", type=_list(str), default=list(VARIANTS),
+                             help=f"comma-separated variants out of {', '.join(VARIANTS)} (default: all)")
+        command.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs per case (default: 3)")
+        command.add_argument("--concurrency", type=_list(int), default=list(DEFAULT_CONCURRENCY),
+                             help="comma-separated concurrency levels for the throughput runs (default: 1,4,16)")
+        command.add_argument("--workers", type=int, default=None, help="server worker count (default: CPU count)")
+        command.add_argument("--driver", choices=driver.DRIVERS, default=None,
+                             help="pandoc driver (default: MCP_PANDOC_DRIVER or blocking)")
+    options = parser.parse_args(argv)
+    for name, allowed in (("inputs", INPUTS), ("outputs", OUTPUTS), ("variants", VARIANTS)):
+        unknown = [value for value in getattr(options, name) if value not in allowed]
+        if unknown:
+            parser.error(f"unknown {name}: {', '.join(unknown)}")
+    return options
+
+
+def main(argv=None) -> int:
+    """Run the harness; returns the process exit status."""
+    options = parse_args(argv)
+    if options.command == "run":
+        report = json.dumps(run_benchmarks(options), indent=2)
+        if options.output == "-":
+            print(report)
+        else:
+            with open(options.output, "w") as f:
+                f.write(report + "\n")
+        return 0
+
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    if options.current:
+        with open(options.current) as f:
+            current = json.load(f)
+    else:
+        # Re-run with the baseline's matrix so the cases line up; --driver and --workers may differ
+        recorded = baseline["meta"]["options"]
+        for name in ("inputs", "outputs", "sizes", "variants", "repeat", "concurrency"):
+            setattr(options, name, recorded[name])
+        current = run_benchmarks(options)
+    regressions = compare(baseline, current, options.threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    print(f"{len(regressions)} regression(s) beyond {options.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
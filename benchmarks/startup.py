@@ -0,0 +1,108 @@
+"""Startup benchmark for mcp-pandoc.
+
+MCP clients start a server per session, so import time and the latency of
+the first conversion are user-visible. Every run below starts a fresh
+interpreter and measures:
+
+* ``package_import``: ``import mcp_pandoc`` (what argument parsing costs)
+* ``server_import``: ``import mcp_pandoc.server`` (the MCP stack included)
+* ``first_call``: the first ``convert-contents`` call, with the pandoc
+  capability probe file missing (``cold``) or present (``warm``)
+* ``warmup`` / ``first_call_after_warmup``: what ``--warmup`` does before
+  the first call, and the first call after it
+* ``process``: wall time of the whole child interpreter
+
+Usage::
+
+    python benchmarks/startup.py --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench import summarize  # noqa: E402
+
+DEFAULT_RUNS = 5
+
+CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import mcp_pandoc
+package_imported = time.perf_counter()
+from mcp_pandoc import server
+server_imported = time.perf_counter()
+timings = {"package_import": package_imported - started, "server_import": server_imported - package_imported}
+if "--warmup" in sys.argv:
+    server.warmup()
+    timings["warmup"] = time.perf_counter() - server_imported
+called = time.perf_counter()
+asyncio.run(server.handle_call_tool("convert-contents", {"contents": "# Hello\\n\\nWorld", "output_format": "html"}))
+timings["first_call"] = time.perf_counter() - called
+print(json.dumps(timings))
+"""
+
+
+def run_child(probe_file: str, warmup: bool = False) -> dict:
+    """Start a fresh interpreter, convert once and return its timings."""
+    env = {**os.environ, "PYTHONPATH": os.path.join(ROOT, "src"), "MCP_PANDOC_PROBE_FILE": probe_file,
+           "MCP_PANDOC_RESULT_PAGE_CHARS": "0"}
+    env.pop("MCP_PANDOC_CACHE_DIR", None)
+    started = time.perf_counter()
+    process = subprocess.run(  # noqa: S603 - the current interpreter
+        [sys.executable, "-c", CHILD, *(["--warmup"] if warmup else [])],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    timings = json.loads(process.stdout.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - started
+    return timings
+
+
+def run_startup(runs: int) -> dict:
+    """Measure cold-probe, warm-probe and warmup starts ``runs`` times each."""
+    samples: dict[str, list[float]] = {}
+
+    def add(prefix: str, timings: dict) -> None:
+        for name, seconds in timings.items():
+            samples.setdefault(f"{prefix}/{name}", []).append(seconds)
+
+    with tempfile.TemporaryDirectory(prefix="mcp-pandoc-startup-") as work_dir:
+        probe_file = os.path.join(work_dir, "probe.json")
+        for _ in range(runs):
+            if os.path.exists(probe_file):
+                os.unlink(probe_file)
+            add("cold", run_child(probe_file))
+            add("warm", run_child(probe_file))
+            timings = run_child(probe_file, warmup=True)
+            timings["first_call_after_warmup"] = timings.pop("first_call")
+            add("warmup", timings)
+    return {
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "cases": {name: summarize(values) for name, values in sorted(samples.items())},
+    }
+
+
+def main(argv=None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help=f"starts per case (default: {DEFAULT_RUNS})")
+    parser.add_argument("--output", default="-", help="report path (default: stdout)")
+    options = parser.parse_args(argv)
+    report = json.dumps(run_startup(options.runs), indent=2)
+    if options.output == "-":
+        print(report)
+    else:
+        with open(options.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
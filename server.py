@@ -1,94 +1,810 @@
-import os, shutil, subprocess, tempfile
-from fastapi import FastAPI, HTTPException, Header
-from fastapi.responses import FileResponse, JSONResponse
+"""HTTP service converting markdown or HTML to docx or PDF with pandoc (see the Dockerfile).
+
+Conversions run as asyncio subprocesses, at most MAX_CONCURRENCY at a time with MAX_QUEUE more waiting; beyond that
+requests get 429 with a Retry-After estimate. docx output is streamed back as pandoc writes it, PDFs are built in a
+scratch file, and pandoc's process group is killed on timeouts, resource limits and client disconnects.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import math
+import os
+import resource
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from collections.abc import AsyncIterator
+from typing import Annotated
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from python_multipart.multipart import MultipartParser, parse_options_header
 from starlette.background import BackgroundTask
+from starlette.requests import ClientDisconnect
 
 API_KEY = os.getenv("API_KEY")            # optional
-PDF_ENGINE = "wkhtmltopdf"                # <- force non-LaTeX engine
+PDF_ENGINE = os.getenv("PDF_ENGINE", "wkhtmltopdf")   # default engine (non-LaTeX); jobs may pick another
+HTML_ENGINES = ("wkhtmltopdf", "weasyprint")
+PDF_ENGINES = HTML_ENGINES + ("typst", "xelatex", "lualatex", "pdflatex")
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", str(os.cpu_count() or 2)))  # pandoc jobs running at once
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "16"))                                   # jobs allowed to wait; more -> 429
+# PDF is the only output that needs files (pandoc hands the engine a temp file); point this at memory-backed storage
+# (the Dockerfile uses /dev/shm). Files are created with mkstemp, so a shared directory is safe.
+SCRATCH_DIR = os.getenv("SCRATCH_DIR") or tempfile.gettempdir()
+CHUNK = 64 * 1024
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(1024 ** 3)))  # /convert/stream uploads; larger -> 413
+COALESCE = os.getenv("COALESCE", "1").lower() not in ("0", "false", "no")  # identical /convert jobs share a run
+# Per output format, e.g. "300,pdf=900" (the bare value is the default; 0 = no limit). Past the timeout, or when the
+# client disconnects, pandoc's whole process group (filters, PDF engine) is killed. CPU/memory caps are RLIMIT_CPU
+# and RLIMIT_AS of every process pandoc runs.
+TIMEOUT_SECONDS = os.getenv("TIMEOUT_SECONDS", "300,pdf=900")
+MAX_CPU_SECONDS = os.getenv("MAX_CPU_SECONDS", "")
+MAX_MEMORY_MB = os.getenv("MAX_MEMORY_MB", "")
+GHC_OUT_OF_MEMORY = 251                   # pandoc's exit status when its heap allocation fails
+MEDIA = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pdf": "application/pdf",
+}
+
+def per_format(spec: str) -> dict[str, float]:
+    """Parse a per-format spec like "300,pdf=900" into {"*": 300, "pdf": 900}."""
+    table = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        fmt, _, value = item.rpartition("=")
+        table[fmt or "*"] = float(value)
+    return table
+
+TIMEOUTS = per_format(TIMEOUT_SECONDS)
+CPU_LIMITS = per_format(MAX_CPU_SECONDS)
+MEMORY_LIMITS = per_format(MAX_MEMORY_MB)
+
+def limit(table: dict[str, float], fmt: str) -> float | None:
+    """Look up `fmt` in a per_format table, falling back to its default; None (no limit) for 0 or unset."""
+    return table.get(fmt, table.get("*")) or None
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
 app = FastAPI()
+log = logging.getLogger("pandoc-api")
+log.addHandler(logging.StreamHandler(sys.stderr))
+log.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
 class Job(BaseModel):
+    """One /convert request."""
+
     input_format: str = "markdown"        # "markdown" or "html"
     output_format: str                    # "docx" or "pdf"
     content: str
     reference_docx_path: str | None = None
     defaults_yaml_path: str | None = None
     filters: list[str] | None = None
+    pdf_engine: str | None = None         # one of PDF_ENGINES that is installed; default PDF_ENGINE
+
+class Histogram:
+    """Cumulative-bucket histogram in Prometheus' shape."""
+
+    def __init__(self):
+        """Start with every bucket empty."""
+        self.counts, self.count, self.sum = [0] * len(BUCKETS), 0, 0.0
+
+    def observe(self, value: float) -> None:
+        """Count one observation."""
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def lines(self, name: str, labels: str = "") -> list[str]:
+        """Render the histogram as Prometheus exposition lines."""
+        sep = "," if labels else ""
+        out = [f'{name}_bucket{{{labels}{sep}le="{b}"}} {c}' for b, c in zip(BUCKETS, self.counts, strict=True)]
+        out.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        return out + [f"{name}_sum{suffix} {self.sum:.6f}", f"{name}_count{suffix} {self.count}"]
+
+class Metrics:
+    """Request counters and latency histograms, rendered for Prometheus by /metrics."""
+
+    def __init__(self):
+        """Start with no requests counted."""
+        self.requests: dict[tuple[str, str], int] = {}   # (output_format, status) -> count
+        self.durations: dict[str, Histogram] = {}        # output_format -> request duration
+        self.queue_wait = Histogram()
+
+    def finish(self, trace: dict) -> None:
+        """Count a finished request and write its trace as one JSON line to stderr."""
+        key = (trace["output_format"], trace["status"])
+        self.requests[key] = self.requests.get(key, 0) + 1
+        self.durations.setdefault(trace["output_format"], Histogram()).observe(trace["seconds"])
+        log.info(json.dumps({"event": "trace", **trace}))
+
+metrics = Metrics()
+
+class Trace:
+    """Stage timings of one /convert request; finished exactly once, when the response is done or fails."""
+
+    def __init__(self, job: "Job", engine: str | None):
+        """Start timing a request for `job`."""
+        self.started = time.monotonic()
+        self.fields = {"output_format": job.output_format, "input_format": job.input_format,
+                       "pdf_engine": engine, "bytes_in": len(job.content), "stages": {}}
+        self.done = False
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time the block as stage `name`."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.fields["stages"][name] = round(time.monotonic() - started, 4)
+
+    def finish(self, status: str, error: str | None = None) -> None:
+        """Record the request's outcome and duration in the metrics and the log; later calls are ignored."""
+        if self.done:
+            return
+        self.done = True
+        self.fields.update(status=status, seconds=round(time.monotonic() - self.started, 4))
+        if error:
+            self.fields["error"] = error.strip().splitlines()[0][:500] if error.strip() else error
+        metrics.finish(self.fields)
+
+class Limiter:
+    """Global cap on concurrent conversions with a bounded wait queue (fail fast instead of piling up)."""
+
+    def __init__(self, limit: int, max_queue: int):
+        """Allow `limit` conversions at once and `max_queue` more waiting for a slot."""
+        self.limit, self.max_queue = limit, max_queue
+        self.sem = asyncio.Semaphore(limit)
+        self.active = self.waiting = self.completed = self.rejected = 0
+        self.avg_seconds = 1.0            # moving average of job duration, used for Retry-After
+
+    def retry_after(self) -> int:
+        """Seconds a rejected client should wait: the queue ahead of it divided among the slots."""
+        return max(1, math.ceil(self.avg_seconds * (self.waiting + 1) / self.limit))
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold a conversion slot, yielding the seconds spent waiting for it; raises 429 when the queue is full."""
+        if self.sem.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="too many conversions in progress, retry later",
+                                headers={"Retry-After": str(self.retry_after())})
+        self.waiting += 1
+        queued = time.monotonic()
+        try:
+            await self.sem.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - queued
+        metrics.queue_wait.observe(waited)
+        self.active += 1
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.monotonic() - started)
+            self.active -= 1
+            self.completed += 1
+            self.sem.release()
+
+    def stats(self) -> dict:
+        """Return slot usage and counters, for /stats, /healthz and /metrics."""
+        return {"active": self.active, "waiting": self.waiting, "max_concurrency": self.limit,
+                "max_queue": self.max_queue, "completed": self.completed, "rejected": self.rejected,
+                "avg_seconds": round(self.avg_seconds, 3)}
+
+limiter = Limiter(MAX_CONCURRENCY, MAX_QUEUE)
+
+async def run(cmd: list[str]) -> tuple[int, str, str]:
+    """Run a short command to completion; returns its exit status, stdout and stderr."""
+    p = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        out, err = await p.communicate()
+    except asyncio.CancelledError:        # client went away: don't leave pandoc/wkhtmltopdf running
+        p.kill()
+        await p.wait()
+        raise
+    return p.returncode, out.decode("utf-8", "replace"), err.decode("utf-8", "replace")
+
+class Killed(HTTPException):
+    """pandoc's process group was killed: timed out, over a CPU/memory limit, or the client went away."""
+
+    STATUS = {"timeout": 504, "cpu_limit": 422, "memory_limit": 422, "cancelled": 499}
+
+    def __init__(self, reason: str, detail: str):
+        """Map the kill `reason` to its HTTP status."""
+        super().__init__(status_code=self.STATUS[reason], detail=detail)
+        self.reason = reason
+
+class Child:
+    """pandoc in its own process group (with the filters and PDF engine it starts), under its format's limits."""
+
+    def __init__(self, p, fmt: str):
+        """Watch pandoc process `p` converting to `fmt`, killing it when the format's timeout expires."""
+        self.p, self.fmt, self.killed = p, fmt, None
+        timeout = limit(TIMEOUTS, fmt)
+        self.timer = asyncio.get_running_loop().call_later(timeout, self.kill, "timeout") if timeout else None
+
+    @staticmethod
+    def limits(fmt: str) -> list[str]:
+        """Return a `sh` prefix setting the format's CPU and memory caps before it execs pandoc ([] when it has none).
+
+        Not a preexec_fn, which can deadlock a threaded process, and not prlimit on the running pandoc: it sizes its
+        heap reservation from RLIMIT_AS as it starts. pandoc's own children inherit the caps.
+        """
+        cpu, memory = limit(CPU_LIMITS, fmt), limit(MEMORY_LIMITS, fmt)
+        steps = []
+        if cpu:                           # soft limits first: a hard limit below the current soft one is rejected
+            steps += [f"ulimit -S -t {int(cpu)}", f"ulimit -H -t {int(cpu) + 5}"]
+        if memory:
+            steps += [f"ulimit -S -v {int(memory) << 10}", f"ulimit -H -v {int(memory) << 10}"]
+        return ["/bin/sh", "-c", " && ".join(steps) + ' && exec "$@"', "sh"] if steps else []
+
+    def kill(self, reason: str) -> None:
+        """SIGKILL pandoc's process group, remembering the first reason, unless pandoc has already exited."""
+        if self.p.returncode is None:
+            self.killed = self.killed or reason
+            with contextlib.suppress(ProcessLookupError, PermissionError):
+                os.killpg(self.p.pid, signal.SIGKILL)
+
+    async def reap(self) -> None:
+        """Wait for pandoc, killing its group first if it is still running (the response was cut short)."""
+        if self.timer:
+            self.timer.cancel()
+        self.kill("cancelled")
+        await self.p.wait()
+
+    def failure(self) -> Killed | None:
+        """Why pandoc was killed, if it was: our timeout, or its CPU/memory rlimit."""
+        rc = self.p.returncode
+        if self.killed == "timeout":
+            return Killed("timeout", f"conversion timed out after {limit(TIMEOUTS, self.fmt):g}s")
+        if self.killed == "cancelled":
+            return Killed("cancelled", "client disconnected")
+        if rc == -signal.SIGXCPU:
+            return Killed("cpu_limit", f"conversion exceeded the CPU limit of {limit(CPU_LIMITS, self.fmt):g}s")
+        if rc == GHC_OUT_OF_MEMORY and (memory := limit(MEMORY_LIMITS, self.fmt)):
+            return Killed("memory_limit", f"conversion exceeded the memory limit of {memory:g} MB")
+        return None
+
+async def spawn(cmd: list[str], data: bytes | AsyncIterator[bytes], fmt: str, env: dict | None = None):
+    """Start pandoc with `data` (bytes, or chunks as they arrive) on stdin.
+
+    Returns the Child and a task collecting pandoc's stderr.
+    """
+    p = await asyncio.create_subprocess_exec(*Child.limits(fmt), *cmd, stdin=asyncio.subprocess.PIPE,
+                                             stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env,
+                                             start_new_session=True)
+    child = Child(p, fmt)
+    err_task = asyncio.create_task(p.stderr.read())
+    try:
+        if isinstance(data, bytes):
+            p.stdin.write(data)
+            await p.stdin.drain()
+        else:
+            async for chunk in data:      # drain() holds the upload back while pandoc's pipe is full
+                p.stdin.write(chunk)
+                await p.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass                              # pandoc exited early; its stderr says why
+    except BaseException:                 # the upload failed (too large, client gone): don't leave pandoc running
+        await child.reap()
+        err_task.cancel()
+        raise
+    finally:
+        p.stdin.close()
+    return child, err_task
+
+async def unless_disconnected(request: Request, coro, body_read: asyncio.Event | None = None):
+    """Await `coro`, cancelling it (which kills its pandoc) if the client disconnects before it is done.
+
+    A streamed body is read by `coro` itself: polling for a disconnect would swallow its chunks, so the watch starts
+    once `body_read` is set (a disconnect during the upload ends the body stream instead).
+    """
+    task = asyncio.ensure_future(coro)
+
+    async def watch():
+        if body_read:
+            await body_read.wait()
+        while not await request.is_disconnected():
+            await asyncio.sleep(0.5)
+
+    watcher = asyncio.create_task(watch())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    if task.cancelled():
+        raise Killed("cancelled", "client disconnected")
+    return task.result()
+
+def too_large() -> HTTPException:
+    """Return the 413 error for a body larger than MAX_BODY_BYTES."""
+    return HTTPException(status_code=413, detail=f"request body is larger than MAX_BODY_BYTES ({MAX_BODY_BYTES})")
+
+class Upload:
+    """A /convert/stream body, handed to pandoc chunk by chunk: raw, or the first file part of a multipart form."""
+
+    def __init__(self, request: Request, trace: "Trace"):
+        """Read the body of `request`, counting its size in `trace`."""
+        self.request, self.trace = request, trace
+        self.done = asyncio.Event()
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        self.boundary = options.get(b"boundary") if content_type == b"multipart/form-data" else None
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield the document's bytes as they arrive; `done` is set once the body has been read."""
+        try:
+            async for chunk in (self._raw() if self.boundary is None else self._multipart()):
+                yield chunk
+        except ClientDisconnect:
+            raise Killed("cancelled", "client disconnected") from None
+        finally:
+            self.done.set()
+
+    async def _raw(self) -> AsyncIterator[bytes]:
+        received = 0
+        async for chunk in self.request.stream():
+            received += len(chunk)
+            self.trace.fields["bytes_in"] = received
+            if received > MAX_BODY_BYTES:
+                raise too_large()
+            if chunk:
+                yield chunk
 
-def run(cmd: list[str]) -> tuple[int, str, str]:
-    p = subprocess.run(cmd, text=True, capture_output=True)
-    return p.returncode, p.stdout, p.stderr
+    async def _multipart(self) -> AsyncIterator[bytes]:
+        # The parser calls back synchronously; the file's data from one body chunk is collected, then passed on
+        out: list[bytes] = []
+        header, disposition, state = [b"", b""], b"", {"in_file": False, "found": False}
+
+        def on_header_field(data, start, end):
+            header[0] += data[start:end]
+
+        def on_header_value(data, start, end):
+            header[1] += data[start:end]
+
+        def on_header_end():
+            nonlocal disposition
+            if header[0].lower() == b"content-disposition":
+                disposition = header[1]
+            header[:] = [b"", b""]
+
+        def on_headers_finished():
+            nonlocal disposition
+            state["in_file"] = not state["found"] and b"filename" in parse_options_header(disposition)[1]
+            disposition = b""
+
+        def on_part_data(data, start, end):
+            if state["in_file"]:
+                out.append(data[start:end])
+
+        def on_part_end():
+            if state["in_file"]:
+                state.update(in_file=False, found=True)
+
+        parser = MultipartParser(self.boundary, {
+            "on_header_field": on_header_field, "on_header_value": on_header_value, "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished, "on_part_data": on_part_data, "on_part_end": on_part_end,
+        })
+        async for chunk in self._raw():
+            parser.write(chunk)
+            if out:
+                yield b"".join(out)
+                out.clear()
+        parser.finalize()
+        if not state["found"]:
+            raise HTTPException(status_code=400, detail="multipart body has no file part")
+
+_versions: dict | None = None
+_versions_lock = asyncio.Lock()
+
+async def versions() -> dict:
+    """Tool versions, probed once: they can't change under a running server, and probes cost a process each."""
+    global _versions
+    async with _versions_lock:
+        if _versions is None:
+            probes = {"pandoc": ["pandoc", "-v"]}
+            if shutil.which(PDF_ENGINE):
+                probes[PDF_ENGINE] = [PDF_ENGINE, "--version"]
+            found = {}
+            for name, cmd in probes.items():
+                _, out, err = await run(cmd)
+                found[name] = (out or err).splitlines()[0] if (out or err) else ""
+            _versions = {**found, "pdf_engines": [e for e in PDF_ENGINES if shutil.which(e)]}
+    return _versions
 
 @app.get("/healthz")
-def healthz():
-    rc_wk, wk_out, wk_err = run(["wkhtmltopdf", "--version"])
-    rc_pd, pd_out, pd_err = run(["pandoc", "-v"])
-    return JSONResponse({
-        "ok": True,
-        "pdf_engine": PDF_ENGINE,
-        "wkhtmltopdf": (wk_out or wk_err).splitlines()[0] if (wk_out or wk_err) else "",
-        "pandoc": (pd_out or pd_err).splitlines()[0] if (pd_out or pd_err) else "",
-    })
+async def healthz():
+    """Liveness check with the tool versions and slot usage."""
+    return JSONResponse({"ok": True, "pdf_engine": PDF_ENGINE, **await versions(), "jobs": limiter.stats()})
 
-@app.post("/convert")
-def convert(job: Job, x_api_key: str | None = Header(default=None)):
+@app.get("/stats")
+async def stats():
+    """Slot usage and counters as JSON."""
+    return JSONResponse(limiter.stats())
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Request, queue and child process metrics in Prometheus' text format."""
+    jobs = limiter.stats()
+    # asyncio reaps pandoc and the PDF engines itself, so child usage is the process-wide RUSAGE_CHILDREN total
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss_bytes = children.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    lines = ["# TYPE pandoc_requests_total counter"]
+    lines += [f'pandoc_requests_total{{output_format="{fmt}",status="{status}"}} {count}'
+              for (fmt, status), count in sorted(metrics.requests.items())]
+    lines.append("# TYPE pandoc_request_duration_seconds histogram")
+    for fmt, hist in sorted(metrics.durations.items()):
+        lines += hist.lines("pandoc_request_duration_seconds", f'output_format="{fmt}"')
+    lines.append("# TYPE pandoc_queue_wait_seconds histogram")
+    lines += metrics.queue_wait.lines("pandoc_queue_wait_seconds")
+    lines += [
+        "# TYPE pandoc_jobs_active gauge", f"pandoc_jobs_active {jobs['active']}",
+        "# TYPE pandoc_jobs_waiting gauge", f"pandoc_jobs_waiting {jobs['waiting']}",
+        "# TYPE pandoc_jobs_rejected_total counter", f"pandoc_jobs_rejected_total {jobs['rejected']}",
+        "# TYPE pandoc_max_concurrency gauge", f"pandoc_max_concurrency {jobs['max_concurrency']}",
+        "# TYPE pandoc_child_cpu_seconds_total counter",
+        f"pandoc_child_cpu_seconds_total {children.ru_utime + children.ru_stime:.6f}",
+        "# TYPE pandoc_child_max_rss_bytes gauge", f"pandoc_child_max_rss_bytes {rss_bytes}",
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+def authorize(x_api_key: str | None) -> None:
+    """Reject the request unless it carries the API key (when one is configured)."""
     if API_KEY and x_api_key != API_KEY:
         raise HTTPException(status_code=401, detail="invalid API key")
 
+def pandoc_command(job: Job) -> tuple[list[str], str]:
+    """Validate a job and build its pandoc command; returns it with the PDF engine."""
     if job.input_format not in ("markdown", "html"):
         raise HTTPException(status_code=400, detail="input_format must be 'markdown' or 'html'")
     if job.output_format not in ("docx", "pdf"):
         raise HTTPException(status_code=400, detail="output_format must be 'docx' or 'pdf'")
+    engine = job.pdf_engine or PDF_ENGINE
+    if job.output_format == "pdf" and (engine not in PDF_ENGINES or not shutil.which(engine)):
+        raise HTTPException(status_code=400, detail=f"pdf_engine must be one of the installed engines: "
+                                                    f"{', '.join(e for e in PDF_ENGINES if shutil.which(e))}")
+
+    # Build pandoc command: input on stdin, output on stdout (PDF: a scratch file, see below)
+    cmd = ["pandoc", "-f", job.input_format]
 
-    td = tempfile.mkdtemp(prefix="pandoc_")
-    cleanup_now = True
+    if job.output_format == "pdf" and engine in HTML_ENGINES:
+        # HTML → PDF via wkhtmltopdf/weasyprint (no LaTeX at all)
+        cmd += [
+            "--pdf-engine", engine,
+            "-t", "html5",
+            "--metadata", "pagetitle=Document",
+            "--standalone"
+        ]
+    elif job.output_format == "pdf":
+        cmd += ["--pdf-engine", engine]
+        if engine != "typst":
+            cmd += ["-V", "geometry:margin=1in"]
+    else:
+        cmd += ["-t", job.output_format]
+
+    if job.reference_docx_path and job.output_format == "docx":
+        cmd += ["--reference-doc", job.reference_docx_path]
+    if job.defaults_yaml_path:
+        cmd += ["--defaults", job.defaults_yaml_path]
+    if job.filters:
+        for flt in job.filters:
+            cmd += ["--filter", flt]
+    return cmd, engine
+
+@app.post("/convert")
+async def convert(job: Job, request: Request, x_api_key: str | None = Header(default=None)):
+    """Convert a document sent as JSON; docx is streamed back, PDF is sent from a scratch file."""
+    authorize(x_api_key)
+    cmd, engine = pandoc_command(job)
+    trace = Trace(job, engine if job.output_format == "pdf" else None)
+    if COALESCE:
+        return await respond_shared(request, job, cmd, engine, trace)
+    return await respond(request, cmd, job.content.encode("utf-8"), job.output_format, engine, trace)
+
+@app.post("/convert/stream")
+async def convert_stream(request: Request, output_format: str, input_format: str = "markdown",
+                         reference_docx_path: str | None = None, defaults_yaml_path: str | None = None,
+                         filters: Annotated[list[str] | None, Query()] = None, pdf_engine: str | None = None,
+                         x_api_key: str | None = Header(default=None)):
+    """Convert a large document, sent as the body instead of in JSON.
+
+    The Job fields are query parameters and the body is the content, raw or as the file of a multipart form. The body
+    is piped to pandoc as it arrives and the output streamed back, so the memory a request takes here doesn't grow
+    with the document (pandoc itself still holds the whole document).
+    """
+    authorize(x_api_key)
+    job = Job(input_format=input_format, output_format=output_format, content="", filters=filters,
+              reference_docx_path=reference_docx_path, defaults_yaml_path=defaults_yaml_path, pdf_engine=pdf_engine)
+    cmd, engine = pandoc_command(job)
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > MAX_BODY_BYTES:
+        raise too_large()
+    trace = Trace(job, engine if job.output_format == "pdf" else None)
+    upload = Upload(request, trace)
+    return await respond(request, cmd, upload.chunks(), job.output_format, engine, trace, upload.done)
+
+async def respond(request: Request, cmd: list[str], data: bytes | AsyncIterator[bytes], fmt: str, engine: str,
+                  trace: Trace, body_read: asyncio.Event | None = None):
+    """Run pandoc in a slot on `data` and respond with its output: streamed for docx, a scratch file for PDF."""
     try:
-        in_ext = "md" if job.input_format == "markdown" else "html"
-        in_path = os.path.join(td, f"in.{in_ext}")
-        out_path = os.path.join(td, f"out.{job.output_format}")
-
-        with open(in_path, "w", encoding="utf-8") as f:
-            f.write(job.content)
-
-        # Build pandoc command
-        cmd = ["pandoc", "-f", job.input_format, in_path, "-o", out_path]
-
-        if job.output_format == "pdf":
-            # Force HTML → PDF via wkhtmltopdf (no LaTeX at all)
-            cmd += [
-                "--pdf-engine", "wkhtmltopdf",
-                "-t", "html5",
-                "--metadata", "pagetitle=Document",
-                "--standalone"
-            ]
-
-        if job.reference_docx_path and job.output_format == "docx":
-            cmd += ["--reference-doc", job.reference_docx_path]
-        if job.defaults_yaml_path:
-            cmd += ["--defaults", job.defaults_yaml_path]
-        if job.filters:
-            for flt in job.filters:
-                cmd += ["--filter", flt]
-
-        rc, out, err = run(cmd)
-        if rc != 0:
-            raise HTTPException(status_code=500, detail=(err or out or "pandoc failed"))
-
-        if not os.path.exists(out_path):
-            raise HTTPException(status_code=500, detail="output file missing")
-
-        media = (
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-            if job.output_format == "docx" else "application/pdf"
-        )
-        cleanup_now = False
-        return FileResponse(
-            out_path, media_type=media, filename=f"out.{job.output_format}",
-            background=BackgroundTask(shutil.rmtree, td, ignore_errors=True)
-        )
-    finally:
-        if cleanup_now:
-            shutil.rmtree(td, ignore_errors=True)
+        if fmt == "pdf":
+            path = await unless_disconnected(request, build_pdf(cmd, data, trace), body_read)
+            trace.finish("ok")
+            return pdf_response(path, engine, BackgroundTask(os.unlink, path))
+
+        # The slot is held until the response has been streamed, so it is released by the body generator
+        stack = contextlib.AsyncExitStack()
+
+        async def start():
+            trace.fields["stages"]["queue"] = round(await stack.enter_async_context(limiter.slot()), 4)
+            with trace.stage("first_byte"):
+                child, err_task = await spawn(cmd + ["-o", "-"], data, fmt)
+                stack.push_async_callback(child.reap)
+                first = await child.p.stdout.read(CHUNK)
+            if not first:
+                await child.p.wait()
+                err = (await err_task).decode("utf-8", "replace")
+                raise child.failure() or HTTPException(status_code=500, detail=(err or "pandoc produced no output"))
+            return child, first
+
+        try:
+            child, first = await unless_disconnected(request, start(), body_read)
+        except BaseException:
+            await stack.aclose()
+            raise
+    except BaseException as e:
+        record_failure(trace, e)
+        raise
+
+    async def body():
+        try:
+            async with stack:
+                with trace.stage("stream"):
+                    yield first
+                    while chunk := await child.p.stdout.read(CHUNK):
+                        yield chunk
+                    await child.p.wait()  # exited normally; reap() only kills when the stream was cut short
+        except BaseException as e:
+            trace.finish("aborted", str(e) or type(e).__name__)
+            raise
+        # Headers are already sent, so a kill mid-stream can only be recorded (the client gets a truncated file)
+        trace.finish(child.killed or ("ok" if child.p.returncode == 0 else "error"))
+
+    return StreamingResponse(body(), media_type=MEDIA[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="out.{fmt}"'})
+
+def record_failure(trace: Trace, e: BaseException) -> None:
+    """Finish `trace` with the status matching the error that ended the request."""
+    if isinstance(e, Killed):
+        trace.finish(e.reason, str(e.detail))
+    elif isinstance(e, HTTPException):
+        trace.finish("rejected" if e.status_code in (413, 429) else "error", str(e.detail))
+    else:                                 # includes the client going away while queued
+        trace.finish("error", str(e) or type(e).__name__)
+
+def pdf_response(path: str, engine: str, background: BackgroundTask) -> FileResponse:
+    """Send the PDF at `path`, running `background` (which deletes it) once it has been sent."""
+    return FileResponse(path, media_type=MEDIA["pdf"], filename="out.pdf", headers={"X-PDF-Engine": engine},
+                        background=background)
+
+async def build_pdf(cmd: list[str], data: bytes | AsyncIterator[bytes], trace: Trace) -> str:
+    """Run pandoc in a slot into a PDF scratch file and return its path; the caller deletes it."""
+    async with limiter.slot() as waited:
+        trace.fields["stages"]["queue"] = round(waited, 4)
+        # pandoc infers PDF from the .pdf extension; it and wkhtmltopdf keep their intermediates in SCRATCH_DIR too
+        fd, out_path = tempfile.mkstemp(prefix="pandoc_", suffix=".pdf", dir=SCRATCH_DIR)
+        os.close(fd)
+        cleanup_now = True
+        try:
+            with trace.stage("pandoc"):
+                child, err_task = await spawn(cmd + ["-o", out_path], data, "pdf",
+                                              env={**os.environ, "TMPDIR": SCRATCH_DIR})
+                try:
+                    out = await child.p.stdout.read()
+                    rc = await child.p.wait()
+                finally:
+                    await child.reap()
+            err = (await err_task).decode("utf-8", "replace")
+            if killed := child.failure():
+                raise killed
+            if rc != 0:
+                raise HTTPException(status_code=500, detail=(err or out.decode("utf-8", "replace") or "pandoc failed"))
+
+            if not os.path.getsize(out_path):
+                raise HTTPException(status_code=500, detail="output file missing")
+
+            cleanup_now = False
+            return out_path
+        finally:
+            if cleanup_now:
+                with contextlib.suppress(OSError):
+                    os.unlink(out_path)
+
+def job_key(job: Job, cmd: list[str]) -> str:
+    """Jobs with the same content, pandoc command and referenced files (by size and mtime) are identical."""
+    def fingerprint(path: str) -> list:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return [path]                 # a filter found on PATH, or missing (pandoc will say so)
+        return [path, st.st_size, st.st_mtime_ns]
+
+    files = [job.reference_docx_path, job.defaults_yaml_path, *(job.filters or [])]
+    payload = json.dumps([hashlib.sha256(job.content.encode("utf-8")).hexdigest(), cmd,
+                          [fingerprint(path) for path in files if path]])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+flights: dict[str, "Flight"] = {}
+MAX_AHEAD = 16                            # docx chunks pandoc may run ahead of the slowest request sharing its run
+
+class Flight:
+    """One pandoc run shared by every identical /convert job that arrives while it runs.
+
+    Identical jobs join while the run has not sent any docx output yet; pandoc writes a docx at the very end, so that
+    is most of the run. Only a window of output not yet sent to every job is kept, and pandoc waits while it is full.
+    The PDF scratch file is served to each request and deleted after the last one. pandoc is killed once no request
+    waits for it.
+    """
+
+    def __init__(self, key: str, produce):
+        """Register the flight under `key` and start `produce(flight)` in a task of its own."""
+        self.key, self.path = key, None
+        self.chunks: list[bytes] = []     # output not yet sent to every request
+        self.sent = 0                     # chunks sent to every request and dropped
+        self.positions: dict[object, int] = {}    # next chunk of each attached request
+        self.changed = asyncio.Event()
+        flights[key] = self
+        self.task = asyncio.create_task(produce(self))
+        self.task.add_done_callback(self.landed)
+
+    def landed(self, task: asyncio.Task) -> None:
+        """Stop taking joiners once the run is over, and wake every request waiting on it."""
+        self.forget()                     # later identical jobs start a run of their own
+        self.wake()
+        if not task.cancelled():
+            task.exception()              # retrieved: every request re-raises it, an abandoned flight has none
+
+    def forget(self) -> None:
+        """Remove the flight from the table, if it is still the one registered for its key."""
+        if flights.get(self.key) is self:
+            del flights[self.key]
+
+    def wake(self) -> None:
+        """Wake the producer and the requests waiting for output or for room in the window."""
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    @contextlib.contextmanager
+    def attached(self):
+        """Attach a request for the duration of the block, yielding its token for output()."""
+        token = object()
+        self.positions[token] = self.sent
+        try:
+            yield token
+        finally:
+            del self.positions[token]
+            if not self.positions:
+                self.forget()
+                self.task.cancel()        # a no-op once pandoc is done; before, the producer's finally kills it
+                if self.path:
+                    with contextlib.suppress(OSError):
+                        os.unlink(self.path)
+            else:
+                self.trim()
+
+    def trim(self) -> None:
+        """Drop the chunks every request has been sent."""
+        done = min(self.positions.values()) - self.sent
+        if done > 0:
+            del self.chunks[:done]
+            self.sent += done
+            self.forget()                 # a job joining now could not be sent the output from its start
+            self.wake()
+
+    async def append(self, chunk: bytes) -> None:
+        """Add a chunk of docx output, waiting while the window of chunks not yet sent to every request is full."""
+        self.chunks.append(chunk)
+        self.wake()
+        while len(self.chunks) > MAX_AHEAD:
+            await self.changed.wait()
+
+    async def result(self):
+        """Wait for the run's outcome, shared by every request."""
+        return await asyncio.shield(self.task)    # a request that gives up must not cancel the others' run
+
+    async def started(self) -> None:
+        """Wait for the first chunk of output; raises the run's error if it failed before writing any."""
+        while not self.chunks and not self.task.done():
+            await self.changed.wait()
+        if not self.chunks:
+            await self.result()
+
+    async def output(self, token: object) -> AsyncIterator[bytes]:
+        """Yield the docx output for the request holding `token`, from its first byte."""
+        while True:
+            index = self.positions[token] - self.sent
+            if index < len(self.chunks):
+                chunk = self.chunks[index]
+                self.positions[token] += 1
+                self.trim()
+                yield chunk
+            elif self.task.done():
+                return
+            else:
+                await self.changed.wait()
+
+    def status(self) -> str:
+        """"ok", the kill reason, or "error", for the trace of each request."""
+        error = self.task.exception()
+        return "ok" if error is None else getattr(error, "reason", "error")
+
+async def stream_docx(flight: Flight, cmd: list[str], data: bytes, fmt: str, trace: Trace) -> None:
+    """Stream a docx from pandoc into `flight`, holding a conversion slot while pandoc runs."""
+    async with limiter.slot() as waited:
+        trace.fields["stages"]["queue"] = round(waited, 4)
+        child, err_task = await spawn(cmd + ["-o", "-"], data, fmt)
+        try:
+            while chunk := await child.p.stdout.read(CHUNK):
+                await flight.append(chunk)
+            await child.p.wait()
+        finally:
+            await child.reap()
+    err = (await err_task).decode("utf-8", "replace")
+    if killed := child.failure():
+        raise killed
+    if child.p.returncode != 0 or not (flight.chunks or flight.sent):
+        raise HTTPException(status_code=500, detail=(err or "pandoc produced no output"))
+
+async def respond_shared(request: Request, job: Job, cmd: list[str], engine: str, trace: Trace):
+    """respond() for /convert, where an identical job already running is joined instead of run again."""
+    fmt, data, key = job.output_format, job.content.encode("utf-8"), job_key(job, cmd)
+    flight = flights.get(key)
+    trace.fields["coalesced"] = flight is not None
+    if flight is None:
+        async def produce(into: Flight) -> None:
+            if fmt == "pdf":
+                into.path = await build_pdf(cmd, data, trace)
+            else:
+                await stream_docx(into, cmd, data, fmt, trace)
+        flight = Flight(key, produce)    # queue and pandoc stages are timed in the first job's trace
+
+    stack = contextlib.ExitStack()
+    token = stack.enter_context(flight.attached())
+    try:
+        if fmt == "pdf":
+            await unless_disconnected(request, flight.result())
+            trace.finish("ok")
+            return pdf_response(flight.path, engine, BackgroundTask(stack.close))
+        with trace.stage("first_byte"):
+            await unless_disconnected(request, flight.started())
+    except BaseException as e:
+        stack.close()
+        record_failure(trace, e)
+        raise
+
+    async def body():
+        try:
+            with stack, trace.stage("stream"):
+                async for chunk in flight.output(token):
+                    yield chunk
+        except BaseException as e:
+            trace.finish("aborted", str(e) or type(e).__name__)
+            raise
+        # As in respond(), a run that fails after its first byte can only be recorded
+        trace.finish(flight.status())
 
+    return StreamingResponse(body(), media_type=MEDIA[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="out.{fmt}"'})
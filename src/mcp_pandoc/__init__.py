@@ -1,12 +1,191 @@
 """mcp_pandoc package initialization."""
+import argparse
 import asyncio
+import importlib
+import os
+import threading
 
-from . import server
+from . import (
+    assets,
+    cache,
+    capabilities,
+    chapters,
+    driver,
+    filters,
+    flights,
+    jobs,
+    latex_format,
+    limits,
+    metrics,
+    pandoc_server,
+    pdf_engines,
+    pool,
+    results,
+)
+
+
+def parse_args(argv=None):
+    """Parse command line options for the mcp-pandoc server."""
+    parser = argparse.ArgumentParser(prog="mcp-pandoc", description="MCP server for pandoc document conversion")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Maximum number of concurrent conversions (env: MCP_PANDOC_WORKERS, default: CPU count)"
+    )
+    parser.add_argument(
+        "--executor", choices=pool.EXECUTOR_KINDS, default=None,
+        help="Run conversions in a thread or process pool (env: MCP_PANDOC_EXECUTOR, default: thread)"
+    )
+    parser.add_argument(
+        "--max-queue", type=int, default=None,
+        help=f"Maximum number of conversions waiting for a worker (env: MCP_PANDOC_MAX_QUEUE, "
+             f"default: {pool.DEFAULT_MAX_QUEUE})"
+    )
+    parser.add_argument(
+        "--cache-dir", default=None,
+        help="Directory for the persistent conversion result cache (env: MCP_PANDOC_CACHE_DIR, default: disabled)"
+    )
+    parser.add_argument(
+        "--cache-max-bytes", type=int, default=None,
+        help=f"Maximum size of the result cache before LRU eviction (env: MCP_PANDOC_CACHE_MAX_BYTES, "
+             f"default: {cache.DEFAULT_MAX_BYTES})"
+    )
+    parser.add_argument(
+        "--asset-dir", default=None,
+        help="Directory of the rendered-asset cache that diagram filters reach through MCP_PANDOC_ASSET_DIR "
+             "(env: MCP_PANDOC_ASSET_DIR, default: disabled)"
+    )
+    parser.add_argument(
+        "--asset-max-bytes", type=int, default=None,
+        help=f"Maximum size of the asset cache before LRU eviction (env: MCP_PANDOC_ASSET_MAX_BYTES, "
+             f"default: {assets.DEFAULT_MAX_BYTES})"
+    )
+    parser.add_argument(
+        "--chapter-cache-bytes", type=int, default=None,
+        help=f"Memory for parsed chapter ASTs reused by input_files book builds; 0 disables "
+             f"(env: MCP_PANDOC_CHAPTER_CACHE_BYTES, default: {chapters.DEFAULT_MAX_BYTES})"
+    )
+    parser.add_argument(
+        "--no-coalesce", dest="coalesce", action="store_false", default=None,
+        help="Run every conversion on its own instead of letting identical conversions in flight share one run "
+             "(env: MCP_PANDOC_COALESCE=0)"
+    )
+    parser.add_argument(
+        "--driver", choices=driver.DRIVERS, default=None,
+        help="Wait for pandoc in a pool worker or on the event loop with asyncio subprocesses "
+             "(env: MCP_PANDOC_DRIVER, default: blocking)"
+    )
+    parser.add_argument(
+        "--filter-mode", choices=filters.FILTER_MODES, default=None,
+        help="Run panflute/pandocfilters Python filters as pandoc subprocesses or in-process on a shared AST "
+             "(env: MCP_PANDOC_FILTER_MODE, default: subprocess)"
+    )
+    parser.add_argument(
+        "--backend", choices=pandoc_server.BACKENDS, default=None,
+        help="Run conversions as pandoc subprocesses or on a pool of warm 'pandoc server' processes "
+             "(env: MCP_PANDOC_BACKEND, default: subprocess)"
+    )
+    parser.add_argument(
+        "--server-workers", type=int, default=None,
+        help=f"Number of pandoc server processes for the server backend (env: MCP_PANDOC_SERVER_WORKERS, "
+             f"default: {pandoc_server.DEFAULT_SERVER_WORKERS})"
+    )
+    parser.add_argument(
+        "--result-page-chars", type=int, default=None,
+        help=f"Converted contents longer than this are returned in pages through read-conversion-result; "
+             f"0 disables paging (env: MCP_PANDOC_RESULT_PAGE_CHARS, default: {results.DEFAULT_PAGE_CHARS})"
+    )
+    parser.add_argument(
+        "--max-embed-bytes", type=int, default=None,
+        help=f"Largest output returned inline with embed_output (env: MCP_PANDOC_MAX_EMBED_BYTES, "
+             f"default: {results.DEFAULT_MAX_EMBED_BYTES})"
+    )
+    parser.add_argument(
+        "--timeout", default=None,
+        help=f"Seconds a conversion may run before its processes are killed, optionally per output format, "
+             f"e.g. '300,pdf=900'; 0 disables (env: MCP_PANDOC_TIMEOUT, default: {limits.DEFAULT_TIMEOUT})"
+    )
+    parser.add_argument(
+        "--max-cpu-seconds", default=None,
+        help="RLIMIT_CPU for every pandoc, filter and TeX process, optionally per output format, e.g. '60,pdf=300' "
+             "(env: MCP_PANDOC_MAX_CPU_SECONDS, default: unlimited)"
+    )
+    parser.add_argument(
+        "--max-memory-mib", default=None,
+        help="RLIMIT_AS in MiB for every pandoc, filter and TeX process, optionally per output format, "
+             "e.g. '2048,pdf=4096' (env: MCP_PANDOC_MAX_MEMORY_MIB, default: unlimited)"
+    )
+    parser.add_argument(
+        "--job-db", default=None,
+        help="SQLite database keeping submit-conversion jobs and their results across restarts "
+             "(env: MCP_PANDOC_JOB_DB, default: in memory only)"
+    )
+    parser.add_argument(
+        "--job-ttl", type=float, default=None,
+        help=f"Seconds a finished submit-conversion job is kept (env: MCP_PANDOC_JOB_TTL, "
+             f"default: {jobs.DEFAULT_TTL_SECONDS})"
+    )
+    parser.add_argument(
+        "--latex-format-dir", default=None,
+        help="Directory for precompiled LaTeX preamble formats used by xelatex PDF builds "
+             "(env: MCP_PANDOC_LATEX_FORMAT_DIR, default: disabled)"
+    )
+    parser.add_argument(
+        "--pdf-engine", choices=(pdf_engines.AUTO, *pdf_engines.ENGINES), default=None,
+        help="PDF engine for jobs that don't set pdf_engine; 'auto' benchmarks the installed engines at startup "
+             f"(env: MCP_PANDOC_PDF_ENGINE, default: {pdf_engines.DEFAULT_ENGINE})"
+    )
+    parser.add_argument(
+        "--log-format", choices=metrics.LOG_FORMATS, default=None,
+        help="Format of the stderr log, which has one trace line per tool call with stage timings and child "
+             "process CPU/memory (env: MCP_PANDOC_LOG_FORMAT, default: text)"
+    )
+    parser.add_argument(
+        "--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), type=str.upper, default=None,
+        help="Minimum level of logged messages; WARNING hides the per-call traces "
+             "(env: MCP_PANDOC_LOG_LEVEL, default: INFO)"
+    )
+    parser.add_argument(
+        "--probe-file", default=None,
+        help="File caching pandoc's path, version, formats and the installed PDF engines between starts; "
+             "an empty value disables it (env: MCP_PANDOC_PROBE_FILE, default: ~/.cache/mcp-pandoc/pandoc-probe.json)"
+    )
+    parser.add_argument(
+        "--warmup", action="store_true", default=None,
+        help="Probe pandoc and run a trivial conversion in the background at startup (env: MCP_PANDOC_WARMUP)"
+    )
+    return parser.parse_args(argv)
 
 
 def main():
     """Run the mcp-pandoc server."""
+    args = parse_args()
+    metrics.configure(log_format=args.log_format, log_level=args.log_level)
+    capabilities.configure(probe_file=args.probe_file)
+    limits.configure(timeout=args.timeout, max_cpu_seconds=args.max_cpu_seconds, max_memory_mib=args.max_memory_mib)
+    pool.configure(max_workers=args.workers, executor=args.executor, max_queue=args.max_queue)
+    driver.configure(driver=args.driver)
+    cache.configure(directory=args.cache_dir, max_bytes=args.cache_max_bytes)
+    assets.configure(directory=args.asset_dir, max_bytes=args.asset_max_bytes)
+    chapters.configure(max_bytes=args.chapter_cache_bytes)
+    flights.configure(enabled=args.coalesce)
+    filters.configure(mode=args.filter_mode)
+    pandoc_server.configure(backend=args.backend, workers=args.server_workers)
+    latex_format.configure(directory=args.latex_format_dir)
+    pdf_engines.configure(default=args.pdf_engine)
+    results.configure(page_chars=args.result_page_chars, max_embed_bytes=args.max_embed_bytes)
+    jobs.configure(database=args.job_db, ttl_seconds=args.job_ttl)
+    # The MCP stack is the bulk of the import time, so it is loaded only once the options are valid
+    from . import server
+    if args.warmup or os.environ.get("MCP_PANDOC_WARMUP", "").lower() in ("1", "true", "yes"):
+        threading.Thread(target=server.warmup, name="mcp-pandoc-warmup", daemon=True).start()
     asyncio.run(server.main())
 
+
+def __getattr__(name):
+    # ``mcp_pandoc.server`` is imported on first access rather than with the package
+    if name == "server":
+        return importlib.import_module(".server", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # Optionally expose other important items at package level
 __all__ = ['main', 'server']
@@ -0,0 +1,61 @@
+"""The server's side of the rendered-asset cache that diagram filters share.
+
+The cache itself lives in the standalone ``mcp_pandoc_assets`` package, which
+filters import without loading the server. This module configures it for the
+server process and tells filters where it is: every filter the server or
+pandoc runs gets the directory as ``MCP_PANDOC_ASSET_DIR`` in its own
+environment (see ``filter_variables``). The server never writes the variable
+into its own environment.
+
+The cache is off unless a directory is configured, like the result cache.
+"""
+import os
+
+from mcp_pandoc_assets import ASSET_DIR_ENV, ASSET_MAX_BYTES_ENV, DEFAULT_MAX_BYTES, AssetCache
+
+__all__ = [
+    "ASSET_DIR_ENV",
+    "ASSET_MAX_BYTES_ENV",
+    "DEFAULT_MAX_BYTES",
+    "AssetCache",
+    "configure",
+    "filter_variables",
+    "get_assets",
+]
+
+_assets: AssetCache | None = None
+_configured = False
+
+
+def configure(directory: str | None = None, max_bytes: int | None = None) -> AssetCache | None:
+    """(Re)create the process-wide asset cache.
+
+    The cache is disabled unless a directory is given here or through
+    ``MCP_PANDOC_ASSET_DIR``; ``max_bytes`` falls back to
+    ``MCP_PANDOC_ASSET_MAX_BYTES``.
+    """
+    global _assets, _configured
+    _configured = True
+    directory = directory or os.environ.get(ASSET_DIR_ENV)
+    if not directory:
+        _assets = None
+        return None
+    if max_bytes is None:
+        max_bytes = int(os.environ.get(ASSET_MAX_BYTES_ENV) or DEFAULT_MAX_BYTES)
+    _assets = AssetCache(directory, max_bytes)
+    return _assets
+
+
+def get_assets() -> AssetCache | None:
+    """Return the process-wide asset cache, or None when it is disabled."""
+    if not _configured:
+        configure()
+    return _assets
+
+
+def filter_variables() -> dict[str, str]:
+    """Return the environment variables that point filters at the asset cache ({} when it is disabled)."""
+    assets = get_assets()
+    if assets is None:
+        return {}
+    return {ASSET_DIR_ENV: assets.directory, ASSET_MAX_BYTES_ENV: str(assets.max_bytes)}
@@ -0,0 +1,278 @@
+"""Content-addressed on-disk cache for conversion results.
+
+Entries are keyed by a hash of everything that influences pandoc's output: the
+input bytes, formats, extra arguments and the content of every referenced file
+(defaults file, reference document, filters). Writes are atomic renames and
+eviction runs under an advisory lock, so several server processes can share one
+cache directory.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+_ENTRY_SUFFIX = ".bin"
+# Digests of referenced and input files kept in memory; the least recently used are dropped beyond this
+MAX_DIGEST_MEMO = 4096
+
+_digest_memo: OrderedDict[tuple[str, int, int], str] = OrderedDict()
+_digest_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """Return the sha256 of a file, memoized on (path, mtime, size) for the ``MAX_DIGEST_MEMO`` most recent files."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _digest_lock:
+        digest = _digest_memo.get(memo_key)
+        if digest is not None:
+            _digest_memo.move_to_end(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        with _digest_lock:
+            _digest_memo[memo_key] = digest
+            while len(_digest_memo) > MAX_DIGEST_MEMO:
+                _digest_memo.popitem(last=False)
+    return digest
+
+
+def file_fingerprint(path: str) -> dict:
+    """Describe a referenced file by content hash and modification time."""
+    return {
+        "path": os.path.abspath(path),
+        "sha256": file_digest(path),
+        "mtime_ns": os.stat(path).st_mtime_ns,
+    }
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # Another file system, or hard links aren't permitted here
+        shutil.copyfile(source, destination)
+
+
+def unshare(path: str) -> None:
+    """Unlink ``path`` if it is a hard link, such as one ``ResultCache.copy_to`` made.
+
+    pandoc and the server overwrite output files in place, which would change
+    the cache entry a linked output shares its data with.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        if os.stat(path).st_nlink > 1:
+            os.unlink(path)
+
+
+class ResultCache:
+    """Size-bounded LRU cache of conversion outputs stored as files.
+
+    The inode change time of an entry doubles as its last-access time, so the
+    LRU order survives restarts and is shared between processes. Hits bump it
+    without touching the modification time, which outputs hard-linked to the
+    entry share.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """Create a cache rooted at ``directory`` holding at most ``max_bytes``."""
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_path = os.path.join(self.directory, ".lock")
+        self._approx_bytes: int | None = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        """Hash the given key parts into a stable cache key."""
+        payload = json.dumps({"v": CACHE_VERSION, **parts}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + _ENTRY_SUFFIX)
+
+    def _touch(self, path: str) -> None:
+        # Setting the times to their current values still updates the change time
+        with contextlib.suppress(OSError):
+            st = os.stat(path)
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def get_bytes(self, key: str) -> bytes | None:
+        """Return the cached bytes for ``key``, or None on a miss."""
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self._touch(path)
+        self.hits += 1
+        return data
+
+    def get_text(self, key: str) -> str | None:
+        """Return the cached text for ``key``, or None on a miss."""
+        data = self.get_bytes(key)
+        return None if data is None else data.decode("utf-8")
+
+    def copy_to(self, key: str, destination: str) -> bool:
+        """Hard-link (or copy) the cached output for ``key`` to ``destination``; return False on a miss.
+
+        Linking costs no I/O however large the output is. Across file systems,
+        or where links aren't allowed, the entry is copied instead. Call
+        ``unshare`` before writing to a destination in place.
+        """
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return False
+        dest_dir = os.path.dirname(os.path.abspath(destination))
+        os.makedirs(dest_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=".mcp-pandoc-")
+        os.close(fd)
+        os.unlink(tmp_path)
+        try:
+            _link_or_copy(path, tmp_path)
+            os.replace(tmp_path, destination)
+        except FileNotFoundError:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            self.misses += 1
+            return False
+        self._touch(path)
+        self.hits += 1
+        return True
+
+    def put_text(self, key: str, text: str) -> None:
+        """Store converted text under ``key``."""
+        self.put_bytes(key, text.encode("utf-8"))
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        """Store converted bytes under ``key``."""
+        self._write(key, lambda f: f.write(data))
+
+    def put_file(self, key: str, source: str) -> None:
+        """Store the contents of ``source`` under ``key``."""
+        def copy(f):
+            with open(source, "rb") as src:
+                shutil.copyfileobj(src, f)
+        self._write(key, copy)
+
+    def _write(self, key: str, writer) -> None:
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer(f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        self.stores += 1
+        if self._approx_bytes is not None:
+            self._approx_bytes += size
+        # Other processes write to the same directory, so rescan periodically as well as when over budget
+        if self._approx_bytes is None or self._approx_bytes > self.max_bytes or self.stores % 100 == 0:
+            self.evict()
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        with open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(_ENTRY_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_ctime, st.st_size, path))
+        return entries
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits in ``max_bytes``."""
+        with self._exclusive():
+            entries = self._entries()
+            total = sum(size for _ctime, size, _path in entries)
+            for _ctime, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                    self.evictions += 1
+                total -= size
+            self._approx_bytes = total
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and cache configuration."""
+        return {
+            "directory": self.directory,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+_cache: ResultCache | None = None
+_configured = False
+
+
+def configure(directory: str | None = None, max_bytes: int | None = None) -> ResultCache | None:
+    """(Re)create the process-wide cache.
+
+    The cache is disabled unless a directory is given here or through
+    ``MCP_PANDOC_CACHE_DIR``; ``MCP_PANDOC_CACHE_MAX_BYTES`` bounds its size.
+    """
+    global _cache, _configured
+    _configured = True
+    directory = directory or os.environ.get("MCP_PANDOC_CACHE_DIR")
+    if not directory:
+        _cache = None
+        return None
+    if max_bytes is None:
+        max_bytes = int(os.environ.get("MCP_PANDOC_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+    _cache = ResultCache(directory, max_bytes)
+    return _cache
+
+
+def get_cache() -> ResultCache | None:
+    """Return the process-wide cache, or None when caching is disabled."""
+    if not _configured:
+        configure()
+    return _cache
@@ -0,0 +1,156 @@
+"""Pandoc capability probe, cached on disk across server starts.
+
+MCP clients start a server per session, so everything the first conversion
+has to discover is user-visible latency. pypandoc finds pandoc by running
+every candidate binary with ``--version``; the server then also needs the
+version (for result cache keys and filters), the supported formats and the
+installed PDF engines. This module finds all of it once and stores it in a
+small JSON file keyed by the path, mtime and size of each candidate binary,
+so later starts only ``stat`` the binaries and read the file.
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from dataclasses import asdict, dataclass
+
+PROBE_VERSION = 1
+# Executables pandoc can hand a PDF build to (kept in sync with pdf_engines.ENGINES)
+PDF_ENGINE_EXECUTABLES = ("xelatex", "lualatex", "pdflatex", "wkhtmltopdf", "weasyprint", "typst")
+
+
+@dataclass
+class PandocCapabilities:
+    """What the pandoc binary the server runs can do."""
+
+    path: str
+    version: str
+    input_formats: list[str]
+    output_formats: list[str]
+    pdf_engines: list[str]
+
+
+def default_probe_file() -> str:
+    """Return the default probe cache file in the user's cache directory."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "mcp-pandoc", "pandoc-probe.json")
+
+
+def _candidates() -> list[str]:
+    """Return the binaries pypandoc would consider, in its search order, without importing pypandoc."""
+    if os.environ.get("PYPANDOC_PANDOC"):
+        return [os.environ["PYPANDOC_PANDOC"]]
+    candidates = [shutil.which("pandoc")]
+    spec = importlib.util.find_spec("pypandoc")
+    if spec and spec.origin:
+        candidates.append(os.path.join(os.path.dirname(os.path.realpath(spec.origin)), "files", "pandoc"))
+    home = os.path.expanduser("~")
+    if sys.platform.startswith("linux"):
+        candidates += [os.path.join(home, "bin", "pandoc"), os.path.join(home, ".bin", "pandoc")]
+    elif sys.platform == "darwin":
+        candidates.append(os.path.join(home, "Applications", "pandoc", "pandoc"))
+    candidates.append(os.path.join(sys.exec_prefix, "bin", "pandoc"))
+    return [path for path in candidates if path]
+
+
+def probe_key() -> str:
+    """Fingerprint the candidate pandoc binaries and PDF engines on the PATH.
+
+    Costs a ``stat`` per candidate, so it is checked on every start; any
+    upgraded, added or removed binary changes it.
+    """
+    entries = []
+    for path in [*_candidates(), *(shutil.which(engine) for engine in PDF_ENGINE_EXECUTABLES)]:
+        if path:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append([os.path.realpath(path), st.st_mtime_ns, st.st_size])
+    return hashlib.sha256(json.dumps([PROBE_VERSION, entries]).encode()).hexdigest()
+
+
+def _list(path: str, option: str) -> list[str]:
+    process = subprocess.run([path, option], capture_output=True, text=True, check=True)  # noqa: S603 - pandoc binary
+    return process.stdout.split()
+
+
+def probe() -> PandocCapabilities:
+    """Run the full probe: locate pandoc through pypandoc, then ask it for its version and formats."""
+    import pypandoc
+
+    # pypandoc returns the bare name for a pandoc on the PATH; the probe file needs a path it can check
+    path = os.path.abspath(shutil.which(pypandoc.get_pandoc_path()) or pypandoc.get_pandoc_path())
+    return PandocCapabilities(
+        path=path,
+        version=pypandoc.get_pandoc_version(),
+        input_formats=_list(path, "--list-input-formats"),
+        output_formats=_list(path, "--list-output-formats"),
+        pdf_engines=[engine for engine in PDF_ENGINE_EXECUTABLES if shutil.which(engine)],
+    )
+
+
+def _read_probe_file(probe_file: str, key: str) -> PandocCapabilities | None:
+    try:
+        with open(probe_file, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") != key or not os.path.exists(cached["capabilities"]["path"]):
+            return None
+        return PandocCapabilities(**cached["capabilities"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_probe_file(probe_file: str, key: str, capabilities: PandocCapabilities) -> None:
+    try:
+        os.makedirs(os.path.dirname(probe_file), exist_ok=True)
+        tmp_path = f"{probe_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "capabilities": asdict(capabilities)}, f)
+        os.replace(tmp_path, probe_file)
+    except OSError:
+        # A read-only home only costs the probe on the next start
+        pass
+
+
+_capabilities: PandocCapabilities | None = None
+_probe_file: str | None = None
+_configured = False
+_lock = threading.Lock()
+
+
+def configure(probe_file: str | None = None) -> str | None:
+    """Set the probe cache file (falls back to ``MCP_PANDOC_PROBE_FILE``; an empty value disables the file).
+
+    Returns the file in use, or None when the probe is not cached on disk.
+    """
+    global _probe_file, _configured, _capabilities
+    if probe_file is None:
+        probe_file = os.environ.get("MCP_PANDOC_PROBE_FILE", default_probe_file())
+    _probe_file = os.path.abspath(os.path.expanduser(probe_file)) if probe_file else None
+    _configured = True
+    _capabilities = None
+    return _probe_file
+
+
+def get_capabilities() -> PandocCapabilities:
+    """Return the pandoc capabilities, probing at most once per process and once per binary change."""
+    global _capabilities
+    if _capabilities is not None:
+        return _capabilities
+    with _lock:
+        if _capabilities is None:
+            if not _configured:
+                configure()
+            key = probe_key() if _probe_file else None
+            capabilities = _read_probe_file(_probe_file, key) if _probe_file else None
+            if capabilities is None:
+                capabilities = probe()
+                if _probe_file:
+                    _write_probe_file(_probe_file, key, capabilities)
+            _capabilities = capabilities
+    return _capabilities
@@ -0,0 +1,114 @@
+"""Book builds: one output from an ordered list of chapter files.
+
+With ``input_files`` every chapter is parsed into a pandoc JSON AST on its
+own, and the chapter ASTs are merged (see ``sections.merge_asts``) before
+the filters and the writer run once on the whole book. The parsed ASTs are
+cached by chapter content, so rebuilding a book after editing one chapter
+parses only that chapter again.
+
+Parsing chapters separately differs from pandoc's own multi-file input,
+which concatenates the sources before parsing, in two ways. Markdown
+reference links and footnotes must be defined in the chapter that uses
+them. The book's metadata (title, author, ...) comes from the first
+chapter.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+MAX_CHAPTERS = 1000
+
+
+def chapter_key(data: bytes, input_format: str, reader_args: list[str], defaults_sha256: str | None,
+                pandoc_version: str) -> str:
+    """Hash everything that determines a chapter's parsed AST."""
+    payload = json.dumps({
+        "content": hashlib.sha256(data).hexdigest(),
+        "input_format": input_format,
+        "reader_args": reader_args,
+        "defaults": defaults_sha256,
+        "pandoc_version": pandoc_version,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ChapterCache:
+    """In-memory LRU cache of parsed chapter ASTs, bounded by their total size."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        """Create an empty cache holding at most ``max_bytes`` of AST JSON."""
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> str | None:
+        """Return the cached AST for ``key``, or None on a miss."""
+        with self._lock:
+            ast_json = self._entries.get(key)
+            if ast_json is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return ast_json
+
+    def put(self, key: str, ast_json: str) -> None:
+        """Store a parsed AST, evicting the least recently used ones to stay within ``max_bytes``."""
+        if len(ast_json) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = ast_json
+            self._bytes += len(ast_json)
+            while self._bytes > self.max_bytes:
+                _key, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the cache's size."""
+        with self._lock:
+            return {
+                "chapters": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_cache: ChapterCache | None = None
+_configured = False
+
+
+def configure(max_bytes: int | None = None) -> ChapterCache | None:
+    """(Re)create the chapter AST cache.
+
+    ``max_bytes`` falls back to ``MCP_PANDOC_CHAPTER_CACHE_BYTES``; ``0``
+    disables the cache.
+    """
+    global _cache, _configured
+    if max_bytes is None:
+        max_bytes = int(os.environ.get("MCP_PANDOC_CHAPTER_CACHE_BYTES", DEFAULT_MAX_BYTES))
+    if max_bytes < 0:
+        raise ValueError(f"max_bytes must not be negative, got: {max_bytes}")
+    _configured = True
+    _cache = ChapterCache(max_bytes) if max_bytes else None
+    return _cache
+
+
+def get_chapter_cache() -> ChapterCache | None:
+    """Return the chapter AST cache, or None when it is disabled."""
+    if not _configured:
+        configure()
+    return _cache
@@ -0,0 +1,182 @@
+"""Incremental conversion of a directory tree, driven by a change manifest.
+
+``convert-directory`` mirrors every matching file of an input tree into an
+output tree. The output directory holds a manifest recording, for each
+input, the hash of its content, a hash of the conversion options and the
+modification time of its output. A rebuild reconverts only the inputs
+that are new or changed, converted with other options, or whose output was
+modified or removed. It deletes the outputs of inputs that no longer
+exist.
+
+An unchanged file costs two ``stat`` calls: its content is only hashed
+when its size or modification time differs from the manifest. That way a
+file that was merely touched is not reconverted.
+"""
+import contextlib
+import fnmatch
+import json
+import os
+from dataclasses import dataclass, field
+
+from .cache import file_digest
+
+MANIFEST_NAME = ".mcp-pandoc-manifest.json"
+MANIFEST_VERSION = 1
+# Files matched when no include patterns are given, by input format
+INPUT_PATTERNS = {
+    "markdown": ["*.md", "*.markdown"],
+    "html": ["*.html", "*.htm"],
+    "rst": ["*.rst"],
+    "latex": ["*.tex"],
+    "docx": ["*.docx"],
+    "odt": ["*.odt"],
+    "epub": ["*.epub"],
+    "ipynb": ["*.ipynb"],
+    "txt": ["*.txt"],
+}
+
+
+def find_inputs(input_dir: str, include: list[str], exclude: list[str], skip_dir: str | None = None) -> list[str]:
+    """Return the paths under ``input_dir`` (relative, with ``/``) that match ``include`` and not ``exclude``.
+
+    Patterns are ``fnmatch`` globs matched against the relative path, where
+    ``*`` also matches ``/`` (``*.md`` matches ``guide/intro.md``). Hidden files
+    and directories, and ``skip_dir`` (an output tree inside the input tree),
+    are not searched.
+    """
+    skip_dir = os.path.abspath(skip_dir) if skip_dir else None
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(
+            name for name in dirs
+            if not name.startswith(".") and os.path.abspath(os.path.join(root, name)) != skip_dir
+        )
+        relative_root = os.path.relpath(root, input_dir)
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            relative = name if relative_root == "." else f"{relative_root}/{name}".replace(os.sep, "/")
+            if any(fnmatch.fnmatchcase(relative, pattern) for pattern in include) and not any(
+                fnmatch.fnmatchcase(relative, pattern) for pattern in exclude
+            ):
+                found.append(relative)
+    return found
+
+
+def output_path_for(relative: str, extension: str) -> str:
+    """Return the output path (relative, with ``/``) mirroring input ``relative``."""
+    return f"{os.path.splitext(relative)[0]}.{extension}"
+
+
+@dataclass
+class BuildPlan:
+    """What a rebuild has to do."""
+
+    convert: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    # Inputs recorded in the manifest that were removed or no longer match the patterns
+    stale: list[str] = field(default_factory=list)
+    # The content hash and stat of each input to convert, taken before converting it
+    fingerprints: dict[str, dict] = field(default_factory=dict)
+
+
+class Manifest:
+    """The record of a previous build of an output tree."""
+
+    def __init__(self, input_dir: str, output_dir: str):
+        """Load the manifest of ``output_dir``; a missing or unreadable one means nothing was built yet."""
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.path = os.path.join(self.output_dir, MANIFEST_NAME)
+        self.files: dict[str, dict] = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("version") == MANIFEST_VERSION and saved.get("input_dir") == self.input_dir:
+                self.files = saved["files"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _fingerprint(self, relative: str, st: os.stat_result) -> dict:
+        return {
+            "input_sha256": file_digest(os.path.join(self.input_dir, relative)),
+            "input_mtime_ns": st.st_mtime_ns,
+            "input_size": st.st_size,
+        }
+
+    def plan(self, inputs: list[str], options: str, extension: str, force: bool = False) -> BuildPlan:
+        """Decide which of ``inputs`` need converting with the options hashed as ``options``."""
+        plan = BuildPlan(stale=sorted(set(self.files) - set(inputs)))
+        for relative in inputs:
+            st = os.stat(os.path.join(self.input_dir, relative))
+            entry = self.files.get(relative)
+            output = output_path_for(relative, extension)
+            if not force and entry and entry["options"] == options and entry["output"] == output:
+                try:
+                    output_mtime_ns = os.stat(os.path.join(self.output_dir, output)).st_mtime_ns
+                except FileNotFoundError:
+                    output_mtime_ns = None
+                if output_mtime_ns == entry["output_mtime_ns"]:
+                    if (st.st_mtime_ns, st.st_size) == (entry["input_mtime_ns"], entry["input_size"]):
+                        plan.skipped.append(relative)
+                        continue
+                    fingerprint = self._fingerprint(relative, st)
+                    if fingerprint["input_sha256"] == entry["input_sha256"]:
+                        # Touched but unchanged: remember the new stat so the next build skips the hash
+                        entry.update(fingerprint)
+                        plan.skipped.append(relative)
+                        continue
+                    plan.fingerprints[relative] = fingerprint
+            plan.convert.append(relative)
+            plan.fingerprints.setdefault(relative, self._fingerprint(relative, st))
+        return plan
+
+    def converted(self, relative: str, fingerprint: dict, options: str, extension: str) -> None:
+        """Record a successful conversion of ``relative``.
+
+        If the output path changed (a different output format), the old output
+        is deleted.
+        """
+        output = output_path_for(relative, extension)
+        previous = self.files.get(relative)
+        if previous and previous["output"] != output:
+            self._delete_output(previous["output"])
+        self.files[relative] = {
+            **fingerprint,
+            "options": options,
+            "output": output,
+            "output_mtime_ns": os.stat(os.path.join(self.output_dir, output)).st_mtime_ns,
+        }
+
+    def failed(self, relative: str) -> None:
+        """Forget ``relative`` so the next build retries it."""
+        self.files.pop(relative, None)
+
+    def remove(self, relative: str) -> bool:
+        """Delete the output of a stale input and forget it; returns True if a file was deleted."""
+        entry = self.files.pop(relative, None)
+        return bool(entry) and self._delete_output(entry["output"])
+
+    def _delete_output(self, output: str) -> bool:
+        path = os.path.join(self.output_dir, output)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return False
+        # Drop directories the deletion left empty, up to the output root
+        parent = os.path.dirname(path)
+        while parent != self.output_dir and parent.startswith(self.output_dir + os.sep):
+            with contextlib.suppress(OSError):
+                os.rmdir(parent)
+            if os.path.exists(parent):
+                break
+            parent = os.path.dirname(parent)
+        return True
+
+    def save(self) -> None:
+        """Write the manifest atomically."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "input_dir": self.input_dir, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
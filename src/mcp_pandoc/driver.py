@@ -0,0 +1,226 @@
+"""Pandoc drivers: how the server starts pandoc and reports its failures.
+
+Every conversion step talks to the probed pandoc binary directly, passing the
+input on stdin and reading the output from stdout as bytes. Three drivers are
+available for the conversions the server runs itself:
+
+* ``blocking`` (default) runs pandoc from a worker of the conversion pool and
+  waits for it there; traces report the CPU time and peak RSS of every pandoc
+  process.
+* ``asyncio`` starts pandoc with ``asyncio.create_subprocess_exec`` and waits
+  for it on the event loop, so a running conversion holds a pool slot but no
+  worker thread or process. asyncio reaps the process itself, so traces count
+  the process without its CPU time and peak RSS.
+* ``pypandoc`` converts with ``pypandoc.convert_text``/``convert_file`` from a
+  pool worker, the way the server did before it drove pandoc itself. It is
+  kept as the reference the other drivers are benchmarked against. pypandoc
+  reaps pandoc itself, so the trace gets the process-wide growth of the
+  children's CPU time, which is only exact when no other conversion finishes
+  meanwhile. Its pandoc does not run in a process group of its own, so a
+  timeout or cancellation cannot kill it and the CPU and memory caps do not
+  apply. Its filters only find the asset cache when ``MCP_PANDOC_ASSET_DIR``
+  is set in the server's own environment. Embedded (bytes) outputs, which
+  pypandoc cannot return, use the blocking driver.
+
+Steps that run Python code between pandoc calls (in-process filters, sectioned
+parsing, LaTeX format builds) always run on the pool with the blocking driver.
+
+Pandoc's exit code is kept on ``PandocError`` so that failures can be
+categorized without parsing its stderr.
+"""
+import asyncio
+import os
+import re
+import resource
+from types import SimpleNamespace
+
+from .assets import filter_variables
+from .capabilities import get_capabilities
+from .limits import current_scope, kill_group, limited_command, spawn_options
+from .metrics import current_trace, run_process
+
+DRIVERS = ("blocking", "asyncio", "pypandoc")
+
+# Exit codes from pandoc's manual (section "Exit codes")
+EXIT_CODES = {
+    1: "PandocIOError",
+    3: "PandocFailOnWarningError",
+    4: "PandocAppError",
+    5: "PandocTemplateError",
+    6: "PandocOptionError",
+    21: "PandocUnknownReaderError",
+    22: "PandocUnknownWriterError",
+    23: "PandocUnsupportedExtensionError",
+    24: "PandocCiteprocError",
+    25: "PandocBibliographyError",
+    31: "PandocEpubSubdirectoryError",
+    43: "PandocPDFError",
+    44: "PandocXMLError",
+    47: "PandocPDFProgramNotFoundError",
+    61: "PandocHttpError",
+    62: "PandocShouldNeverHappenError",
+    63: "PandocSomeError",
+    64: "PandocParseError",
+    66: "PandocMakePDFError",
+    67: "PandocSyntaxMapError",
+    83: "PandocFilterError",
+    84: "PandocLuaError",
+    89: "PandocNoScriptingEngine",
+    91: "PandocMacroLoop",
+    92: "PandocUTF8DecodingError",
+    93: "PandocIpynbDecodingError",
+    94: "PandocUnsupportedCharsetError",
+    97: "PandocCouldNotFindDataFileError",
+    98: "PandocCouldNotFindMetadataFileError",
+    99: "PandocResourceNotFound",
+}
+FILTER_EXIT_CODES = {83, 84}
+FORMAT_EXIT_CODES = {21, 22, 23}
+
+
+class PandocError(RuntimeError):
+    """Pandoc exited with a non-zero status.
+
+    The message keeps the wording pypandoc used, so existing callers and
+    clients see the same errors whichever driver ran pandoc.
+    """
+
+    def __init__(self, returncode: int, stderr: str):
+        """Record pandoc's exit code and stderr."""
+        super().__init__(returncode, stderr)
+        self.returncode = returncode
+        self.stderr = stderr
+
+    @property
+    def name(self) -> str:
+        """Pandoc's name for the error, e.g. ``PandocFilterError``."""
+        return EXIT_CODES.get(self.returncode, "PandocError")
+
+    def __str__(self) -> str:
+        """Format the error like pypandoc."""
+        return f'Pandoc died with exitcode "{self.returncode}" during conversion: {self.stderr}'
+
+
+def child_env(output_dir: str | None = None) -> dict[str, str] | None:
+    """Return the environment for pandoc and the filters it runs, or None when it can inherit the server's.
+
+    Filters get the asset cache and, when pandoc writes a file,
+    ``PANDOC_OUTPUT_DIR``.
+    """
+    variables = filter_variables()
+    if output_dir:
+        variables["PANDOC_OUTPUT_DIR"] = output_dir
+    if all(os.environ.get(name) == value for name, value in variables.items()):
+        return None
+    return {**os.environ, **variables}
+
+
+def run_pandoc(args: list[str], input: bytes | None = None, output_dir: str | None = None) -> bytes:
+    """Run pandoc with ``args`` in the calling thread and return its stdout; raises PandocError on failure.
+
+    ``output_dir`` is passed to the filters pandoc runs as ``PANDOC_OUTPUT_DIR``.
+    """
+    process = run_process([get_capabilities().path, *args], input=input, env=child_env(output_dir))
+    scope = current_scope()
+    if scope is not None:
+        scope.check_pandoc_exit(process.returncode)
+    if process.returncode != 0:
+        raise PandocError(process.returncode, process.stderr.decode("utf-8", errors="replace").strip())
+    return process.stdout
+
+
+async def run_pandoc_async(args: list[str], input: bytes | None = None, output_dir: str | None = None) -> bytes:
+    """Run pandoc with ``args`` on the event loop and return its stdout; raises PandocError on failure.
+
+    Pandoc runs in its own process group under the current conversion's
+    limits; the group is killed if the awaiting task is cancelled.
+    ``output_dir`` is passed to the filters pandoc runs as ``PANDOC_OUTPUT_DIR``.
+    """
+    scope = current_scope()
+    if scope is not None:
+        scope.check()
+    process = await asyncio.create_subprocess_exec(
+        *limited_command([get_capabilities().path, *args]),
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=child_env(output_dir),
+        **spawn_options(),
+    )
+    if scope is not None:
+        scope.started(process.pid)
+    try:
+        stdout, stderr = await process.communicate(input)
+    except BaseException:
+        if process.returncode is None:
+            kill_group(process.pid)
+            await process.wait()
+        raise
+    finally:
+        if scope is not None:
+            scope.finished(process.pid)
+    current = current_trace()
+    if current is not None:
+        current.add_child()
+    if scope is not None:
+        scope.check_pandoc_exit(process.returncode)
+    if process.returncode != 0:
+        raise PandocError(process.returncode, stderr.decode("utf-8", errors="replace").strip())
+    return stdout
+
+
+def run_pypandoc(contents: str | None, input_file: str | None, input_format: str, output_format: str,
+                 output_file: str | None, extra_args: list[str]) -> str:
+    """Run one blocking conversion through pypandoc; returns the output text, or "" when writing to ``output_file``.
+
+    Failures are raised as PandocError with pypandoc's exit code and message.
+    Kept at module level so it can be shipped to a process pool worker.
+    """
+    import pypandoc
+
+    scope = current_scope()
+    if scope is not None:
+        scope.check()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        if input_file:
+            output = pypandoc.convert_file(input_file, output_format, outputfile=output_file, extra_args=extra_args)
+        else:
+            output = pypandoc.convert_text(contents, output_format, format=input_format, outputfile=output_file,
+                                           extra_args=extra_args)
+    except RuntimeError as e:
+        match = re.match(r'Pandoc died with exitcode "(-?\d+)" during conversion: (.*)', str(e), re.DOTALL)
+        if match is None:
+            raise
+        returncode = int(match.group(1))
+        if scope is not None:
+            scope.check_pandoc_exit(returncode)
+        raise PandocError(returncode, match.group(2).strip()) from e
+    finally:
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        current = current_trace()
+        if current is not None:
+            # RUSAGE_CHILDREN only keeps the largest child's peak RSS, so it is known only when it grew
+            current.add_child(SimpleNamespace(
+                ru_utime=after.ru_utime - before.ru_utime, ru_stime=after.ru_stime - before.ru_stime,
+                ru_maxrss=after.ru_maxrss if after.ru_maxrss > before.ru_maxrss else 0,
+            ))
+    return "" if output_file else output
+
+
+_driver: str | None = None
+
+
+def configure(driver: str | None = None) -> str:
+    """Set the pandoc driver (falls back to ``MCP_PANDOC_DRIVER``, default: blocking)."""
+    global _driver
+    driver = driver or os.environ.get("MCP_PANDOC_DRIVER", "blocking")
+    if driver not in DRIVERS:
+        raise ValueError(f"Unsupported driver: '{driver}'. Supported drivers are: {', '.join(DRIVERS)}")
+    _driver = driver
+    return _driver
+
+
+def get_driver() -> str:
+    """Return the configured pandoc driver."""
+    if _driver is None:
+        return configure()
+    return _driver
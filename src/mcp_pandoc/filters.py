@@ -0,0 +1,437 @@
+"""In-process execution of panflute/pandocfilters Python filters.
+
+Pandoc runs every ``--filter`` as a separate process and pipes the whole JSON
+AST through it. In ``inprocess`` mode the server instead parses the input to
+the JSON AST once, imports each Python filter module once (re-imported when the
+file changes) and runs the filter chain on a shared AST before handing it back
+to pandoc for writing.
+
+Filters are driven through their usual entry points (``main()`` calling
+``panflute.run_filter``/``toJSONFilter`` or ``pandocfilters.toJSONFilter``):
+while a filter runs, panflute's ``load``/``dump`` and pandocfilters'
+``toJSONFilters`` are swapped for versions that read and write the in-memory
+AST. Anything else (Lua filters, other executables, Python filters that don't
+use either library) falls back to a subprocess, exactly as pandoc would run it.
+
+Filters see the variables pandoc sets for them (``PANDOC_VERSION``,
+``PANDOC_READER_OPTIONS``, ``PANDOC_OUTPUT_DIR``) and the asset cache's.
+In-process filters read them through ``os.environ``, which is replaced by a
+view that adds them only in the context running the filter; the process
+environment itself never changes, so subprocesses started by other
+conversions don't inherit them.
+"""
+import atexit
+import contextlib
+import contextvars
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections.abc import Iterator, MutableMapping
+from types import SimpleNamespace
+
+from .assets import filter_variables
+from .capabilities import get_capabilities
+from .driver import PandocError, run_pandoc
+from .metrics import logger, run_process, stage
+
+FILTER_MODES = ("subprocess", "inprocess")
+
+_libraries: SimpleNamespace | None = None
+
+# Filter modules share interpreter-wide state (sys.argv, sys.stdin, patched entry points),
+# so in-process filters run one at a time.
+_filter_lock = threading.RLock()
+_module_cache: dict[str, tuple[int, object | None]] = {}
+
+
+def filter_libraries() -> SimpleNamespace:
+    """Import panflute and pandocfilters on first use, remembering their unpatched entry points.
+
+    Only in-process filters need them, and importing them is a noticeable
+    share of the server's start time.
+    """
+    global _libraries
+    if _libraries is None:
+        import pandocfilters
+        import panflute
+        import panflute.io
+
+        _libraries = SimpleNamespace(
+            panflute=panflute,
+            pandocfilters=pandocfilters,
+            load=panflute.io.load,
+            dump=panflute.io.dump,
+            to_json_filters=pandocfilters.toJSONFilters,
+        )
+    return _libraries
+
+
+_filter_variables: contextvars.ContextVar[dict[str, str] | None] = contextvars.ContextVar(
+    "mcp_pandoc_filter_variables", default=None
+)
+
+
+class _FilterEnviron(MutableMapping):
+    """``os.environ`` plus the variables of the in-process filter running in the current context."""
+
+    def __init__(self, environ):
+        self.environ = environ
+
+    def __getitem__(self, key):
+        variables = _filter_variables.get()
+        if variables is not None and key in variables:
+            return variables[key]
+        return self.environ[key]
+
+    def __setitem__(self, key, value):
+        self.environ[key] = value
+
+    def __delitem__(self, key):
+        del self.environ[key]
+
+    def __iter__(self) -> Iterator[str]:
+        variables = _filter_variables.get() or {}
+        yield from variables
+        yield from (key for key in self.environ if key not in variables)
+
+    def __len__(self) -> int:
+        return sum(1 for _key in self)
+
+    def copy(self) -> dict:
+        return dict(self)
+
+
+@contextlib.contextmanager
+def _filter_environment(variables: dict[str, str]):
+    if not isinstance(os.environ, _FilterEnviron):
+        os.environ = _FilterEnviron(os.environ)  # noqa: B003 - a view over the same environment
+    token = _filter_variables.set(variables)
+    try:
+        yield
+    finally:
+        _filter_variables.reset(token)
+
+
+_reader_options: dict[tuple[str, tuple[str, ...]], str | None] = {}
+_probe_path: str | None = None
+# Swaps the AST for one carrying PANDOC_READER_OPTIONS in its metadata
+_PROBE_SOURCE = """import json, os, sys
+doc = json.load(sys.stdin)
+options = os.environ.get("PANDOC_READER_OPTIONS", "")
+json.dump({**doc, "meta": {"reader_options": {"t": "MetaString", "c": options}}, "blocks": []}, sys.stdout)
+"""
+
+
+def _probe_filter() -> str:
+    global _probe_path
+    if _probe_path is None:
+        fd, path = tempfile.mkstemp(prefix="mcp-pandoc-reader-options-")
+        with os.fdopen(fd, "w") as f:
+            f.write(f"#!{sys.executable}\n{_PROBE_SOURCE}")
+        os.chmod(path, 0o700)
+        atexit.register(_remove_probe_filter, path)
+        _probe_path = path
+    return _probe_path
+
+
+def _remove_probe_filter(path: str) -> None:
+    with contextlib.suppress(OSError):
+        os.unlink(path)
+
+
+def probe_reader_options(input_format: str, reader_args: list[str]) -> str | None:
+    """Return the PANDOC_READER_OPTIONS pandoc gives filters reading ``input_format`` with ``reader_args``.
+
+    pandoc only shows them to filters, so a probe filter collects them from an
+    empty document, once per format and arguments. None if the probe fails.
+    """
+    key = (input_format, tuple(reader_args))
+    if key not in _reader_options:
+        try:
+            output = run_pandoc(
+                [f"--from={input_format}", *reader_args, "--to=json", "--filter", _probe_filter()], input=b""
+            )
+            _reader_options[key] = json.loads(output)["meta"]["reader_options"]["c"] or None
+        except (PandocError, OSError, ValueError, KeyError) as e:
+            logger.warning("Could not read pandoc's reader options for %s: %s", input_format, e)
+            _reader_options[key] = None
+    return _reader_options[key]
+
+
+class _NotInProcessError(Exception):
+    """Raised when a filter cannot be driven in-process and must run as a subprocess."""
+
+
+class _ChainState:
+    """The AST passed along the filter chain, converted lazily between representations."""
+
+    def __init__(self, ast_json: str, output_format: str, reader_options: str | None = None):
+        # JSON text, a decoded dict or a panflute.Doc
+        self.value = ast_json
+        self.output_format = output_format
+        self.reader_options = reader_options
+        self.loaded = False
+        self.dumped = False
+
+    def variables(self, output_dir: str | None) -> dict[str, str]:
+        """Return the environment variables filters run with."""
+        variables = {**filter_variables(), "PANDOC_VERSION": get_capabilities().version}
+        if self.reader_options:
+            variables["PANDOC_READER_OPTIONS"] = self.reader_options
+        if output_dir:
+            variables["PANDOC_OUTPUT_DIR"] = output_dir
+        return variables
+
+    def as_doc(self):
+        libraries = filter_libraries()
+        if not isinstance(self.value, libraries.panflute.Doc):
+            self.value = libraries.load(io.StringIO(self.as_json()))
+        self.value.format = self.output_format
+        return self.value
+
+    def as_dict(self) -> dict:
+        if not isinstance(self.value, dict):
+            self.value = json.loads(self.as_json())
+        return self.value
+
+    def as_json(self) -> str:
+        if isinstance(self.value, dict):
+            self.value = json.dumps(self.value, ensure_ascii=False)
+        elif not isinstance(self.value, str):
+            buffer = io.StringIO()
+            filter_libraries().dump(self.value, buffer)
+            self.value = buffer.getvalue()
+        return self.value
+
+    # Stand-ins for the library entry points while a filter runs
+
+    def load(self, input_stream=None):
+        self.loaded = True
+        return self.as_doc()
+
+    def dump(self, doc, output_stream=None):
+        self.value = doc
+        self.dumped = True
+
+    def to_json_filters(self, actions):
+        self.loaded = True
+        doc = self.as_dict()
+        meta = doc.get("meta", {})
+        altered = doc
+        for action in actions:
+            altered = filter_libraries().pandocfilters.walk(altered, action, self.output_format, meta)
+        self.value = altered
+        self.dumped = True
+
+
+class _ImportGuard:
+    """Entry points used while importing a filter: any attempt to run it at import time is refused."""
+
+    def load(self, input_stream=None):
+        raise _NotInProcessError("filter runs at import time")
+
+    dump = load
+    to_json_filters = load
+
+
+@contextlib.contextmanager
+def _patched_entry_points(state, argv: list[str]):
+    libraries = filter_libraries()
+    panflute, pandocfilters = libraries.panflute, libraries.pandocfilters
+    saved = (panflute.io.load, panflute.io.dump, pandocfilters.toJSONFilters, sys.stdin, sys.argv)
+    panflute.io.load = state.load
+    panflute.io.dump = state.dump
+    pandocfilters.toJSONFilters = state.to_json_filters
+    # Never let a filter read the server's stdin or write into its stdout
+    sys.stdin = io.StringIO("")
+    sys.argv = argv
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    finally:
+        panflute.io.load, panflute.io.dump, pandocfilters.toJSONFilters, sys.stdin, sys.argv = saved
+
+
+def is_python_filter(path: str) -> bool:
+    """Return True if ``path`` is a Python script (by extension or shebang)."""
+    if path.endswith(".py"):
+        return True
+    try:
+        with open(path, "rb") as f:
+            first_line = f.readline(200)
+    except OSError:
+        return False
+    return first_line.startswith(b"#!") and b"python" in first_line
+
+
+def _load_filter_module(path: str):
+    """Import a panflute/pandocfilters filter once per file version; None if it can't run in-process."""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _module_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    module = None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        source = f.read()
+    if is_python_filter(path) and ("panflute" in source or "pandocfilters" in source):
+        name = "_mcp_pandoc_filter_" + hashlib.sha256(path.encode("utf-8")).hexdigest()[:16]
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        try:
+            with _patched_entry_points(_ImportGuard(), [path]):
+                spec.loader.exec_module(module)
+        except Exception as e:
+            logger.warning("Filter %s cannot run in-process, using subprocess: %s", path, e)
+            module = None
+        if module is not None and not callable(getattr(module, "main", None)):
+            module = None
+
+    _module_cache[path] = (mtime, module)
+    return module
+
+
+def _run_in_process(module, path: str, state: _ChainState, output_dir: str | None) -> None:
+    state.loaded = state.dumped = False
+    module_globals = vars(module)
+    rebound = module_globals.get("toJSONFilters") is filter_libraries().to_json_filters
+    try:
+        if rebound:
+            module_globals["toJSONFilters"] = state.to_json_filters
+        with _filter_environment(state.variables(output_dir)), \
+                _patched_entry_points(state, [path, state.output_format]):
+            try:
+                module.main()
+            except SystemExit as e:
+                if e.code not in (None, 0):
+                    raise ValueError(f"Filter {path} exited with status {e.code}") from e
+            except Exception as e:
+                # A filter that fails before touching the AST (e.g. it reads stdin itself) runs as a subprocess
+                if not state.loaded:
+                    raise _NotInProcessError(str(e)) from e
+                raise
+    finally:
+        if rebound:
+            module_globals["toJSONFilters"] = filter_libraries().to_json_filters
+
+    if not state.dumped:
+        if state.loaded:
+            raise ValueError(f"Filter {path} did not return a document")
+        raise _NotInProcessError("filter did not call run_filter/toJSONFilter")
+
+
+def _run_subprocess_filter(path: str, state: _ChainState, output_dir: str | None) -> None:
+    if path.endswith(".lua"):
+        state.value = run_pandoc(
+            ["--from=json", "--to=json", "--lua-filter", path], input=state.as_json().encode("utf-8")
+        ).decode("utf-8")
+        return
+
+    # Run the filter the way pandoc does: target format as the first argument, AST on stdin
+    env = {**os.environ, **state.variables(output_dir)}
+    command = [path, state.output_format]
+    if path.endswith(".py") and not os.access(path, os.X_OK):
+        command.insert(0, sys.executable)
+    process = run_process(command, input=state.as_json().encode("utf-8"), env=env)
+    if process.returncode != 0:
+        stderr = process.stderr.decode("utf-8", errors="replace").strip()
+        raise ValueError(f"Filter {path} failed with exit code {process.returncode}: {stderr}")
+    state.value = process.stdout.decode("utf-8")
+
+
+def apply_filters(ast_json: str, filters: list[str], output_format: str, output_dir: str | None = None,
+                  in_process: bool = True, reader_options: str | None = None) -> str:
+    """Apply a chain of resolved filters to a pandoc JSON AST and return the new AST.
+
+    With ``in_process=False`` every filter runs as a subprocess, as pandoc would run it.
+    ``reader_options`` is the PANDOC_READER_OPTIONS the filters see (see ``probe_reader_options``).
+    """
+    state = _ChainState(ast_json, output_format, reader_options)
+    with stage("filters"):
+        _apply_chain(state, filters, output_dir, in_process)
+    return state.as_json()
+
+
+def _apply_chain(state: _ChainState, filters: list[str], output_dir: str | None, in_process: bool) -> None:
+    for path in filters:
+        if in_process and is_python_filter(path):
+            with _filter_lock:
+                module = _load_filter_module(path)
+                if module is not None:
+                    try:
+                        _run_in_process(module, path, state, output_dir)
+                        continue
+                    except _NotInProcessError:
+                        _module_cache[path] = (os.stat(path).st_mtime_ns, None)
+        _run_subprocess_filter(path, state, output_dir)
+
+
+def read_ast(contents: str | None, input_file: str | None, input_format: str, reader_args: list[str]) -> str:
+    """Parse the input into a pandoc JSON AST."""
+    # A trailing --to wins over anything a defaults file sets
+    with stage("read"):
+        if input_file:
+            return run_pandoc([*reader_args, "--to=json", input_file]).decode("utf-8")
+        return run_pandoc(
+            [f"--from={input_format}", *reader_args, "--to=json"], input=contents.encode("utf-8")
+        ).decode("utf-8")
+
+
+def write_ast(ast_json: str, output_format: str, output_file: str | None, writer_args: list[str]) -> str:
+    """Write a pandoc JSON AST to the target format (to ``output_file`` if given)."""
+    # A trailing --from wins over anything a defaults file sets
+    args = [f"--to={output_format}"]
+    if output_file:
+        args.append(f"--output={output_file}")
+    with stage("write"):
+        output = run_pandoc([*args, *writer_args, "--from=json"], input=ast_json.encode("utf-8"))
+    return "" if output_file else output.decode("utf-8", errors="replace")
+
+
+def read_ast_with_filters(contents: str | None, input_file: str | None, input_format: str, reader_args: list[str],
+                          filters: list[str], output_format: str, output_dir: str | None = None,
+                          in_process: bool = True) -> str:
+    """Parse the input into a JSON AST and run the filter chain on it."""
+    ast_json = read_ast(contents, input_file, input_format, reader_args)
+    if not filters:
+        return ast_json
+    options = probe_reader_options(input_format, reader_args)
+    return apply_filters(ast_json, filters, output_format, output_dir, in_process, options)
+
+
+def convert_with_filters(contents: str | None, input_file: str | None, input_format: str, output_format: str,
+                         output_file: str | None, reader_args: list[str], writer_args: list[str],
+                         filters: list[str], output_dir: str | None = None) -> str:
+    """Parse the input to a JSON AST once, run the filter chain in-process, then write the target format.
+
+    Kept at module level, like the other pipeline steps, so it can be shipped to a process pool worker.
+    """
+    ast_json = read_ast_with_filters(
+        contents, input_file, input_format, reader_args, filters, output_format, output_dir
+    )
+    return write_ast(ast_json, output_format, output_file, writer_args)
+
+
+_mode: str | None = None
+
+
+def configure(mode: str | None = None) -> str:
+    """Set the filter execution mode (falls back to ``MCP_PANDOC_FILTER_MODE``, default: subprocess)."""
+    global _mode
+    mode = mode or os.environ.get("MCP_PANDOC_FILTER_MODE", "subprocess")
+    if mode not in FILTER_MODES:
+        raise ValueError(f"Unsupported filter mode: '{mode}'. Supported modes are: {', '.join(FILTER_MODES)}")
+    _mode = mode
+    return _mode
+
+
+def get_mode() -> str:
+    """Return the configured filter execution mode."""
+    if _mode is None:
+        return configure()
+    return _mode
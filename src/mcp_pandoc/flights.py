@@ -0,0 +1,120 @@
+"""Single-flight coalescing of identical conversions running at the same time.
+
+Agents often start the same conversion several times at once, for example
+parallel tool calls that each turn one report into a PDF. The first call
+(the leader) starts the conversion in a task of its own. Identical calls
+that arrive while it runs attach to that task and share its outcome,
+including its failure. The server then gives each caller its own copy of
+the output.
+
+The shared task runs its processes in a process scope of its own. A caller
+that is cancelled or times out only stops waiting, and the conversion is
+killed when no caller is left waiting for it.
+"""
+import asyncio
+import os
+from collections.abc import Awaitable, Callable
+
+from .limits import ProcessKilledError, ProcessScope, detach_scope
+
+
+class Flight:
+    """One running conversion and the number of callers waiting for it."""
+
+    def __init__(self):
+        """Create a flight with no task and no waiters yet."""
+        self.task: asyncio.Task | None = None
+        self.scope: ProcessScope | None = None
+        self.waiters = 0
+
+    async def lead(self, produce: Callable[[], Awaitable]):
+        """Run ``produce()`` with the flight's own process scope."""
+        self.scope = detach_scope()
+        return await produce()
+
+    def abandon(self) -> None:
+        """Cancel the conversion and kill its processes."""
+        self.task.cancel()
+        if self.scope is not None:
+            self.scope.kill(ProcessKilledError("cancelled"))
+
+
+class Flights:
+    """The conversions in flight, by conversion key."""
+
+    def __init__(self):
+        """Create an empty table."""
+        self._flights: dict[str, Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, produce: Callable[[], Awaitable]) -> tuple[object, bool]:
+        """Return the outcome of ``produce()`` and whether it was shared from a flight already running for ``key``.
+
+        Only the leader calls ``produce``. Cancelling a caller only stops it
+        waiting. When the last waiter is cancelled, the conversion is
+        cancelled and its processes are killed.
+        """
+        flight = self._flights.get(key)
+        joined = flight is not None
+        if flight is None:
+            flight = self._flights[key] = Flight()
+            # The task copies the leader's context, so its stages count in the leader's trace
+            flight.task = asyncio.create_task(flight.lead(produce))
+            flight.task.add_done_callback(lambda task: self._landed(key, flight, task))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), joined
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Forget it first, so that a new identical call doesn't join a cancelled flight
+                self._forget(key, flight)
+                flight.abandon()
+
+    def _forget(self, key: str, flight: Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _landed(self, key: str, flight: Flight, task: asyncio.Task) -> None:
+        self._forget(key, flight)
+        if not task.cancelled():
+            # Mark the error as retrieved: every waiter re-raises it, and an abandoned flight has none
+            task.exception()
+
+    def stats(self) -> dict:
+        """Return the number of conversions in flight and how many calls shared one."""
+        return {
+            "in_flight": len(self._flights),
+            "waiters": sum(flight.waiters for flight in self._flights.values()),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+
+_flights: Flights | None = None
+_configured = False
+
+
+def configure(enabled: bool | None = None) -> Flights | None:
+    """(Re)create the table of conversions in flight.
+
+    ``enabled`` falls back to ``MCP_PANDOC_COALESCE`` (on unless ``0``,
+    ``false`` or ``no``).
+    """
+    global _flights, _configured
+    if enabled is None:
+        enabled = os.environ.get("MCP_PANDOC_COALESCE", "1").lower() not in ("0", "false", "no")
+    _configured = True
+    _flights = Flights() if enabled else None
+    return _flights
+
+
+def get_flights() -> Flights | None:
+    """Return the table of conversions in flight, or None when coalescing is disabled."""
+    if not _configured:
+        configure()
+    return _flights
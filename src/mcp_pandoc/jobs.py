@@ -0,0 +1,311 @@
+"""Background conversion jobs that outlive the MCP request that submitted them.
+
+A large PDF or EPUB build can take longer than a client's request timeout.
+``submit-conversion`` validates the arguments, records a job and returns its
+id at once; the conversion then runs in the background, at most one job per
+pool worker so queued jobs never fill the pool's wait queue. Clients poll
+``conversion-status`` (optionally waiting for the job to finish) and collect
+the output with ``fetch-conversion``.
+
+While a job runs, every stage it enters (pandoc, filters, LaTeX, ...) is
+reported to the listeners of the job: the server forwards them to the
+submitting session as log notifications and, to a waiting
+``conversion-status`` call, as progress notifications.
+
+Jobs live in memory and can also be written to a SQLite database so that
+finished results survive a server restart. Jobs that were still queued or
+running when the server stopped are marked as failed when it starts again.
+Finished jobs expire ``ttl_seconds`` after they finish. Paged results a job
+produced are pinned in the result store until the job expires, so the
+result_id ``fetch-conversion`` hands out stays readable as long as the job.
+Pinned results are only kept in memory: after a restart, a job loaded from
+the database still reports its first page, but the rest of a paged result
+is gone.
+"""
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass, field
+
+from .pool import get_pool
+from .results import get_store
+
+JOB_STATES = ("queued", "running", "succeeded", "failed")
+FINISHED_STATES = ("succeeded", "failed")
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_MAX_JOBS = 256
+MAX_WAIT_SECONDS = 60
+
+
+@dataclass
+class Job:
+    """A conversion submitted to run in the background."""
+
+    job_id: str
+    tool: str
+    arguments: dict
+    status: str = "queued"
+    stage: str | None = None
+    created: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    error: str | None = None
+    # The tool's MCP content items, as JSON-serializable dicts
+    result: list[dict] | None = None
+
+    @property
+    def done(self) -> bool:
+        """True once the job succeeded or failed."""
+        return self.status in FINISHED_STATES
+
+    def summary(self, ttl_seconds: float | None = None) -> dict:
+        """Return the job's state without its result, for conversion-status."""
+        now = time.time()
+        summary = {
+            "job_id": self.job_id,
+            "tool": self.tool,
+            "status": self.status,
+            "stage": self.stage,
+            "output_format": self.arguments.get("output_format"),
+            "output_file": self.arguments.get("output_file"),
+            "queued_seconds": round((self.started or now) - self.created, 3),
+        }
+        if self.started is not None:
+            summary["run_seconds"] = round((self.finished or now) - self.started, 3)
+        if self.error:
+            summary["error"] = self.error
+        if self.finished is not None and ttl_seconds is not None:
+            summary["expires_in_seconds"] = max(0, round(self.finished + ttl_seconds - now))
+        return summary
+
+
+class JobStore:
+    """Track background conversion jobs until they expire.
+
+    At most ``max_jobs`` jobs are kept; when the table is full the oldest
+    finished jobs are dropped first, and new submissions are refused while
+    every job is still unfinished.
+    """
+
+    def __init__(self, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_jobs: int = DEFAULT_MAX_JOBS,
+                 database: str | None = None):
+        """Create a store, loading the jobs recorded in ``database`` if given."""
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self.database = database
+        self._jobs: dict[str, Job] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._listeners: dict[str, list[Callable[[Job], None]]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._lock = threading.Lock()
+        # A sqlite3.Connection; sqlite3 is only imported when a database is configured
+        self._db = None
+        if database:
+            self._open(database)
+
+    def _open(self, database: str) -> None:
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+        self._db = sqlite3.connect(database, check_same_thread=False, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        for (data,) in self._db.execute("SELECT data FROM jobs"):
+            job = Job(**json.loads(data))
+            if not job.done:
+                job.status = "failed"
+                job.finished = time.time()
+                job.error = "The server stopped before the job finished; submit the conversion again"
+                self._save(job)
+            self._jobs[job.job_id] = job
+        with self._lock:
+            self._expire_locked()
+
+    def _save(self, job: Job) -> None:
+        if self._db is not None:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO jobs (job_id, data) VALUES (?, ?)", (job.job_id, json.dumps(asdict(job)))
+                )
+
+    def _expire_locked(self, room: int = 0) -> None:
+        """Drop expired jobs, then the oldest finished ones until ``room`` new jobs fit."""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.done and now - job.finished > self.ttl_seconds
+        ]
+        overflow = len(self._jobs) - len(expired) - self.max_jobs + room
+        if overflow > 0:
+            finished = sorted(
+                (job for job in self._jobs.values() if job.done and job.job_id not in expired),
+                key=lambda job: job.finished,
+            )
+            expired.extend(job.job_id for job in finished[:overflow])
+        for job_id in expired:
+            del self._jobs[job_id]
+            self._listeners.pop(job_id, None)
+            get_store().release(job_id)
+        if expired and self._db is not None:
+            self._db.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in expired])
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Like the pool's slots: one semaphore per running loop, sized to the pool's workers
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(get_pool().max_workers)
+        return self._semaphore
+
+    def submit(self, tool: str, arguments: dict, run: Callable[[Job], Awaitable[list[dict]]]) -> Job:
+        """Record a job and start ``run(job)`` in the background; returns the queued job.
+
+        ``run`` returns the tool's content items; any exception fails the job.
+        Must be called from the event loop the job should run on.
+        """
+        job = Job(job_id=uuid.uuid4().hex, tool=tool, arguments=arguments)
+        with self._lock:
+            self._expire_locked(room=1)
+            if len(self._jobs) >= self.max_jobs:
+                raise ValueError(
+                    f"Too many unfinished conversion jobs ({len(self._jobs)}). "
+                    "Wait for some to finish before submitting more."
+                )
+            self._jobs[job.job_id] = job
+        self._save(job)
+        self._tasks[job.job_id] = asyncio.get_running_loop().create_task(self._run(job, run))
+        return job
+
+    async def _run(self, job: Job, run: Callable[[Job], Awaitable[list[dict]]]) -> None:
+        try:
+            async with self._get_semaphore():
+                self.update(job, status="running", started=time.time())
+                try:
+                    result = await run(job)
+                except Exception as e:
+                    self.update(job, status="failed", stage=None, finished=time.time(), error=str(e))
+                else:
+                    self.update(job, status="succeeded", stage=None, finished=time.time(), result=result)
+        finally:
+            self._tasks.pop(job.job_id, None)
+
+    def update(self, job: Job, **changes) -> None:
+        """Change a job's fields, persist status changes and tell the job's listeners.
+
+        Must be called from the job's event loop (see ``stage_listener``).
+        """
+        for name, value in changes.items():
+            setattr(job, name, value)
+        if "status" in changes:
+            self._save(job)
+        for listener in list(self._listeners.get(job.job_id, ())):
+            listener(job)
+
+    def stage_listener(self, job: Job) -> Callable[[str], None]:
+        """Return a trace ``on_stage`` callback that reports stages of ``job``, from any thread."""
+        loop = asyncio.get_running_loop()
+
+        def on_stage(name: str) -> None:
+            loop.call_soon_threadsafe(functools.partial(self.update, job, stage=name))
+
+        return on_stage
+
+    @contextlib.contextmanager
+    def listening(self, job_id: str, listener: Callable[[Job], None]):
+        """Call ``listener(job)`` on every change of a job while the block runs."""
+        listeners = self._listeners.setdefault(job_id, [])
+        listeners.append(listener)
+        try:
+            yield
+        finally:
+            with contextlib.suppress(ValueError):
+                listeners.remove(listener)
+
+    def subscribe(self, job_id: str, listener: Callable[[Job], None]) -> None:
+        """Call ``listener(job)`` on every change of a job until it is dropped."""
+        self._listeners.setdefault(job_id, []).append(listener)
+
+    def get(self, job_id: str) -> Job:
+        """Return a job, raising ValueError for unknown or expired ids."""
+        with self._lock:
+            self._expire_locked()
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Unknown or expired job_id: {job_id}")
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Job:
+        """Return the job once it has finished or ``timeout`` seconds have passed."""
+        job = self.get(job_id)
+        if job.done or timeout <= 0:
+            return job
+        finished = asyncio.get_running_loop().create_future()
+
+        def listener(changed: Job) -> None:
+            if changed.done and not finished.done():
+                finished.set_result(None)
+
+        with self.listening(job_id, listener), contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(finished, timeout)
+        return job
+
+    def jobs(self) -> list[Job]:
+        """Return every job that has not expired, oldest first."""
+        with self._lock:
+            self._expire_locked()
+            return sorted(self._jobs.values(), key=lambda job: job.created)
+
+    def stats(self) -> dict:
+        """Return the number of jobs in each state and the store configuration."""
+        with self._lock:
+            counts = {state: 0 for state in JOB_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return {**counts, "max_jobs": self.max_jobs, "ttl_seconds": self.ttl_seconds, "database": self.database}
+
+    def close(self) -> None:
+        """Stop running jobs, unpin their results and close the database; unfinished jobs fail on the next start."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self._tasks.clear()
+        for job_id in list(self._jobs):
+            get_store().release(job_id)
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+
+_store: JobStore | None = None
+
+
+def configure(database: str | None = None, ttl_seconds: float | None = None) -> JobStore:
+    """(Re)create the process-wide job store.
+
+    ``database`` falls back to ``MCP_PANDOC_JOB_DB`` (default: jobs are only
+    kept in memory) and ``ttl_seconds`` to ``MCP_PANDOC_JOB_TTL``.
+    """
+    global _store
+    if _store is not None:
+        _store.close()
+    if database is None:
+        database = os.environ.get("MCP_PANDOC_JOB_DB") or None
+    if ttl_seconds is None:
+        ttl_seconds = float(os.environ.get("MCP_PANDOC_JOB_TTL", DEFAULT_TTL_SECONDS))
+    if ttl_seconds < 0:
+        raise ValueError(f"ttl_seconds must not be negative, got: {ttl_seconds}")
+    _store = JobStore(ttl_seconds=ttl_seconds, database=os.path.expanduser(database) if database else None)
+    return _store
+
+
+def get_jobs() -> JobStore:
+    """Return the process-wide job store, creating it from the environment on first use."""
+    if _store is None:
+        return configure()
+    return _store
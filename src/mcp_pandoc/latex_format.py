@@ -0,0 +1,241 @@
+r"""Precompiled LaTeX preamble formats for the xelatex PDF path.
+
+Most of a small PDF's build time goes to xelatex loading the same packages
+(fontspec, geometry, hyperref, ...) for every document. With a format
+directory configured, the server has pandoc write standalone LaTeX instead of
+a PDF, dumps the document's preamble once into a TeX format file with
+``mylatexformat`` and compiles later documents sharing that preamble against
+the dumped format instead of loading those packages again.
+
+Only the document-independent head of the preamble is dumped: it ends before
+the first font selection (XeTeX cannot dump natively loaded fonts) or
+per-document setting such as ``\title`` or ``\hypersetup``, and the rest runs
+after ``\endofdump`` as usual. Formats are keyed by that dumped text (so the
+template, geometry and package options are covered) and by the TeX
+installation, so they are rebuilt when either changes. Preambles that still
+cannot be dumped are remembered and, like any other failure here, make the
+conversion fall back to pandoc's own PDF path.
+"""
+import contextlib
+import functools
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from .driver import run_pandoc
+from .metrics import run_process, stage
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+ENGINE = "xelatex"
+MAX_FORMATS = 16
+MAX_RUNS = 3
+_BEGIN_DOCUMENT = "\\begin{document}"
+_END_OF_DUMP = "\\endofdump\n"
+# Preamble lines that load fonts or depend on the document; the dump stops before the first one
+_STOP = re.compile(
+    r"\\(?:(?:setmainfont|setsansfont|setmonofont|setmathfont|newfontfamily|setCJK\w*font|babelfont|"
+    r"hypersetup|title|subtitle|author|date)\b|begin\{document\})"
+)
+_IF = re.compile(r"\\if[a-zA-Z@]*")
+_FI = re.compile(r"\\fi\b")
+_RERUN = re.compile(r"Rerun to get|Label\(s\) may have changed|There were undefined references")
+
+
+class LatexFormatError(Exception):
+    """Raised when a PDF cannot be built from a cached format; callers use pandoc's PDF path instead."""
+
+
+@functools.lru_cache(maxsize=1)
+def _tex_tools() -> tuple[str, str, str] | None:
+    """Return (xelatex, base format, mylatexformat.ltx) paths, or None if any is missing."""
+    xelatex = shutil.which(ENGINE)
+    kpsewhich = shutil.which("kpsewhich")
+    if not xelatex or not kpsewhich:
+        return None
+    paths = []
+    for name in ("xelatex.fmt", "mylatexformat.ltx"):
+        found = subprocess.run(  # noqa: S603 - kpsewhich from PATH
+            [kpsewhich, "-engine=xetex", name], capture_output=True, text=True
+        ).stdout.strip()
+        if not found:
+            return None
+        paths.append(found)
+    return xelatex, paths[0], paths[1]
+
+
+def tex_fingerprint() -> str:
+    """Identify the TeX installation: the engine binary and base format, by path and modification time."""
+    tools = _tex_tools()
+    if tools is None:
+        raise LatexFormatError("xelatex, kpsewhich or mylatexformat.ltx not found")
+    xelatex, base_format, _mylatexformat = tools
+    return ";".join(f"{path}:{os.stat(path).st_mtime_ns}" for path in (xelatex, base_format))
+
+
+def format_key(preamble: str, fingerprint: str) -> str:
+    """Name of the format dumped from ``preamble`` on the TeX installation ``fingerprint``."""
+    return "mcp-" + hashlib.sha256(f"{fingerprint}\n{preamble}".encode()).hexdigest()[:32]
+
+
+def split_dumpable(tex: str) -> tuple[str, str]:
+    r"""Split a standalone LaTeX document into the preamble head that can be dumped and the rest.
+
+    The cut is made on a line boundary outside any group or conditional, so a
+    stop command inside ``\ifPDFTeX ... \fi`` moves the cut before that block.
+    """
+    if _BEGIN_DOCUMENT not in tex:
+        raise LatexFormatError("LaTeX output has no \\begin{document}")
+    lines = tex.splitlines(keepends=True)
+    depth = 0
+    block_start = 0
+    for index, line in enumerate(lines):
+        code = re.sub(r"(?<!\\)%.*", "", line)
+        if depth == 0:
+            block_start = index
+        if _STOP.search(code):
+            cut = block_start if depth else index
+            break
+        depth += code.count("{") - code.count("\\{") - code.count("}") + code.count("\\}")
+        depth += len(_IF.findall(code)) - len(_FI.findall(code))
+        depth = max(depth, 0)
+    else:
+        raise LatexFormatError("LaTeX output has no \\begin{document}")
+    dumped = "".join(lines[:cut])
+    if "\\documentclass" not in dumped:
+        raise LatexFormatError("nothing in the preamble can be dumped")
+    return dumped, "".join(lines[cut:])
+
+
+class FormatCache:
+    """Directory of dumped preamble formats, shared between server processes."""
+
+    def __init__(self, directory: str):
+        """Use (and create) ``directory`` for format files."""
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        os.makedirs(self.directory, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self, key: str):
+        with open(os.path.join(self.directory, key + ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def format_for(self, preamble: str) -> str:
+        """Return the format name for a dumpable preamble head, dumping it first if needed."""
+        key = format_key(preamble, tex_fingerprint())
+        fmt_path = os.path.join(self.directory, key + ".fmt")
+        failed_path = os.path.join(self.directory, key + ".failed")
+        if os.path.exists(fmt_path):
+            os.utime(fmt_path)
+            return key
+        if os.path.exists(failed_path):
+            raise LatexFormatError(f"preamble cannot be dumped (see {failed_path})")
+
+        with self._locked(key):
+            # Another process may have built it while we waited for the lock
+            if os.path.exists(fmt_path):
+                return key
+            with tempfile.TemporaryDirectory(prefix="mcp-pandoc-fmt-") as build_dir:
+                with open(os.path.join(build_dir, "preamble.tex"), "w", encoding="utf-8") as f:
+                    f.write(preamble + _END_OF_DUMP + _BEGIN_DOCUMENT + "\n\\end{document}\n")
+                process = run_process(
+                    [_tex_tools()[0], "-ini", "-interaction=nonstopmode", "-halt-on-error", f"-jobname={key}",
+                     "&" + ENGINE, "mylatexformat.ltx", "preamble.tex"],
+                    cwd=build_dir,
+                )
+                built = os.path.join(build_dir, key + ".fmt")
+                if process.returncode != 0 or not os.path.exists(built):
+                    with open(failed_path, "w", encoding="utf-8") as f:
+                        f.write(process.stdout.decode("utf-8", errors="replace")[-4000:])
+                    raise LatexFormatError(f"dumping the preamble failed (see {failed_path})")
+                shutil.move(built, fmt_path + ".tmp")
+                os.replace(fmt_path + ".tmp", fmt_path)
+        self._evict()
+        return key
+
+    def _evict(self) -> None:
+        formats = sorted(
+            (entry.stat().st_mtime, entry.path) for entry in os.scandir(self.directory) if entry.name.endswith(".fmt")
+        )
+        for _mtime, path in formats[:-MAX_FORMATS]:
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+
+    def compile(self, tex: str, work_dir: str, output_file: str) -> None:
+        """Compile a standalone LaTeX document against its cached preamble format into ``output_file``."""
+        dumped, rest = split_dumpable(tex)
+        key = self.format_for(dumped)
+        # The format skips everything up to \endofdump and runs the rest of the preamble normally
+        with open(os.path.join(work_dir, "doc.tex"), "w", encoding="utf-8") as f:
+            f.write(dumped + _END_OF_DUMP + rest)
+        # A trailing separator keeps kpathsea's default format path after ours
+        env = {**os.environ, "TEXFORMATS": self.directory + os.pathsep}
+        for _ in range(MAX_RUNS):
+            process = run_process(
+                [_tex_tools()[0], f"-fmt={key}", "-interaction=nonstopmode", "-halt-on-error", "doc.tex"],
+                cwd=work_dir, env=env,
+            )
+            if process.returncode != 0:
+                log = process.stdout.decode("utf-8", errors="replace")
+                raise LatexFormatError(f"xelatex failed with the cached format: {log[-2000:]}")
+            with open(os.path.join(work_dir, "doc.log"), encoding="utf-8", errors="replace") as log:
+                if not _RERUN.search(log.read()):
+                    break
+        output_dir = os.path.dirname(os.path.abspath(output_file))
+        os.makedirs(output_dir, exist_ok=True)
+        shutil.copyfile(os.path.join(work_dir, "doc.pdf"), output_file)
+
+
+def convert_pdf_with_format(contents: str | None, input_file: str | None, input_format: str, output_file: str,
+                            extra_args: list[str], format_dir: str) -> str:
+    """Build a PDF with xelatex from a cached preamble format; raises LatexFormatError to request a fallback.
+
+    Kept at module level so it can be shipped to a process pool worker.
+    """
+    cache = FormatCache(format_dir)
+    with tempfile.TemporaryDirectory(prefix="mcp-pandoc-pdf-") as work_dir:
+        # Same arguments, minus the engine: pandoc writes the LaTeX it would have handed to xelatex,
+        # with images copied next to it
+        latex_args = [arg for arg in extra_args if not arg.startswith("--pdf-engine")]
+        latex_args += ["--standalone", f"--extract-media={work_dir}", "--to=latex"]
+        with stage("pandoc"):
+            if input_file:
+                tex = run_pandoc([*latex_args, input_file])
+            else:
+                tex = run_pandoc([f"--from={input_format}", *latex_args], input=contents.encode("utf-8"))
+        with stage("latex"):
+            cache.compile(tex.decode("utf-8"), work_dir, output_file)
+    return ""
+
+
+_directory: str | None = None
+_configured = False
+
+
+def configure(directory: str | None = None) -> str | None:
+    """Enable the format cache in ``directory`` (falls back to ``MCP_PANDOC_LATEX_FORMAT_DIR``; default: disabled)."""
+    global _directory, _configured
+    _configured = True
+    _directory = directory or os.environ.get("MCP_PANDOC_LATEX_FORMAT_DIR") or None
+    return _directory
+
+
+def get_format_dir() -> str | None:
+    """Return the format cache directory, or None when disabled or the TeX tools are missing."""
+    if not _configured:
+        configure()
+    if _directory is None or _tex_tools() is None:
+        return None
+    return _directory
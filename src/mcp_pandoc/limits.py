@@ -0,0 +1,305 @@
+"""Wall-clock timeouts, CPU and memory caps, and cancellation for child processes.
+
+Every process started for a conversion (pandoc, subprocess filters, the TeX
+tools) runs in its own process group and is registered with the
+conversion's ``ProcessScope``. When the conversion is cancelled (an MCP
+``notifications/cancelled``, or the client going away) or runs past its
+timeout, the scope kills every registered group, so the filters and PDF
+engines pandoc started die with it. Processes started later for the same
+conversion are refused.
+
+Limits are configured per output format, e.g. ``300,pdf=900``: the first
+value applies to every format without its own entry, and ``0`` means no
+limit. The CPU and memory caps are applied to each child as
+``RLIMIT_CPU`` and ``RLIMIT_AS``; a child that hits one is reported as
+killed by that limit rather than as a plain conversion error.
+
+The caps are set by a ``sh`` wrapper that execs the child, not in a
+``preexec_fn``: running Python code between ``fork`` and ``exec`` can
+deadlock a threaded server. They can't be applied to the running child
+with ``prlimit`` either, because pandoc sizes its heap's address space
+reservation from ``RLIMIT_AS`` as it starts.
+
+Conversions shipped to a process pool worker don't see the caller's scope,
+so the pool passes the ``Limits`` along and the worker runs the conversion
+in a scope of its own (``run_with_limits``).
+"""
+import asyncio
+import contextlib
+import contextvars
+import os
+import signal
+import threading
+from dataclasses import dataclass
+
+KILL_REASONS = ("cancelled", "timeout", "cpu_limit", "memory_limit")
+DEFAULT_TIMEOUT = "600"
+# Exit status of a GHC program (pandoc) whose heap allocation failed
+GHC_OUT_OF_MEMORY = 251
+
+
+class ProcessKilledError(RuntimeError):
+    """A conversion's processes were killed: cancelled, timed out or over a resource limit."""
+
+    def __init__(self, reason: str, limit: float | None = None):
+        """Record why the conversion was killed and the limit involved."""
+        super().__init__(reason, limit)
+        self.reason = reason
+        self.limit = limit
+
+    def __str__(self) -> str:
+        """Describe the kill for users."""
+        if self.reason == "timeout":
+            return f"timed out after {self.limit:g}s"
+        if self.reason == "cpu_limit":
+            return f"exceeded the CPU time limit of {self.limit:g}s"
+        if self.reason == "memory_limit":
+            return f"exceeded the memory limit of {self.limit:g} MiB"
+        return "cancelled"
+
+
+def kill_reason(error: BaseException | None) -> str | None:
+    """Return the kill reason behind ``error`` (following wrapped causes), or None."""
+    while error is not None:
+        if isinstance(error, ProcessKilledError):
+            return error.reason
+        if isinstance(error, asyncio.CancelledError):
+            return "cancelled"
+        error = error.__cause__
+    return None
+
+
+@dataclass(frozen=True)
+class Limits:
+    """The limits applied to one conversion; None means unlimited."""
+
+    timeout_seconds: float | None = None
+    cpu_seconds: int | None = None
+    memory_mib: int | None = None
+
+
+def parse_spec(value: str, name: str) -> dict[str | None, float | None]:
+    """Parse ``"300,pdf=900"`` into ``{None: 300, "pdf": 900}`` (``0`` means no limit)."""
+    spec: dict[str | None, float | None] = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        output_format, _, number = item.rpartition("=")
+        try:
+            parsed = float(number)
+        except ValueError as e:
+            raise ValueError(f"{name} must look like '300' or '300,pdf=900', got: {value!r}") from e
+        if parsed < 0:
+            raise ValueError(f"{name} must not be negative, got: {value!r}")
+        spec[output_format or None] = parsed or None
+    return spec
+
+
+class LimitTable:
+    """Per-output-format timeouts and resource caps."""
+
+    def __init__(self, timeout: str = DEFAULT_TIMEOUT, max_cpu_seconds: str = "", max_memory_mib: str = ""):
+        """Create a table from ``parse_spec`` strings."""
+        self.timeouts = parse_spec(timeout, "timeout")
+        self.cpu_seconds = parse_spec(max_cpu_seconds, "max_cpu_seconds")
+        self.memory_mib = parse_spec(max_memory_mib, "max_memory_mib")
+
+    @staticmethod
+    def _largest(spec: dict[str | None, float | None], formats: list[str]) -> float | None:
+        values = [spec.get(output_format, spec.get(None)) for output_format in formats or [None]]
+        return None if None in values else max(values)
+
+    def for_formats(self, formats: list[str]) -> Limits:
+        """Return the limits for a conversion writing ``formats``: the most generous of their entries."""
+        cpu_seconds = self._largest(self.cpu_seconds, formats)
+        memory_mib = self._largest(self.memory_mib, formats)
+        return Limits(
+            timeout_seconds=self._largest(self.timeouts, formats),
+            cpu_seconds=int(cpu_seconds) if cpu_seconds else None,
+            memory_mib=int(memory_mib) if memory_mib else None,
+        )
+
+    def stats(self) -> dict:
+        """Return the configured limits, keyed by output format ("*" for the default)."""
+        def table(spec):
+            return {output_format or "*": limit for output_format, limit in spec.items()}
+
+        return {
+            "timeout_seconds": table(self.timeouts),
+            "cpu_seconds": table(self.cpu_seconds),
+            "memory_mib": table(self.memory_mib),
+        }
+
+
+class ProcessScope:
+    """The process groups started for one conversion, killed together when it is cancelled or times out."""
+
+    def __init__(self, limits: Limits):
+        """Create an empty scope enforcing ``limits``."""
+        self.limits = limits
+        self.killed: ProcessKilledError | None = None
+        self._groups: set[int] = set()
+        self._lock = threading.Lock()
+
+    def command(self, command: list[str]) -> list[str]:
+        """Return ``command`` wrapped so that it starts under this scope's CPU and memory caps."""
+        steps = []
+        if self.limits.cpu_seconds:
+            # SIGXCPU at the soft limit; the hard limit is a backstop if the child ignores it
+            steps += [f"ulimit -S -t {self.limits.cpu_seconds}", f"ulimit -H -t {self.limits.cpu_seconds + 5}"]
+        if self.limits.memory_mib:
+            memory_kib = self.limits.memory_mib * 1024
+            steps += [f"ulimit -S -v {memory_kib}", f"ulimit -H -v {memory_kib}"]
+        if not steps:
+            return command
+        # Soft limits first: a hard limit below the current soft limit is rejected
+        return ["/bin/sh", "-c", " && ".join(steps) + ' && exec "$@"', "sh", *command]
+
+    def started(self, pid: int) -> None:
+        """Register a child (the leader of its own process group), killing it at once if the scope was killed."""
+        with self._lock:
+            if self.killed is None:
+                self._groups.add(pid)
+                return
+        kill_group(pid)
+
+    def finished(self, pid: int) -> None:
+        """Forget a reaped child."""
+        with self._lock:
+            self._groups.discard(pid)
+
+    def kill(self, error: ProcessKilledError) -> None:
+        """Kill every running process group and refuse new children; the first reason sticks."""
+        with self._lock:
+            if self.killed is None:
+                self.killed = error
+            groups, self._groups = self._groups, set()
+        for pid in groups:
+            kill_group(pid)
+
+    def check(self) -> None:
+        """Raise the kill error if the scope was killed."""
+        if self.killed is not None:
+            raise ProcessKilledError(self.killed.reason, self.killed.limit)
+
+    def check_exit(self, returncode: int) -> None:
+        """Raise ProcessKilledError if a child's exit status shows it was killed by this scope or a limit."""
+        self.check()
+        if returncode == -signal.SIGXCPU and self.limits.cpu_seconds:
+            raise ProcessKilledError("cpu_limit", self.limits.cpu_seconds)
+
+    def check_pandoc_exit(self, returncode: int) -> None:
+        """Like ``check_exit``, also recognizing pandoc running out of its memory limit."""
+        self.check_exit(returncode)
+        if returncode == GHC_OUT_OF_MEMORY and self.limits.memory_mib:
+            raise ProcessKilledError("memory_limit", self.limits.memory_mib)
+
+
+def kill_group(pid: int) -> None:
+    """SIGKILL the process group led by ``pid``, if it still exists."""
+    with contextlib.suppress(ProcessLookupError, PermissionError):
+        os.killpg(pid, signal.SIGKILL)
+
+
+_scope: contextvars.ContextVar[ProcessScope | None] = contextvars.ContextVar("mcp_pandoc_scope", default=None)
+
+
+def current_scope() -> ProcessScope | None:
+    """Return the process scope of the running conversion, if any."""
+    return _scope.get()
+
+
+def detach_scope() -> ProcessScope | None:
+    """Move the running task's children into a new scope with the current limits and no timeout of its own.
+
+    For a task started from a supervised conversion that other callers may
+    share: killing the starting caller's scope no longer kills the task's
+    processes, so whoever owns the task must kill the returned scope.
+    """
+    parent = _scope.get()
+    if parent is None:
+        return None
+    scope = ProcessScope(parent.limits)
+    _scope.set(scope)
+    return scope
+
+
+def spawn_options() -> dict:
+    """Keyword arguments for ``subprocess.Popen``/``create_subprocess_exec``: a child leads its own process group."""
+    return {"start_new_session": True}
+
+
+def limited_command(command: list[str]) -> list[str]:
+    """Return ``command`` wrapped to start under the current scope's CPU and memory caps, if any."""
+    scope = _scope.get()
+    return scope.command(command) if scope is not None else command
+
+
+def run_with_limits(limits: Limits | None, func):
+    """Call ``func()`` in a new scope enforcing ``limits``.
+
+    For process pool workers, which don't see the caller's scope; the
+    caller's scope still enforces the timeout and cancellation.
+    """
+    if limits is None:
+        return func()
+    token = _scope.set(ProcessScope(limits))
+    try:
+        return func()
+    finally:
+        _scope.reset(token)
+
+
+@contextlib.asynccontextmanager
+async def supervise(limits: Limits):
+    """Run a conversion in a new process scope, killing its processes on timeout or cancellation.
+
+    A timeout raises ProcessKilledError; cancellation is re-raised after the
+    processes are killed.
+    """
+    scope = ProcessScope(limits)
+    token = _scope.set(scope)
+    deadline = asyncio.timeout(limits.timeout_seconds)
+    try:
+        async with deadline:
+            yield scope
+    except TimeoutError as e:
+        if not deadline.expired():
+            raise
+        error = ProcessKilledError("timeout", limits.timeout_seconds)
+        scope.kill(error)
+        raise error from e
+    except asyncio.CancelledError:
+        scope.kill(ProcessKilledError("cancelled"))
+        raise
+    finally:
+        _scope.reset(token)
+
+
+_table: LimitTable | None = None
+
+
+def configure(timeout: str | None = None, max_cpu_seconds: str | None = None,
+              max_memory_mib: str | None = None) -> LimitTable:
+    """Set the per-format limits from ``parse_spec`` strings.
+
+    Each falls back to its environment variable (``MCP_PANDOC_TIMEOUT``,
+    ``MCP_PANDOC_MAX_CPU_SECONDS``, ``MCP_PANDOC_MAX_MEMORY_MIB``); by default
+    conversions time out after 600 seconds and have no resource caps.
+    """
+    global _table
+    _table = LimitTable(
+        timeout=timeout if timeout is not None else os.environ.get("MCP_PANDOC_TIMEOUT", DEFAULT_TIMEOUT),
+        max_cpu_seconds=(
+            max_cpu_seconds if max_cpu_seconds is not None else os.environ.get("MCP_PANDOC_MAX_CPU_SECONDS", "")
+        ),
+        max_memory_mib=(
+            max_memory_mib if max_memory_mib is not None else os.environ.get("MCP_PANDOC_MAX_MEMORY_MIB", "")
+        ),
+    )
+    return _table
+
+
+def get_limits() -> LimitTable:
+    """Return the configured limits, reading the environment on first use."""
+    if _table is None:
+        return configure()
+    return _table
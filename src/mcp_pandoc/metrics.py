@@ -0,0 +1,348 @@
+"""Per-call traces, child process resource usage, aggregated metrics and logging.
+
+Every tool call runs under a trace that records how long each stage took
+(argument validation, filter resolution, PDF engine selection, the result
+cache, pandoc, its reader and writer, filters, the LaTeX engine and result
+formatting) together with the CPU time and peak RSS of the child processes
+it started, taken from ``wait4`` as they are reaped. Finished traces are
+logged to stderr (one JSON object per line with ``--log-format json``) and
+aggregated into histograms reported by the ``server-stats`` tool.
+
+Calls whose processes were killed (cancelled, timed out or over a CPU or
+memory limit, see ``limits``) are counted with the kill reason as their
+status instead of ``error``.
+
+Stages that run concurrently (such as the writers of a multi-output call)
+add up, so stage totals can exceed the wall time. Work shipped to a process
+pool is timed as a whole, without its inner stages or child processes.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable
+
+from .limits import current_scope, kill_group, kill_reason, limited_command, spawn_options
+
+LOG_FORMATS = ("text", "json")
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+_RSS_SCALE = 1024 if sys.platform == "darwin" else 1
+
+logger = logging.getLogger("mcp_pandoc")
+
+
+class Trace:
+    """Timings and child process usage of one tool call."""
+
+    def __init__(self, tool: str):
+        """Start timing a call to ``tool``."""
+        self.tool = tool
+        self.started = time.perf_counter()
+        self.seconds: float | None = None
+        self.status = "ok"
+        self.error: str | None = None
+        self.stages: dict[str, float] = {}
+        self.children = 0
+        self.child_cpu_seconds = 0.0
+        self.child_max_rss_kib = 0
+        # Conversions killed during the call, by reason (a batch can lose items without failing)
+        self.killed: dict[str, int] = {}
+        # Called with the stage name whenever a stage starts, possibly from a worker thread
+        self.on_stage: Callable[[str], None] | None = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        """Add ``seconds`` to a stage (stages entered several times accumulate)."""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_child(self, rusage=None) -> None:
+        """Account for a reaped child process, with its ``wait4`` resource usage when known."""
+        with self._lock:
+            self.children += 1
+            if rusage is None:
+                return
+            self.child_cpu_seconds += rusage.ru_utime + rusage.ru_stime
+            self.child_max_rss_kib = max(self.child_max_rss_kib, rusage.ru_maxrss // _RSS_SCALE)
+
+    def add_kill(self, reason: str) -> None:
+        """Count a conversion of this call that was killed."""
+        with self._lock:
+            self.killed[reason] = self.killed.get(reason, 0) + 1
+
+    def as_dict(self) -> dict:
+        """Return the trace as a JSON-serializable dict."""
+        trace = {
+            "tool": self.tool,
+            "status": self.status,
+            "seconds": round(self.seconds if self.seconds is not None else time.perf_counter() - self.started, 4),
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "children": self.children,
+            "child_cpu_seconds": round(self.child_cpu_seconds, 4),
+            "child_max_rss_kib": self.child_max_rss_kib,
+        }
+        if self.killed:
+            trace["killed"] = dict(self.killed)
+        if self.error:
+            trace["error"] = self.error
+        return trace
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds, as Prometheus reports them."""
+
+    def __init__(self, buckets: tuple[float, ...] = HISTOGRAM_BUCKETS):
+        """Create an empty histogram with the given upper bounds."""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record one value."""
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def quantile(self, fraction: float) -> float | None:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        for bound, count in zip(self.buckets, self.counts, strict=True):
+            if count >= rank:
+                return bound
+        return float("inf")
+
+    def as_dict(self) -> dict:
+        """Return count, sum, estimated quantiles and cumulative bucket counts."""
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {**{str(bound): count for bound, count in zip(self.buckets, self.counts, strict=True)},
+                        "+Inf": self.count},
+        }
+
+
+class Registry:
+    """Aggregates finished traces per tool and per stage."""
+
+    def __init__(self):
+        """Create an empty registry."""
+        self.started = time.time()
+        self.calls: dict[str, dict[str, int]] = {}
+        self.durations: dict[str, Histogram] = {}
+        self.stages: dict[str, Histogram] = {}
+        self.child_cpu = Histogram()
+        self.children = 0
+        self.child_max_rss_kib = 0
+        self.killed: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, trace: Trace) -> None:
+        """Add a finished trace to the aggregates."""
+        with self._lock:
+            calls = self.calls.setdefault(trace.tool, {})
+            calls[trace.status] = calls.get(trace.status, 0) + 1
+            self.durations.setdefault(trace.tool, Histogram()).observe(trace.seconds)
+            for name, seconds in trace.stages.items():
+                self.stages.setdefault(name, Histogram()).observe(seconds)
+            if trace.children:
+                self.children += trace.children
+                self.child_cpu.observe(trace.child_cpu_seconds)
+                self.child_max_rss_kib = max(self.child_max_rss_kib, trace.child_max_rss_kib)
+            for reason, count in trace.killed.items():
+                self.killed[reason] = self.killed.get(reason, 0) + count
+
+    def stats(self) -> dict:
+        """Return the aggregates as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "calls": {tool: dict(statuses) for tool, statuses in self.calls.items()},
+                "durations": {tool: histogram.as_dict() for tool, histogram in self.durations.items()},
+                "stages": {name: histogram.as_dict() for name, histogram in self.stages.items()},
+                "children": self.children,
+                "child_cpu_seconds": self.child_cpu.as_dict(),
+                "child_max_rss_kib": self.child_max_rss_kib,
+                "killed": dict(self.killed),
+            }
+
+
+_current: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("mcp_pandoc_trace", default=None)
+_registry = Registry()
+
+
+def get_registry() -> Registry:
+    """Return the process-wide metrics registry."""
+    return _registry
+
+
+def current_trace() -> Trace | None:
+    """Return the trace of the tool call running in this context, if any."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def trace(tool: str):
+    """Trace a tool call: time it, then log it and add it to the registry."""
+    current = Trace(tool)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        # Killed calls (cancelled, timed out, over a resource limit) are counted apart from plain errors
+        current.status = kill_reason(e) or "error"
+        current.error = str(e).splitlines()[0][:500] if str(e) else type(e).__name__
+        raise
+    finally:
+        current.seconds = time.perf_counter() - current.started
+        _current.reset(token)
+        _registry.record(current)
+        logger.info(_describe(current), extra={"trace": current.as_dict()})
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a stage of the current tool call (a no-op outside a trace)."""
+    current = _current.get()
+    if current is not None and current.on_stage is not None:
+        current.on_stage(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if current is not None:
+            current.add_stage(name, time.perf_counter() - started)
+
+
+def _describe(current: Trace) -> str:
+    stages = " ".join(f"{name}={seconds:.3f}s" for name, seconds in current.stages.items())
+    killed = "".join(f" killed_{reason}={count}" for reason, count in current.killed.items())
+    return (
+        f"{current.tool} {current.status} in {current.seconds:.3f}s [{stages}] "
+        f"children={current.children} child_cpu={current.child_cpu_seconds:.3f}s "
+        f"child_max_rss={current.child_max_rss_kib}KiB{killed}"
+    )
+
+
+def _feed(stream, data: bytes) -> None:
+    try:
+        stream.write(data)
+    except BrokenPipeError:
+        # The child exited early; its exit status and stderr say why
+        pass
+    finally:
+        with contextlib.suppress(BrokenPipeError):
+            stream.close()
+
+
+def run_process(command: list[str], input: bytes | None = None, cwd: str | None = None,
+                env: dict | None = None) -> subprocess.CompletedProcess:
+    """Run a child process to completion, recording its CPU time and peak RSS in the current trace.
+
+    Works like ``subprocess.run(..., capture_output=True)``, except that the
+    child is reaped with ``wait4`` so its resource usage is not lost, and that
+    it runs in its own process group under the current conversion's limits.
+    Raises ProcessKilledError if the conversion was killed or the child hit
+    its CPU limit.
+    """
+    if not hasattr(os, "wait4"):  # pragma: no cover - Windows
+        return subprocess.run(command, input=input, capture_output=True, cwd=cwd, env=env)  # noqa: S603
+    scope = current_scope()
+    if scope is not None:
+        scope.check()
+    process = subprocess.Popen(  # noqa: S603 - callers pass pandoc, validated filters or TeX tools
+        limited_command(command), stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, env=env, **spawn_options(),
+    )
+    if scope is not None:
+        scope.started(process.pid)
+    # communicate() would reap the child with waitpid; read the pipes here and reap it with wait4
+    stderr = []
+    threads = [threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)]
+    if input is not None:
+        threads.append(threading.Thread(target=_feed, args=(process.stdin, input), daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        stdout = process.stdout.read()
+        for thread in threads:
+            thread.join()
+    except BaseException:
+        kill_group(process.pid)
+        process.wait()
+        if scope is not None:
+            scope.finished(process.pid)
+        raise
+    finally:
+        process.stdout.close()
+        process.stderr.close()
+    _pid, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    current = _current.get()
+    if current is not None:
+        current.add_child(rusage)
+    if scope is not None:
+        scope.finished(process.pid)
+        scope.check_exit(process.returncode)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr[0] if stderr else b"")
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects, with trace fields at the top level."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Serialize one record."""
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+        }
+        trace_fields = getattr(record, "trace", None)
+        if trace_fields:
+            entry.update(event="trace", **trace_fields)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+_handler: logging.Handler | None = None
+
+
+def configure(log_format: str | None = None, log_level: str | None = None) -> logging.Logger:
+    """Send the server's logs to stderr.
+
+    ``log_format`` (text or json) falls back to ``MCP_PANDOC_LOG_FORMAT`` and
+    ``log_level`` to ``MCP_PANDOC_LOG_LEVEL`` (default: INFO, which includes
+    one trace line per tool call). Stdout is left to the MCP protocol.
+    """
+    global _handler
+    log_format = log_format or os.environ.get("MCP_PANDOC_LOG_FORMAT", "text")
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unsupported log format: '{log_format}'. Supported formats are: {', '.join(LOG_FORMATS)}")
+    level = (log_level or os.environ.get("MCP_PANDOC_LOG_LEVEL", "INFO")).upper()
+    if _handler is not None:
+        logger.removeHandler(_handler)
+    _handler = logging.StreamHandler(sys.stderr)
+    if log_format == "json":
+        _handler.setFormatter(JsonFormatter())
+    else:
+        _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
@@ -0,0 +1,352 @@
+"""Optional conversion backend built on a pool of long-running ``pandoc server`` processes.
+
+Every CLI conversion pays pandoc's process startup, plus pypandoc's executable
+lookup and temp-file handling. Pandoc 3 can instead run as a local HTTP server
+(``pandoc server``) that converts JSON requests. In ``server`` mode a few of
+these processes are started once and kept warm, and conversions are sent to
+them over keep-alive connections.
+
+The server API has no filters, defaults files, reference documents or PDF
+engines, so only plain text-in conversions are eligible; everything else (and
+anything the server fails on) goes through the regular subprocess path.
+"""
+import atexit
+import base64
+import http.client
+import json
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+
+from .capabilities import get_capabilities
+from .metrics import logger
+
+BACKENDS = ("subprocess", "server")
+DEFAULT_SERVER_WORKERS = 2
+DEFAULT_REQUEST_TIMEOUT = 120
+_STARTUP_TIMEOUT = 10.0
+# Dropped workers are restarted in the background after this delay, doubled after each failed attempt
+_RETRY_INITIAL = 1.0
+_RETRY_MAX = 300.0
+
+
+class PandocServerError(Exception):
+    """Raised when a pandoc server worker cannot complete a request."""
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class PandocServerWorker:
+    """One ``pandoc server`` process and the keep-alive connection to it."""
+
+    def __init__(self, pandoc_path: str, timeout: int = DEFAULT_REQUEST_TIMEOUT):
+        """Describe a worker; the process is launched by ``start()``."""
+        self.pandoc_path = pandoc_path
+        self.timeout = timeout
+        self.port: int | None = None
+        self.restarts = 0
+        self._process: subprocess.Popen | None = None
+        self._connection: http.client.HTTPConnection | None = None
+
+    def start(self) -> None:
+        """Launch the server process and wait until it answers a health check."""
+        self.stop()
+        self.port = _free_port()
+        self._process = subprocess.Popen(  # noqa: S603 - the pandoc path comes from the probe or the server config
+            [self.pandoc_path, "server", "--port", str(self.port), "--timeout", str(self.timeout)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        deadline = time.monotonic() + _STARTUP_TIMEOUT
+        while True:
+            if self._process.poll() is not None:
+                raise PandocServerError(f"pandoc server exited with status {self._process.returncode} on startup")
+            try:
+                self.version()
+                return
+            except ConnectionRefusedError:
+                # Not listening yet
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise PandocServerError("pandoc server did not start listening in time") from None
+                time.sleep(0.02)
+            except (OSError, http.client.HTTPException, PandocServerError) as e:
+                # Listening but unable to serve (e.g. a pandoc build without the threaded runtime)
+                self.stop()
+                raise PandocServerError(f"pandoc server failed its health check: {e}") from e
+
+    def stop(self) -> None:
+        """Close the connection and terminate the server process."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.terminate()
+                try:
+                    self._process.wait(timeout=2)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+                    self._process.wait()
+            self._process = None
+
+    def is_alive(self) -> bool:
+        """Return True while the server process is running."""
+        return self._process is not None and self._process.poll() is None
+
+    def _request(self, method: str, path: str, body: bytes | None = None) -> tuple[int, bytes]:
+        if self._connection is None:
+            self._connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        try:
+            self._connection.request(method, path, body=body, headers=headers)
+            response = self._connection.getresponse()
+            return response.status, response.read()
+        except BaseException:
+            # The connection state is unknown after a failure, so never reuse it
+            self._connection.close()
+            self._connection = None
+            raise
+
+    def version(self) -> str:
+        """Return the server's pandoc version (doubles as the health check)."""
+        status, body = self._request("GET", "/version")
+        if status != 200:
+            raise PandocServerError(f"/version returned HTTP {status}")
+        return body.decode("utf-8").strip().strip('"')
+
+    def convert(self, payload: dict) -> dict:
+        """Send one conversion request and return the decoded JSON response."""
+        status, body = self._request("POST", "/", json.dumps(payload).encode("utf-8"))
+        if status != 200:
+            raise PandocServerError(body.decode("utf-8", errors="replace").strip() or f"HTTP {status}")
+        response = json.loads(body)
+        if "error" in response:
+            raise PandocServerError(response["error"])
+        return response
+
+
+class PandocServerPool:
+    """A fixed set of warm pandoc server workers shared by the conversion threads.
+
+    A worker whose process died or whose connection broke is restarted once
+    per request; if it can't be restarted it is dropped and restarted again in
+    the background, with exponential backoff, until it comes back. While no
+    worker is left the pool reports itself unavailable and callers use the
+    subprocess path.
+    """
+
+    def __init__(self, workers: int = DEFAULT_SERVER_WORKERS, pandoc_path: str | None = None,
+                 timeout: int = DEFAULT_REQUEST_TIMEOUT):
+        """Create a pool of ``workers`` servers; processes are launched by ``start()``."""
+        self.size = workers
+        self.pandoc_path = pandoc_path or get_capabilities().path
+        self.timeout = timeout
+        self._idle: queue.Queue[PandocServerWorker] = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers: list[PandocServerWorker] = []
+        self._retrying: dict[PandocServerWorker, threading.Timer] = {}
+        self._closed = False
+        self.requests = 0
+        self.failures = 0
+        self.last_error: str | None = None
+
+    def start(self) -> "PandocServerPool":
+        """Launch every worker, keeping the ones that pass their health check."""
+        for _ in range(self.size):
+            worker = PandocServerWorker(self.pandoc_path, self.timeout)
+            try:
+                worker.start()
+            except PandocServerError as e:
+                self.last_error = str(e)
+                continue
+            self._workers.append(worker)
+            self._idle.put(worker)
+        if not self._workers:
+            logger.warning("pandoc server backend unavailable, using subprocess mode: %s", self.last_error)
+        return self
+
+    @property
+    def available(self) -> bool:
+        """Return True while at least one worker is usable."""
+        with self._lock:
+            return bool(self._workers)
+
+    def _drop(self, worker: PandocServerWorker) -> None:
+        worker.stop()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        logger.warning("pandoc server worker dropped, restarting in %gs: %s", _RETRY_INITIAL, self.last_error)
+        self._retry(worker, _RETRY_INITIAL)
+
+    def _retry(self, worker: PandocServerWorker, delay: float) -> None:
+        timer = threading.Timer(delay, self._restart, args=(worker, delay))
+        timer.daemon = True
+        with self._lock:
+            if self._closed:
+                return
+            self._retrying[worker] = timer
+        timer.start()
+
+    def _restart(self, worker: PandocServerWorker, delay: float) -> None:
+        with self._lock:
+            self._retrying.pop(worker, None)
+            if self._closed:
+                return
+        worker.restarts += 1
+        try:
+            worker.start()
+        except PandocServerError as e:
+            self.last_error = str(e)
+            delay = min(delay * 2, _RETRY_MAX)
+            logger.warning("pandoc server worker restart failed, retrying in %gs: %s", delay, e)
+            self._retry(worker, delay)
+            return
+        with self._lock:
+            if not self._closed:
+                self._workers.append(worker)
+                self._idle.put(worker)
+                return
+        worker.stop()
+
+    def _call(self, payload: dict) -> dict:
+        if not self.available:
+            raise PandocServerError(f"no pandoc server workers available ({self.last_error})")
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PandocServerError("timed out waiting for an idle pandoc server worker") from None
+        try:
+            try:
+                return worker.convert(payload)
+            except (OSError, http.client.HTTPException) as e:
+                # Broken connection or dead process: restart the worker and retry once
+                self.last_error = str(e)
+                worker.restarts += 1
+                worker.start()
+                return worker.convert(payload)
+        except PandocServerError as e:
+            self.last_error = str(e)
+            if not worker.is_alive():
+                self._drop(worker)
+                worker = None
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            self.last_error = str(e)
+            self._drop(worker)
+            worker = None
+            raise PandocServerError(str(e)) from e
+        finally:
+            if worker is not None:
+                self._idle.put(worker)
+
+    def convert(self, contents: str, input_format: str, output_format: str, output_file: str | None = None) -> str:
+        """Convert text on a warm server; returns "" when the result was written to ``output_file``.
+
+        Raises PandocServerError on any failure so callers can retry through the subprocess path.
+        """
+        self.requests += 1
+        try:
+            response = self._call({"text": contents, "from": input_format, "to": output_format})
+        except PandocServerError:
+            self.failures += 1
+            raise
+
+        output = response.get("output", "")
+        if response.get("base64"):
+            data = base64.b64decode(output)
+        elif output_file:
+            data = output.encode("utf-8")
+        else:
+            return output
+
+        if not output_file:
+            raise PandocServerError(f"{output_format} output is binary and needs an output file")
+        output_dir = os.path.dirname(os.path.abspath(output_file))
+        os.makedirs(output_dir, exist_ok=True)
+        with open(output_file, "wb") as f:
+            f.write(data)
+        return ""
+
+    def stats(self) -> dict:
+        """Return worker and request counters."""
+        with self._lock:
+            workers = list(self._workers)
+        return {
+            "workers": len(workers),
+            "configured_workers": self.size,
+            "retrying": len(self._retrying),
+            "restarts": sum(worker.restarts for worker in workers),
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+    def close(self) -> None:
+        """Stop every worker."""
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+            timers, self._retrying = list(self._retrying.values()), {}
+        for timer in timers:
+            timer.cancel()
+        for worker in workers:
+            worker.stop()
+
+
+_backend: str | None = None
+_server_pool: PandocServerPool | None = None
+
+
+def configure(backend: str | None = None, workers: int | None = None, pandoc_path: str | None = None) -> str:
+    """Select the conversion backend, starting the pandoc server pool in ``server`` mode.
+
+    Unset arguments fall back to ``MCP_PANDOC_BACKEND`` (default: subprocess)
+    and ``MCP_PANDOC_SERVER_WORKERS``; ``pandoc_path`` defaults to the probed pandoc.
+    """
+    global _backend, _server_pool
+    backend = backend or os.environ.get("MCP_PANDOC_BACKEND", "subprocess")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported backend: '{backend}'. Supported backends are: {', '.join(BACKENDS)}")
+    if _server_pool is not None:
+        _server_pool.close()
+        _server_pool = None
+    _backend = backend
+    if backend == "server":
+        if workers is None:
+            workers = int(os.environ.get("MCP_PANDOC_SERVER_WORKERS", DEFAULT_SERVER_WORKERS))
+        _server_pool = PandocServerPool(workers=workers, pandoc_path=pandoc_path).start()
+    return _backend
+
+
+def get_backend() -> str:
+    """Return the configured conversion backend."""
+    if _backend is None:
+        return configure()
+    return _backend
+
+
+def get_server_pool() -> PandocServerPool | None:
+    """Return the pandoc server pool when the server backend is active and usable."""
+    get_backend()
+    if _server_pool is None or not _server_pool.available:
+        return None
+    return _server_pool
+
+
+@atexit.register
+def _shutdown() -> None:
+    if _server_pool is not None:
+        _server_pool.close()
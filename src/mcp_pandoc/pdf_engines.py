@@ -0,0 +1,190 @@
+"""PDF engine selection: explicit engines and an ``auto`` mode that benchmarks what is installed.
+
+In ``auto`` mode the server detects which of pandoc's PDF engines are on the
+PATH, converts a small document with each of them once and routes every PDF
+job to the fastest engine that supports what the document needs (math, raw
+LaTeX, characters outside Latin-1/Latin Extended-A). The benchmark runs in a
+background thread; jobs that arrive before it finishes use the engines'
+typical speed order instead of waiting for it.
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+
+from .capabilities import PDF_ENGINE_EXECUTABLES, get_capabilities
+from .driver import run_pandoc
+from .metrics import logger
+
+ENGINES = PDF_ENGINE_EXECUTABLES
+DEFAULT_ENGINE = "xelatex"
+AUTO = "auto"
+
+# What each engine can render faithfully
+ENGINE_FEATURES = {
+    "xelatex": {"math", "raw_latex", "unicode"},
+    "lualatex": {"math", "raw_latex", "unicode"},
+    "pdflatex": {"math", "raw_latex"},
+    "wkhtmltopdf": {"unicode"},
+    "weasyprint": {"unicode"},
+    "typst": {"math", "unicode"},
+}
+# Usual ranking, fastest first, used until the benchmark has timed the installed engines
+TYPICAL_RANKING = ("typst", "wkhtmltopdf", "weasyprint", "pdflatex", "xelatex", "lualatex")
+
+BENCHMARK_DOCUMENT = """# Benchmark
+
+A short paragraph with *emphasis*, **strong text** and `code`.
+
+- one
+- two
+- three
+
+| a | b |
+|---|---|
+| 1 | 2 |
+"""
+
+_MATH = re.compile(r"(?<!\\)\$[^$\n]+\$|\\\(|\\\[|\\begin\{(equation|align)")
+_RAW_LATEX = re.compile(r"\\[a-zA-Z]+(\{|\[|\s|$)")
+_TEXT_INPUTS = {"markdown", "html", "latex", "rst", "txt"}
+_MAX_SCAN_BYTES = 4 * 1024 * 1024
+
+
+def engine_args(engine: str) -> list[str]:
+    """Pandoc arguments for building a PDF with ``engine`` (with one-inch margins where supported)."""
+    args = [f"--pdf-engine={engine}"]
+    if engine in ("xelatex", "lualatex", "pdflatex"):
+        args += ["-V", "geometry:margin=1in"]
+    elif engine == "wkhtmltopdf":
+        args += ["-V", "margin-top=1in", "-V", "margin-bottom=1in", "-V", "margin-left=1in", "-V", "margin-right=1in"]
+    return args
+
+
+def installed_engines() -> list[str]:
+    """Return the engines whose executables are on the PATH (as found by the cached pandoc probe)."""
+    return list(get_capabilities().pdf_engines)
+
+
+def document_features(contents: str | None, input_file: str | None, input_format: str) -> set[str]:
+    """Guess which engine features a document needs by scanning its source."""
+    if input_file:
+        if input_format not in _TEXT_INPUTS and os.path.splitext(input_file)[1].lower() not in (
+            ".md", ".markdown", ".html", ".htm", ".tex", ".rst", ".txt"
+        ):
+            # Binary inputs (docx, epub, ...) can contain anything
+            return {"math", "unicode"}
+        with open(input_file, encoding="utf-8", errors="replace") as f:
+            text = f.read(_MAX_SCAN_BYTES)
+        if input_file.endswith(".tex"):
+            input_format = "latex"
+    else:
+        text = contents or ""
+
+    features = set()
+    if _MATH.search(text):
+        features.add("math")
+    if input_format == "latex" or (input_format == "markdown" and _RAW_LATEX.search(text)):
+        features.add("raw_latex")
+    if any(ord(char) > 0x17F for char in text):
+        features.add("unicode")
+    return features
+
+
+def benchmark(engines: list[str] | None = None) -> dict[str, float]:
+    """Convert the benchmark document with every engine; returns seconds per engine that succeeded."""
+    timings = {}
+    with tempfile.TemporaryDirectory(prefix="mcp-pandoc-engines-") as work_dir:
+        for engine in engines if engines is not None else installed_engines():
+            output_file = os.path.join(work_dir, f"{engine}.pdf")
+            started = time.perf_counter()
+            try:
+                run_pandoc(
+                    ["--from=markdown", f"--output={output_file}", *engine_args(engine),
+                     "--metadata", "title=Benchmark"],
+                    input=BENCHMARK_DOCUMENT.encode("utf-8"),
+                )
+            except Exception as e:
+                logger.warning("PDF engine %s failed the startup benchmark: %s", engine, e)
+                continue
+            timings[engine] = round(time.perf_counter() - started, 3)
+    return timings
+
+
+class EngineSelector:
+    """Picks the PDF engine for each job; benchmarks installed engines once, in the background, for ``auto``."""
+
+    def __init__(self, default: str = DEFAULT_ENGINE):
+        """Create a selector whose jobs without ``pdf_engine`` use ``default``."""
+        if default != AUTO and default not in ENGINES:
+            raise ValueError(
+                f"Unsupported PDF engine: '{default}'. Supported engines are: {', '.join((AUTO, *ENGINES))}"
+            )
+        self.default = default
+        self.timings: dict[str, float] | None = None
+        self._benchmark: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def _run_benchmark(self) -> None:
+        self.timings = benchmark()
+
+    def ranking(self) -> list[str]:
+        """Return working engines, fastest first.
+
+        Until the benchmark has finished (it is started on first use) this is
+        the installed engines in ``TYPICAL_RANKING`` order, so no job waits for it.
+        """
+        timings = self.timings
+        if timings is not None:
+            return sorted(timings, key=timings.get)
+        self.start_benchmark()
+        installed = installed_engines()
+        return [engine for engine in TYPICAL_RANKING if engine in installed]
+
+    def start_benchmark(self) -> None:
+        """Run the benchmark in the background, once, so that ``auto`` jobs don't pay for it."""
+        with self._lock:
+            if self._benchmark is not None or self.timings is not None:
+                return
+            self._benchmark = threading.Thread(
+                target=self._run_benchmark, name="mcp-pandoc-pdf-benchmark", daemon=True
+            )
+        self._benchmark.start()
+
+    def choose(self, requested: str | None, features: set[str]) -> str:
+        """Resolve ``requested`` (None, ``auto`` or an engine name) to a concrete engine."""
+        requested = requested or self.default
+        if requested != AUTO:
+            return requested
+        ranking = self.ranking()
+        for engine in ranking:
+            if features <= ENGINE_FEATURES[engine]:
+                return engine
+        if ranking:
+            # Nothing covers every feature; the fastest LaTeX engine degrades most gracefully
+            return next((engine for engine in ranking if "raw_latex" in ENGINE_FEATURES[engine]), ranking[0])
+        raise ValueError(f"No working PDF engine found (looked for: {', '.join(ENGINES)})")
+
+    def stats(self) -> dict:
+        """Return the default engine and benchmark timings (None until the benchmark has finished)."""
+        return {"default": self.default, "timings": self.timings}
+
+
+_selector: EngineSelector | None = None
+
+
+def configure(default: str | None = None) -> EngineSelector:
+    """Set the engine used when a job doesn't name one (falls back to ``MCP_PANDOC_PDF_ENGINE``, default: xelatex)."""
+    global _selector
+    _selector = EngineSelector(default or os.environ.get("MCP_PANDOC_PDF_ENGINE", DEFAULT_ENGINE))
+    if _selector.default == AUTO:
+        _selector.start_benchmark()
+    return _selector
+
+
+def get_selector() -> EngineSelector:
+    """Return the process-wide engine selector."""
+    if _selector is None:
+        return configure()
+    return _selector
@@ -0,0 +1,150 @@
+"""Bounded worker pool for running blocking pandoc conversions off the event loop."""
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import os
+
+from .limits import current_scope, run_with_limits
+from .metrics import stage
+
+EXECUTOR_KINDS = ("thread", "process")
+DEFAULT_MAX_QUEUE = 64
+
+
+def _env_int(name: str, default: int | None) -> int | None:
+    """Read a non-negative integer from the environment, falling back to ``default``."""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        parsed = int(value)
+    except ValueError as e:
+        raise ValueError(f"{name} must be an integer, got: {value!r}") from e
+    if parsed < 0:
+        raise ValueError(f"{name} must not be negative, got: {parsed}")
+    return parsed
+
+
+class ConversionPool:
+    """Run blocking conversions in a thread or process pool with a concurrency cap.
+
+    At most ``max_workers`` conversions run at once. Up to ``max_queue`` further
+    callers may wait for a free slot; beyond that, callers fail fast instead of
+    piling up behind a long PDF build.
+    """
+
+    def __init__(self, max_workers: int | None = None, executor: str = "thread",
+                 max_queue: int = DEFAULT_MAX_QUEUE):
+        """Create a pool; the underlying executor is started on first use."""
+        if executor not in EXECUTOR_KINDS:
+            raise ValueError(
+                f"Unsupported executor: '{executor}'. Supported executors are: {', '.join(EXECUTOR_KINDS)}"
+            )
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor_kind = executor
+        self.max_queue = max_queue
+        self._executor: concurrent.futures.Executor | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._waiting = 0
+        self._active = 0
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="mcp-pandoc"
+                )
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Semaphores bind to the loop they are first awaited on, so keep one per running loop.
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        return self._semaphore
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Reserve a conversion slot, raising ValueError when the wait queue is full."""
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self._waiting >= self.max_queue:
+            raise ValueError(
+                f"Conversion queue is full ({self._active} running, {self._waiting} waiting). "
+                "Try again once current conversions finish."
+            )
+        self._waiting += 1
+        try:
+            with stage("queue"):
+                await semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            semaphore.release()
+
+    async def run(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` in the pool once a slot is free and return its result."""
+        async with self.slot():
+            loop = asyncio.get_running_loop()
+            call = functools.partial(func, *args, **kwargs)
+            if self.executor_kind == "thread":
+                # Threads see the caller's trace, so stages and child processes inside ``func`` are recorded
+                call = functools.partial(contextvars.copy_context().run, call)
+            else:
+                # Worker processes don't see the caller's scope; its limits travel with the call
+                scope = current_scope()
+                call = functools.partial(run_with_limits, scope.limits if scope is not None else None, call)
+            return await loop.run_in_executor(self._get_executor(), call)
+
+    def stats(self) -> dict:
+        """Return a snapshot of the pool configuration and current load."""
+        return {
+            "executor": self.executor_kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "waiting": self._waiting,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the underlying executor."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+_pool: ConversionPool | None = None
+
+
+def configure(max_workers: int | None = None, executor: str | None = None,
+              max_queue: int | None = None) -> ConversionPool:
+    """(Re)create the process-wide pool.
+
+    Unset arguments fall back to ``MCP_PANDOC_WORKERS``, ``MCP_PANDOC_EXECUTOR``
+    and ``MCP_PANDOC_MAX_QUEUE``.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+    _pool = ConversionPool(
+        max_workers=max_workers or _env_int("MCP_PANDOC_WORKERS", None),
+        executor=executor or os.environ.get("MCP_PANDOC_EXECUTOR", "thread"),
+        max_queue=max_queue if max_queue is not None else _env_int("MCP_PANDOC_MAX_QUEUE", DEFAULT_MAX_QUEUE),
+    )
+    return _pool
+
+
+def get_pool() -> ConversionPool:
+    """Return the process-wide pool, creating it from the environment on first use."""
+    if _pool is None:
+        return configure()
+    return _pool
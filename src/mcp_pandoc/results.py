@@ -0,0 +1,226 @@
+"""Server-side storage for large converted results, read back in pages.
+
+Converted text above the page size is not sent in one MCP message. It is
+written to a spill file and the client receives a result id plus the first
+page; the rest is read with ``read-conversion-result`` by character offset.
+Only the requested page is ever loaded back into memory.
+
+Results created while an owner is set (see ``owned_by``) are pinned: they do
+not expire or count against ``max_results`` until their owner releases them.
+Background jobs own the results of their conversions this way, so a finished
+job's result_id stays readable for as long as the job itself.
+
+The store also carries the size limit for outputs returned inline as embedded
+resources (``embed_output``), the other way results bypass a file on disk.
+"""
+import atexit
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+DEFAULT_PAGE_CHARS = 100_000
+DEFAULT_MAX_RESULTS = 32
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_MAX_EMBED_BYTES = 20 * 1024 * 1024
+# A byte offset is recorded every _INDEX_STRIDE characters so a page read only decodes from the nearest mark
+_INDEX_STRIDE = 64 * 1024
+
+# The owner that results put by the running task are pinned to
+_owner: ContextVar[str | None] = ContextVar("mcp_pandoc_result_owner", default=None)
+
+
+@dataclass
+class StoredResult:
+    """A converted result kept on disk."""
+
+    result_id: str
+    path: str
+    total_chars: int
+    byte_index: list[int]
+    created: float
+    # Owners that keep the result alive regardless of its age and the result limit
+    owners: set[str] = field(default_factory=set)
+
+
+class ResultStore:
+    """Spill large results to disk and serve them by character offset.
+
+    At most ``max_results`` results are kept; the oldest are dropped first,
+    and results older than ``ttl_seconds`` expire. Pinned results are kept
+    until every owner has released them.
+    """
+
+    def __init__(self, page_chars: int = DEFAULT_PAGE_CHARS, max_results: int = DEFAULT_MAX_RESULTS,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS, directory: str | None = None,
+                 max_embed_bytes: int = DEFAULT_MAX_EMBED_BYTES):
+        """Create a store; the spill directory is created on first use."""
+        self.page_chars = page_chars
+        self.max_embed_bytes = max_embed_bytes
+        self.max_results = max_results
+        self.ttl_seconds = ttl_seconds
+        self._directory = directory
+        self._owns_directory = directory is None
+        self._results: dict[str, StoredResult] = {}
+        self._lock = threading.Lock()
+
+    def needs_paging(self, text: str | None) -> bool:
+        """Return True if ``text`` is too large for a single message."""
+        return bool(self.page_chars) and text is not None and len(text) > self.page_chars
+
+    def _get_directory(self) -> str:
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="mcp-pandoc-results-")
+        os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    def put(self, text: str) -> StoredResult:
+        """Write ``text`` to a spill file and return its handle."""
+        result_id = uuid.uuid4().hex
+        path = os.path.join(self._get_directory(), result_id + ".txt")
+        byte_index = []
+        position = 0
+        with open(path, "wb") as f:
+            for start in range(0, len(text), _INDEX_STRIDE):
+                byte_index.append(position)
+                position += f.write(text[start:start + _INDEX_STRIDE].encode("utf-8"))
+        stored = StoredResult(result_id, path, len(text), byte_index, time.monotonic())
+        owner = _owner.get()
+        if owner is not None:
+            stored.owners.add(owner)
+        with self._lock:
+            self._results[result_id] = stored
+            self._evict_locked()
+        return stored
+
+    def _evict_locked(self) -> None:
+        now = time.monotonic()
+        unpinned = [rid for rid, stored in self._results.items() if not stored.owners]
+        expired = [rid for rid in unpinned if now - self._results[rid].created > self.ttl_seconds]
+        overflow = len(unpinned) - len(expired) - self.max_results
+        if overflow > 0:
+            alive = [rid for rid in unpinned if rid not in expired]
+            expired.extend(alive[:overflow])
+        for result_id in expired:
+            stored = self._results.pop(result_id)
+            with contextlib.suppress(OSError):
+                os.unlink(stored.path)
+
+    def read(self, result_id: str, offset: int = 0, length: int | None = None) -> dict:
+        """Return up to ``length`` characters (at most one page) starting at ``offset``."""
+        with self._lock:
+            self._evict_locked()
+            stored = self._results.get(result_id)
+        if stored is None:
+            raise ValueError(f"Unknown or expired result_id: {result_id}")
+        if offset < 0 or offset > stored.total_chars:
+            raise ValueError(f"offset must be between 0 and {stored.total_chars}")
+        length = min(length or self.page_chars, self.page_chars)
+        if length < 1:
+            raise ValueError("length must be a positive integer")
+
+        mark = min(offset // _INDEX_STRIDE, len(stored.byte_index) - 1) if stored.byte_index else 0
+        text = ""
+        if stored.byte_index:
+            with open(stored.path, "rb") as raw:
+                raw.seek(stored.byte_index[mark])
+                reader = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+                reader.read(offset - mark * _INDEX_STRIDE)
+                text = reader.read(length)
+                reader.detach()
+        end = offset + len(text)
+        return {
+            "result_id": result_id,
+            "offset": offset,
+            "total_chars": stored.total_chars,
+            "next_offset": end if end < stored.total_chars else None,
+            "text": text,
+        }
+
+    def release(self, owner: str) -> None:
+        """Unpin every result ``owner`` holds; they expire and are evicted like any other from now on."""
+        with self._lock:
+            for stored in self._results.values():
+                stored.owners.discard(owner)
+            self._evict_locked()
+
+    def discard(self, result_id: str) -> None:
+        """Forget a result and delete its spill file."""
+        with self._lock:
+            stored = self._results.pop(result_id, None)
+        if stored is not None:
+            with contextlib.suppress(OSError):
+                os.unlink(stored.path)
+
+    def stats(self) -> dict:
+        """Return the number of stored results and the paging configuration."""
+        with self._lock:
+            return {
+                "results": len(self._results),
+                "pinned": sum(1 for stored in self._results.values() if stored.owners),
+                "page_chars": self.page_chars,
+                "max_results": self.max_results,
+                "max_embed_bytes": self.max_embed_bytes,
+            }
+
+    def close(self) -> None:
+        """Delete every spill file (and the spill directory if the store created it)."""
+        with self._lock:
+            results, self._results = self._results, {}
+        for stored in results.values():
+            with contextlib.suppress(OSError):
+                os.unlink(stored.path)
+        if self._owns_directory and self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+
+@contextlib.contextmanager
+def owned_by(owner: str):
+    """Pin the results put while the block runs (in this task and its threads) to ``owner``."""
+    token = _owner.set(owner)
+    try:
+        yield
+    finally:
+        _owner.reset(token)
+
+
+_store: ResultStore | None = None
+
+
+def configure(page_chars: int | None = None, max_embed_bytes: int | None = None) -> ResultStore:
+    """(Re)create the process-wide result store.
+
+    ``page_chars`` falls back to ``MCP_PANDOC_RESULT_PAGE_CHARS`` (0 disables
+    paging) and ``max_embed_bytes`` to ``MCP_PANDOC_MAX_EMBED_BYTES``.
+    """
+    global _store
+    if _store is not None:
+        _store.close()
+    if page_chars is None:
+        page_chars = int(os.environ.get("MCP_PANDOC_RESULT_PAGE_CHARS", DEFAULT_PAGE_CHARS))
+    if page_chars < 0:
+        raise ValueError(f"page_chars must not be negative, got: {page_chars}")
+    if max_embed_bytes is None:
+        max_embed_bytes = int(os.environ.get("MCP_PANDOC_MAX_EMBED_BYTES", DEFAULT_MAX_EMBED_BYTES))
+    _store = ResultStore(page_chars=page_chars, max_embed_bytes=max_embed_bytes)
+    return _store
+
+
+def get_store() -> ResultStore:
+    """Return the process-wide result store, creating it from the environment on first use."""
+    if _store is None:
+        return configure()
+    return _store
+
+
+@atexit.register
+def _shutdown() -> None:
+    if _store is not None:
+        _store.close()
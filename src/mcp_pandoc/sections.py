@@ -0,0 +1,292 @@
+"""Parallel sectioned reading of large markdown and HTML inputs.
+
+Pandoc converts a document on a single core. For very large markdown or HTML
+inputs the server can instead split the source at its top-level headings into
+a few sections, parse each section into a JSON AST in a separate pandoc
+process, and merge the ASTs back into one document that a single writer pass
+turns into the target format.
+
+Merging ASTs rather than concatenating written output keeps the document
+consistent: footnotes are numbered once across the whole document, header
+identifiers that collide between sections are renamed the way pandoc would
+(``intro``, ``intro-1``, ...), and markdown reference link and footnote
+definitions are made visible to every section wherever they appear.
+
+Implicit header references (``[Intro]``, ``[the intro][Intro]``) may point
+at a heading in another section, and a heading with the same text in an
+earlier section wins over one in their own. Every section therefore gets a
+reference definition for each heading of the document outside block quotes
+and lists, with a placeholder target that ``merge_asts`` replaces with the
+heading's final identifier.
+Explicit targets such as ``#intro`` already name the identifiers of the whole
+document, which the renaming reproduces, so they are left as written.
+"""
+import json
+import os
+import re
+import time
+from urllib.parse import quote, unquote
+
+from .driver import run_pandoc
+from .metrics import stage
+
+SECTION_FORMATS = ("markdown", "html")
+MAX_SECTIONS = 64
+_EXTENSION_FORMATS = {".md": "markdown", ".markdown": "markdown", ".html": "html", ".htm": "html"}
+
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_ATX = re.compile(r"^(#{1,6})(?:[ \t]|$)")
+_SETEXT = re.compile(r"^ {0,3}(=+|-+)[ \t]*$")
+# Reference link and footnote definitions, which a section may use without containing them
+_DEFINITION = re.compile(r"^ {0,3}\[(\^[^\]]+|[^\]^][^\]]*)\]:")
+# A reference link title on the line after its URL
+_TITLE = re.compile(r"^[ \t]+[\"'(]")
+_FRONT_MATTER_END = re.compile(r"^(---|\.\.\.)[ \t]*$")
+_HTML_HEADING = re.compile(r"<h([1-6])[\s>]", re.IGNORECASE)
+# The text of an ATX heading, without its closing hashes
+_ATX_TEXT = re.compile(r"^#{1,6}[ \t]*(.*?)(?:[ \t]+#+)?[ \t]*$")
+_ATTRIBUTES = re.compile(r"[ \t]*\{[^{}]*\}$")
+_SUFFIXED = re.compile(r"^(.*)-(\d+)$")
+# Target of the reference definitions that stand in for implicit header references until the merge
+_HEADING_TARGET = "mcp-pandoc-heading:"
+# Markup and punctuation that differ between a heading's source text and its parsed inlines
+_KEY_IGNORED = str.maketrans("", "", "*_`~\\\"'\u2018\u2019\u201c\u201d")
+
+
+def section_format(input_file: str | None, input_format: str) -> str:
+    """Return the input's format for splitting, raising ValueError for anything but markdown or HTML."""
+    if input_file:
+        # Pandoc picks the reader for files by extension, so the split has to as well
+        input_format = _EXTENSION_FORMATS.get(os.path.splitext(input_file)[1].lower())
+    if input_format not in SECTION_FORMATS:
+        raise ValueError("parallel_sections is only supported for markdown (.md) and html (.html) input")
+    return input_format
+
+
+def _heading_text(line: str) -> str:
+    """Return the text of an ATX heading line, without its closing hashes and attributes."""
+    return _ATTRIBUTES.sub("", _ATX_TEXT.match(line.rstrip("\r\n")).group(1))
+
+
+def _split_markdown(text: str) -> tuple[list[tuple[int, int]], list[str], str, list[tuple[str, str]]]:
+    """Return (offset, level) and text of each heading, the text without definitions and the definitions.
+
+    Definitions are (label, definition) pairs.
+    """
+    lines = text.splitlines(keepends=True)
+    headings = []
+    titles = []
+    body = []
+    definitions = []
+    offset = 0
+    fence = None
+    # "note", "reference" or "title" (a reference after its title) inside a definition taken out of the body
+    in_definition = None
+    index = 0
+    # YAML front matter stays at the start of the first section
+    if lines and lines[0].rstrip() == "---":
+        for end in range(1, len(lines)):
+            if _FRONT_MATTER_END.match(lines[end]):
+                body.extend(lines[:end + 1])
+                offset = sum(len(line) for line in lines[:end + 1])
+                index = end + 1
+                break
+
+    for line in lines[index:]:
+        if fence:
+            if line.lstrip().startswith(fence):
+                fence = None
+        elif (in_definition == "note" and (line.startswith(("    ", "\t")) or not line.strip())
+              or in_definition == "reference" and _TITLE.match(line)):
+            # Indented continuation of a footnote, or the title of a reference link
+            label, definition = definitions[-1]
+            definitions[-1] = (label, definition + line)
+            in_definition = in_definition if in_definition == "note" else "title"
+            continue
+        elif (match := _DEFINITION.match(line)) and (
+            # Definitions cannot interrupt a paragraph
+            in_definition or not body or not body[-1].strip() or _ATX.match(body[-1])
+        ):
+            in_definition = "note" if match.group(1).startswith("^") else "reference"
+            definitions.append((match.group(1), line))
+            continue
+        elif match := _FENCE.match(line):
+            fence = match.group(1)[0] * 3
+        elif match := _ATX.match(line):
+            headings.append((offset, len(match.group(1))))
+            titles.append(_heading_text(line))
+        elif (match := _SETEXT.match(line)) and body and body[-1].strip() and not _ATX.match(body[-1]):
+            previous = offset - len(body[-1])
+            headings.append((previous, 1 if match.group(1)[0] == "=" else 2))
+            titles.append(_ATTRIBUTES.sub("", body[-1].strip()))
+        in_definition = None
+        body.append(line)
+        offset += len(line)
+    return headings, titles, "".join(body), definitions
+
+
+def _key(text: str) -> str:
+    """Normalize a heading's text the way reference labels match: ignoring case, spacing and inline markup."""
+    return " ".join(text.translate(_KEY_IGNORED).casefold().split())
+
+
+def _heading_definitions(titles: list[str], labels: list[str]) -> list[str]:
+    """Return a placeholder reference definition for each heading text that no explicit definition claims.
+
+    An explicit definition takes precedence over a heading with the same
+    text, in a single pass as well.
+    """
+    taken = {_key(label) for label in labels}
+    definitions = []
+    for title in titles:
+        key = _key(title)
+        # Labels can't contain brackets; such headings are left to pandoc within their section
+        if not key or key in taken or "[" in title or "]" in title:
+            continue
+        taken.add(key)
+        # After a blank line, so a footnote definition before it can't take it in as a lazy continuation
+        definitions.append(f"\n[{title}]: <{_HEADING_TARGET}{quote(title)}>\n")
+    return definitions
+
+
+def split_sections(text: str, input_format: str, parts: int) -> list[str]:
+    """Split ``text`` at its top-level headings into at most ``parts`` sections of similar size.
+
+    Markdown reference link definitions are appended to every section, and
+    footnote definitions to the sections that cite them. So are definitions
+    that stand in for implicit references to the document's headings (see
+    ``merge_asts``).
+    """
+    definitions = []
+    headings_defined = []
+    if input_format == "markdown":
+        headings, titles, text, definitions = _split_markdown(text)
+        headings_defined = _heading_definitions(titles, [label for label, _definition in definitions])
+    else:
+        headings = [(match.start(), int(match.group(1))) for match in _HTML_HEADING.finditer(text)]
+
+    def with_definitions(section: str) -> str:
+        used = [
+            definition for label, definition in definitions
+            if not label.startswith("^") or f"[{label}]" in section
+        ]
+        used.extend(headings_defined)
+        return section + "\n\n" + "".join(used) if used else section
+
+    if not headings:
+        return [with_definitions(text)]
+
+    top_level = min(level for _offset, level in headings)
+    boundaries = [offset for offset, level in headings if level == top_level and offset > 0]
+    # Cut at the heading closest to each multiple of the target size
+    target = len(text) / max(parts, 1)
+    cuts = []
+    for part in range(1, parts):
+        candidates = [offset for offset in boundaries if not cuts or offset > cuts[-1]]
+        if not candidates:
+            break
+        cuts.append(min(candidates, key=lambda offset, wanted=part * target: abs(offset - wanted)))
+    starts = [0, *cuts]
+    ends = [*cuts, len(text)]
+    return [with_definitions(text[start:end]) for start, end in zip(starts, ends, strict=True)]
+
+
+def load_sections(contents: str | None, input_file: str | None, input_format: str,
+                  parts: int) -> tuple[str, list[str]]:
+    """Read the input and split it into sections; returns the input format and the sections."""
+    input_format = section_format(input_file, input_format)
+    if input_file:
+        with open(input_file, encoding="utf-8") as f:
+            contents = f.read()
+    return input_format, split_sections(contents, input_format, parts)
+
+
+def read_section(text: str, input_format: str, reader_args: list[str]) -> tuple[str, float]:
+    """Parse one section into a pandoc JSON AST; returns the AST and the seconds it took.
+
+    Kept at module level so it can be shipped to a process pool worker.
+    """
+    started = time.perf_counter()
+    # A trailing --to wins over anything a defaults file sets
+    with stage("read"):
+        ast_json = run_pandoc(
+            [f"--from={input_format}", *reader_args, "--to=json"], input=text.encode("utf-8")
+        ).decode("utf-8")
+    return ast_json, time.perf_counter() - started
+
+
+def _walk(node, visit) -> None:
+    """Call ``visit`` on every AST element (a dict with a ``t`` tag) under ``node``, in document order."""
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(reversed(item))
+        elif isinstance(item, dict):
+            if "t" in item:
+                visit(item)
+            if isinstance(item.get("c"), list | dict):
+                stack.append(item["c"])
+
+
+def _stringify(inlines: list) -> str:
+    """Return the plain text of a list of inline elements."""
+    parts = []
+
+    def visit(element: dict) -> None:
+        if element["t"] == "Str":
+            parts.append(element["c"])
+        elif element["t"] in ("Code", "Math", "RawInline"):
+            parts.append(element["c"][1])
+        elif element["t"] in ("Space", "SoftBreak", "LineBreak"):
+            parts.append(" ")
+
+    _walk(inlines, visit)
+    return "".join(parts)
+
+
+def merge_asts(asts: list[str]) -> str:
+    """Merge section ASTs into one document; metadata comes from the first section.
+
+    Header identifiers already used by an earlier section get the next free
+    numeric suffix, as pandoc's reader would have assigned in a single pass.
+    Once every identifier is final, links to a heading placeholder (see
+    ``split_sections``) are pointed at the first heading with that text, as
+    pandoc resolves an implicit header reference; a placeholder without a
+    matching heading becomes plain text.
+    """
+    seen: set[str] = set()
+    targets: dict[str, str] = {}
+    placeholders: list[dict] = []
+
+    def visit(element: dict) -> None:
+        if element["t"] == "Header":
+            attr = element["c"][1]
+            identifier = attr[0]
+            if identifier in seen:
+                # "intro-1" from a later section continues the numbering of the first "intro"
+                suffixed = _SUFFIXED.match(identifier)
+                base = suffixed.group(1) if suffixed and suffixed.group(1) in seen else identifier
+                number = 1
+                while f"{base}-{number}" in seen:
+                    number += 1
+                identifier = attr[0] = f"{base}-{number}"
+            if identifier:
+                seen.add(identifier)
+                targets.setdefault(_key(_stringify(element["c"][2])), identifier)
+        elif element["t"] == "Link" and element["c"][2][0].startswith(_HEADING_TARGET):
+            placeholders.append(element)
+
+    documents = [json.loads(ast_json) for ast_json in asts]
+    blocks = []
+    for document in documents:
+        _walk(document["blocks"], visit)
+        blocks.extend(document["blocks"])
+    for link in placeholders:
+        identifier = targets.get(_key(unquote(link["c"][2][0][len(_HEADING_TARGET):])))
+        if identifier is None:
+            link["t"], link["c"] = "Span", link["c"][:2]
+        else:
+            link["c"][2][0] = "#" + identifier
+    merged = {**documents[0], "blocks": blocks}
+    return json.dumps(merged, ensure_ascii=False, separators=(",", ":"))
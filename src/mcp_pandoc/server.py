@@ -1,16 +1,257 @@
 """mcp-pandoc server module."""
+import asyncio
+import base64
+import hashlib
+import json
 import os
+import resource
+import shutil
+import time
+from dataclasses import dataclass, replace
 
-import mcp.server.stdio
 import mcp.types as types
-import pypandoc
-import yaml
 from mcp.server import NotificationOptions, Server
 from mcp.server.models import InitializationOptions
 
+from .assets import get_assets
+from .cache import ResultCache, file_digest, file_fingerprint, get_cache, unshare
+from .capabilities import get_capabilities
+from .chapters import MAX_CHAPTERS, chapter_key, get_chapter_cache
+from .directory import INPUT_PATTERNS, Manifest, find_inputs, output_path_for
+from .driver import FILTER_EXIT_CODES, PandocError, get_driver, run_pandoc, run_pandoc_async, run_pypandoc
+from .filters import (
+    apply_filters,
+    convert_with_filters,
+    filter_libraries,
+    probe_reader_options,
+    read_ast_with_filters,
+)
+from .filters import get_mode as get_filter_mode
+from .flights import get_flights
+from .jobs import MAX_WAIT_SECONDS, Job, get_jobs
+from .latex_format import LatexFormatError, convert_pdf_with_format, get_format_dir
+from .limits import ProcessKilledError, get_limits, kill_reason, supervise
+from .metrics import current_trace, get_registry, logger, stage, trace
+from .pandoc_server import PandocServerError, get_server_pool
+from .pdf_engines import AUTO, DEFAULT_ENGINE, ENGINES, document_features, engine_args, get_selector
+from .pool import get_pool
+from .results import get_store, owned_by
+from .sections import MAX_SECTIONS, load_sections, merge_asts, read_section, section_format
+
 server = Server("mcp-pandoc")
 
 
+def pandoc_args(contents: str | None, input_file: str | None, input_format: str, output_format: str,
+                output_file: str | None, extra_args: list[str],
+                to_bytes: bool = False) -> tuple[list[str], bytes | None]:
+    """Return the pandoc arguments and stdin for a conversion.
+
+    With ``to_bytes`` the output goes to stdout whatever the format; otherwise
+    to ``output_file`` if given.
+    """
+    args = [f"--to={output_format}"]
+    if output_file and not to_bytes:
+        args.append(f"--output={output_file}")
+    args += extra_args
+    if to_bytes:
+        args.append("--output=-")
+    if input_file:
+        return [*args, input_file], None
+    return [f"--from={input_format}", *args], contents.encode("utf-8")
+
+
+def run_pandoc_text(contents: str | None, input_file: str | None, input_format: str, output_format: str,
+                    output_file: str | None, extra_args: list[str]) -> str:
+    """Run one blocking pandoc conversion; returns the output text, or "" when writing to ``output_file``.
+
+    pandoc is started directly rather than through pypandoc, so that the
+    trace gets its ``wait4`` resource usage. Kept at module level so it can be
+    shipped to a process pool worker.
+    """
+    args, stdin = pandoc_args(contents, input_file, input_format, output_format, output_file, extra_args)
+    output_dir = os.path.dirname(os.path.abspath(output_file)) if output_file else None
+    with stage("pandoc"):
+        output = run_pandoc(args, input=stdin, output_dir=output_dir)
+    return "" if output_file else output.decode("utf-8", errors="replace")
+
+
+def run_pandoc_bytes(contents: str | None, input_file: str | None, input_format: str, output_format: str,
+                     extra_args: list[str]) -> bytes:
+    """Run pandoc with the output on stdout and return it as bytes, binary formats included.
+
+    Kept at module level so it can be shipped to a process pool worker.
+    """
+    args, stdin = pandoc_args(contents, input_file, input_format, output_format, None, extra_args, to_bytes=True)
+    with stage("pandoc"):
+        return run_pandoc(args, input=stdin)
+
+
+async def run_conversion(contents: str | None, input_file: str | None, input_format: str, output_format: str,
+                         output_file: str | None, extra_args: list[str], to_bytes: bool = False) -> str | bytes:
+    """Run one pandoc conversion with the configured driver, holding a conversion slot while it runs.
+
+    Returns bytes with ``to_bytes``, else the output text ("" when writing to ``output_file``).
+    """
+    driver = get_driver()
+    if driver == "pypandoc" and not to_bytes:
+        return await get_pool().run(
+            run_pypandoc,
+            contents=contents,
+            input_file=input_file,
+            input_format=input_format,
+            output_format=output_format,
+            output_file=output_file,
+            extra_args=extra_args,
+        )
+    if driver in ("blocking", "pypandoc"):
+        if to_bytes:
+            return await get_pool().run(
+                run_pandoc_bytes,
+                contents=contents,
+                input_file=input_file,
+                input_format=input_format,
+                output_format=output_format,
+                extra_args=extra_args,
+            )
+        return await get_pool().run(
+            run_pandoc_text,
+            contents=contents,
+            input_file=input_file,
+            input_format=input_format,
+            output_format=output_format,
+            output_file=output_file,
+            extra_args=extra_args,
+        )
+    args, stdin = pandoc_args(contents, input_file, input_format, output_format, output_file, extra_args, to_bytes)
+    output_dir = os.path.dirname(os.path.abspath(output_file)) if output_file else None
+    async with get_pool().slot():
+        with stage("pandoc"):
+            output = await run_pandoc_async(args, stdin, output_dir)
+    if to_bytes:
+        return output
+    return "" if output_file else output.decode("utf-8", errors="replace")
+
+
+CONVERT_CONTENTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "contents": {
+            "type": "string",
+            "description": "The content to be converted (required if input_file not provided)"
+        },
+        "input_file": {
+            "type": "string",
+            "description": (
+                "Complete path to input file including filename and extension "
+                "(e.g., '/path/to/input.md')"
+            )
+        },
+        "input_files": {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 1,
+            "maxItems": MAX_CHAPTERS,
+            "description": (
+                "Chapter files, in order, to build into one output (instead of contents or input_file); "
+                "each chapter is parsed once and cached, so rebuilding after an edit re-reads only that chapter"
+            )
+        },
+        "input_format": {
+            "type": "string",
+            "description": "Source format of the content (defaults to markdown)",
+            "default": "markdown",
+            "enum": ["markdown", "html", "pdf", "docx", "rst", "latex", "epub", "txt", "ipynb", "odt"]
+        },
+        "output_format": {
+            "type": "string",
+            "description": "Desired output format (defaults to markdown)",
+            "default": "markdown",
+            "enum": ["markdown", "html", "pdf", "docx", "rst", "latex", "epub", "txt", "ipynb", "odt"]
+        },
+        "output_file": {
+            "type": "string",
+            "description": (
+                "Complete path where to save the output including filename and extension "
+                "(required for pdf, docx, rst, latex, epub formats unless embed_output is set)"
+            )
+        },
+        "pdf_engine": {
+            "type": "string",
+            "enum": [AUTO, *ENGINES],
+            "description": (
+                "PDF engine for pdf output (defaults to the server's default, normally xelatex). 'auto' picks "
+                "the fastest installed engine that supports what the document needs"
+            )
+        },
+        "embed_output": {
+            "type": "boolean",
+            "description": (
+                "Return the converted document in the reply as an embedded resource (base64 blob for "
+                "docx, pdf, odt and epub) instead of writing output_file"
+            )
+        },
+        "reference_doc": {
+            "type": "string",
+            "description": (
+                "Path to a reference document to use for styling "
+                "(supported for docx output format)"
+            )
+        },
+        "parallel_sections": {
+            "type": "integer",
+            "minimum": 2,
+            "maximum": MAX_SECTIONS,
+            "description": (
+                "Split a large markdown or html input at its top-level headings into up to this many sections "
+                "and parse them in parallel before writing the output in one pass"
+            )
+        },
+        "filters": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": (
+                "List of Pandoc filter paths to apply during conversion. "
+                "Filters are applied in the order specified."
+            )
+        },
+        "defaults_file": {
+            "type": "string",
+            "description": (
+                "Path to a Pandoc defaults file (YAML) containing conversion options. "
+                "Similar to using pandoc -d option."
+            )
+        },
+        "outputs": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "output_format": {
+                        "type": "string",
+                        "enum": ["markdown", "html", "pdf", "docx", "rst", "latex", "epub", "txt", "ipynb", "odt"]
+                    },
+                    "output_file": {"type": "string"},
+                    "reference_doc": {"type": "string"},
+                    "pdf_engine": {"type": "string", "enum": [AUTO, *ENGINES]},
+                    "embed_output": {"type": "boolean"}
+                },
+                "required": ["output_format"],
+                "additionalProperties": False
+            },
+            "description": (
+                "Write several formats from one parse of the input, instead of output_format/output_file. "
+                "Each entry takes output_format, output_file and (for docx) reference_doc. The input is read "
+                "once, filters run once per distinct output format, and the outputs are written in parallel. "
+                "Multi-output calls skip the precompiled LaTeX formats, sharing with identical calls in flight "
+                "and the pandoc server backend."
+            )
+        }
+    },
+    "additionalProperties": False
+}
+
+
 @server.list_tools()
 async def handle_list_tools() -> list[types.Tool]:
     """List available tools.
@@ -85,7 +326,9 @@ async def handle_list_tools() -> list[types.Tool]:
                 "   * Filters must be executable Python scripts\n"
                 "   * Use absolute paths or paths relative to current working directory\n"
                 "   * Filters are applied in the order specified\n"
-                "   * Common filters: mermaid conversion, color processing, table formatting\n\n"
+                "   * Common filters: mermaid conversion, color processing, table formatting\n"
+                "   * Diagram filters can keep rendered images in the server's asset cache (MCP_PANDOC_ASSET_DIR), "
+                "so each diagram is rendered once\n\n"
                 "📄 Defaults File Support (NEW FEATURE):\n"
                 "7. Pandoc Defaults File Support:\n"
                 "   * Use defaults_file parameter to specify a YAML configuration file\n"
@@ -94,82 +337,453 @@ async def handle_list_tools() -> list[types.Tool]:
                 "   * Options in the defaults file can include filters, reference-doc, and other Pandoc options\n"
                 "   * Example: 'Convert this markdown to DOCX using defaults_file=\"/path/to/defaults.yaml\" "
                 "and save as /reports/report.docx'\n\n"
+                "📚 Multiple Outputs:\n"
+                "8. Use the outputs parameter to produce several formats in one call:\n"
+                "   * Example: outputs=[{\"output_format\": \"html\", \"output_file\": \"/out/report.html\"}, "
+                "{\"output_format\": \"docx\", \"output_file\": \"/out/report.docx\"}]\n"
+                "   * The input is parsed once and filtered once per format; each output still gets its own "
+                "options\n"
+                "   * Multi-output calls don't use the precompiled LaTeX formats, sharing with identical calls in "
+                "flight or the pandoc server backend\n\n"
+                "📑 Large Results:\n"
+                "9. Converted contents too large for one reply come back as the first page plus a result_id:\n"
+                "   * Call read-conversion-result with that result_id and the given offset to read the rest\n\n"
+                "🖨️ PDF Engines:\n"
+                "10. Use pdf_engine to pick xelatex, lualatex, pdflatex, wkhtmltopdf, weasyprint or typst, or 'auto'\n"
+                "   * 'auto' uses the fastest installed engine that can render the document (math, raw LaTeX, "
+                "Unicode); the engine used is reported in the result\n\n"
+                "⚡ Very Large Inputs:\n"
+                "11. Set parallel_sections (e.g. 4) to parse a large markdown or html input in parallel:\n"
+                "   * The input is split at its top-level headings; footnotes, anchors and reference links "
+                "still work across sections\n"
+                "   * The result reports an estimate of how much faster the parallel parse was than a single pass\n\n"
+                "📖 Books:\n"
+                "12. Use input_files instead of input_file to build one output from ordered chapter files:\n"
+                "   * Example: input_files=[\"/book/01-intro.md\", \"/book/02-setup.md\"], output_format=\"epub\", "
+                "output_file=\"/book/book.epub\"\n"
+                "   * Each chapter's parse is cached, so a rebuild after editing one chapter only re-reads that "
+                "chapter; filters and the writer still run on the whole book\n\n"
+                "Identical conversions requested at the same time (e.g. parallel calls) run pandoc once; each call "
+                "still gets its own output_file.\n\n"
                 "Note: After conversion, always check the success message for the exact file location."
             ),
+            inputSchema=CONVERT_CONTENTS_SCHEMA,
+        ),
+        types.Tool(
+            name="convert-batch",
+            description=(
+                "Runs many conversions in one call. Each entry in 'conversions' takes exactly the same "
+                "arguments as convert-contents (contents or input_file, input_format, output_format, "
+                "output_file, reference_doc, filters, defaults_file).\n\n"
+                "* All specs are validated up front, then converted concurrently\n"
+                "* A failing item does not stop the others\n"
+                "* The result is a JSON summary with per-item status ('ok', 'error' or 'invalid'), "
+                "timing in seconds, output_file, and the converted text for items without an output_file\n\n"
+                "Example: 'Convert every chapter in /book/chapters to DOCX' -> one convert-batch call with one "
+                "spec per chapter, each with its own output_file."
+            ),
             inputSchema={
                 "type": "object",
                 "properties": {
-                    "contents": {
-                        "type": "string",
-                        "description": "The content to be converted (required if input_file not provided)"
+                    "conversions": {
+                        "type": "array",
+                        "items": CONVERT_CONTENTS_SCHEMA,
+                        "minItems": 1,
+                        "description": "Conversion specs, each using the convert-contents arguments"
                     },
-                    "input_file": {
-                        "type": "string",
+                    "max_parallel": {
+                        "type": "integer",
+                        "minimum": 1,
                         "description": (
-                            "Complete path to input file including filename and extension "
-                            "(e.g., '/path/to/input.md')"
+                            "Maximum number of conversions to run at once "
+                            "(defaults to, and is capped at, the server's worker count)"
                         )
-                    },
-                    "input_format": {
+                    }
+                },
+                "required": ["conversions"],
+                "additionalProperties": False
+            },
+        ),
+        types.Tool(
+            name="convert-directory",
+            description=(
+                "Converts a whole directory tree, mirroring it into output_dir (guide/intro.md -> "
+                "output_dir/guide/intro.html). Every file uses the same options, which are the convert-contents "
+                "options without contents/input_file/output_file.\n\n"
+                "* Incremental: a manifest in output_dir records what was built, so a rebuild only converts new "
+                "and changed files and deletes the outputs of removed ones (force=true rebuilds everything)\n"
+                "* include/exclude are glob patterns on paths relative to input_dir ('*' also matches '/'); "
+                "by default every file with the input format's extension is included\n"
+                "* Files are converted in parallel; the result is a JSON summary with the number of converted, "
+                "skipped, failed and deleted files and the error of each failed file\n\n"
+                "Example: 'Keep /site/html in sync with the markdown docs in /docs' -> convert-directory with "
+                "input_dir='/docs', output_dir='/site/html', output_format='html'."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "input_dir": {
                         "type": "string",
-                        "description": "Source format of the content (defaults to markdown)",
-                        "default": "markdown",
-                        "enum": ["markdown", "html", "pdf", "docx", "rst", "latex", "epub", "txt", "ipynb", "odt"]
+                        "description": "Directory tree to convert"
                     },
-                    "output_format": {
+                    "output_dir": {
                         "type": "string",
-                        "description": "Desired output format (defaults to markdown)",
-                        "default": "markdown",
-                        "enum": ["markdown", "html", "pdf", "docx", "rst", "latex", "epub", "txt", "ipynb", "odt"]
+                        "description": "Directory receiving the converted tree and its manifest"
                     },
-                    "output_file": {
-                        "type": "string",
+                    "include": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Glob patterns of files to convert (default: by input_format, e.g. '*.md')"
+                    },
+                    "exclude": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Glob patterns of files to leave out, e.g. 'drafts/*'"
+                    },
+                    "input_format": CONVERT_CONTENTS_SCHEMA["properties"]["input_format"],
+                    "output_format": CONVERT_CONTENTS_SCHEMA["properties"]["output_format"],
+                    "reference_doc": CONVERT_CONTENTS_SCHEMA["properties"]["reference_doc"],
+                    "filters": CONVERT_CONTENTS_SCHEMA["properties"]["filters"],
+                    "defaults_file": CONVERT_CONTENTS_SCHEMA["properties"]["defaults_file"],
+                    "pdf_engine": CONVERT_CONTENTS_SCHEMA["properties"]["pdf_engine"],
+                    "force": {
+                        "type": "boolean",
+                        "description": "Reconvert every file, ignoring the manifest (default: false)"
+                    },
+                    "max_parallel": {
+                        "type": "integer",
+                        "minimum": 1,
                         "description": (
-                            "Complete path where to save the output including filename and extension "
-                            "(required for pdf, docx, rst, latex, epub formats)"
+                            "Maximum number of files to convert at once "
+                            "(defaults to, and is capped at, the server's worker count)"
                         )
+                    }
+                },
+                "required": ["input_dir", "output_dir"],
+                "additionalProperties": False
+            },
+        ),
+        types.Tool(
+            name="read-conversion-result",
+            description=(
+                "Reads the next page of a large converted result. convert-contents and convert-batch return "
+                "only the first page of converted contents above the page size, together with a result_id "
+                "and the offset to continue from. Results expire after an hour."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "result_id": {
+                        "type": "string",
+                        "description": "The result_id returned with the first page"
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "minimum": 0,
+                        "description": "Character offset to start reading from (default: 0)"
                     },
-                    "reference_doc": {
+                    "length": {
+                        "type": "integer",
+                        "minimum": 1,
+                        "description": "Number of characters to read (default and maximum: the page size)"
+                    }
+                },
+                "required": ["result_id"],
+                "additionalProperties": False
+            },
+        ),
+        types.Tool(
+            name="submit-conversion",
+            description=(
+                "Starts a conversion in the background and returns a job_id at once. Takes exactly the same "
+                "arguments as convert-contents. Use it for conversions that may outlast the request timeout "
+                "(large PDF, EPUB or DOCX builds) or to queue many conversions and collect them later.\n\n"
+                "* Poll conversion-status with the job_id (wait_seconds waits for the job to finish)\n"
+                "* Collect the output with fetch-conversion: the same result convert-contents would return\n"
+                "* Stage changes are sent to this session as log notifications while the job runs\n"
+                "* Finished jobs are kept for an hour"
+            ),
+            inputSchema=CONVERT_CONTENTS_SCHEMA,
+        ),
+        types.Tool(
+            name="conversion-status",
+            description=(
+                "Reports the state of a job started with submit-conversion as JSON: status (queued, running, "
+                "succeeded or failed), the stage it is in, queue and run time, and the error of a failed job. "
+                "Without job_id, lists every job. With wait_seconds, waits up to that long for the job to "
+                "finish and sends progress notifications meanwhile."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": {
                         "type": "string",
-                        "description": (
-                            "Path to a reference document to use for styling "
-                            "(supported for docx output format)"
-                        )
+                        "description": "The job_id returned by submit-conversion (omit to list all jobs)"
                     },
-                    "filters": {
-                        "type": "array",
-                        "items": {"type": "string"},
+                    "wait_seconds": {
+                        "type": "number",
+                        "minimum": 0,
+                        "maximum": MAX_WAIT_SECONDS,
                         "description": (
-                            "List of Pandoc filter paths to apply during conversion. "
-                            "Filters are applied in the order specified."
+                            f"Wait up to this long for the job to finish (default: 0, max: {MAX_WAIT_SECONDS})"
                         )
-                    },
-                    "defaults_file": {
+                    }
+                },
+                "additionalProperties": False
+            },
+        ),
+        types.Tool(
+            name="fetch-conversion",
+            description=(
+                "Returns the result of a job started with submit-conversion: the same message (and embedded "
+                "output) convert-contents returns. Reports the job's state if it has not finished yet and the "
+                "conversion error if it failed."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": {
                         "type": "string",
+                        "description": "The job_id returned by submit-conversion"
+                    },
+                    "wait_seconds": {
+                        "type": "number",
+                        "minimum": 0,
+                        "maximum": MAX_WAIT_SECONDS,
                         "description": (
-                            "Path to a Pandoc defaults file (YAML) containing conversion options. "
-                            "Similar to using pandoc -d option."
+                            f"Wait up to this long for the job to finish (default: 0, max: {MAX_WAIT_SECONDS})"
                         )
                     }
                 },
+                "required": ["job_id"],
                 "additionalProperties": False
             },
-        )
+        ),
+        types.Tool(
+            name="server-stats",
+            description=(
+                "Report the server's performance metrics as JSON: per-tool call counts and latency histograms, "
+                "time spent per conversion stage (validation, filter resolution, cache, pandoc read/write, "
+                "filters, LaTeX, formatting), CPU time and peak memory of the pandoc/filter/TeX child "
+                "processes, and the state of the worker pool, result cache, stored results, pandoc server "
+                "backend and PDF engine selection."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {},
+                "additionalProperties": False
+            },
+        ),
     ]
 
-@server.call_tool()
-async def handle_call_tool(
-    name: str, arguments: dict | None
-) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
-    """Handle tool execution requests.
 
-    Tools can modify server state and notify clients of changes.
+# Process-wide caches for per-call file work, validated with a single stat() per lookup
+_defaults_cache: dict[str, tuple[int, int, dict]] = {}
+_filter_path_cache: dict[tuple[str, str | None, str], tuple[str, int, int]] = {}
+
+
+def load_defaults_file(defaults_file: str) -> dict:
+    """Parse and validate a defaults file.
+
+    The parsed YAML is reused until the file's mtime or size changes. The
+    returned dict is shared between calls and must not be modified.
     """
-    if name not in ["convert-contents"]:
-        raise ValueError(f"Unknown tool: {name}")
+    try:
+        st = os.stat(defaults_file)
+    except FileNotFoundError as e:
+        raise ValueError(f"Defaults file not found: {defaults_file}") from e
+
+    cache_key = os.path.abspath(defaults_file)
+    cached = _defaults_cache.get(cache_key)
+    if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+
+    # Deferred: only calls with a defaults file need the YAML parser
+    import yaml
+
+    # Check if it's a valid YAML file and readable
+    try:
+        with open(defaults_file) as f:
+            yaml_content = yaml.safe_load(f)
+
+        # Validate the YAML structure
+        if not isinstance(yaml_content, dict):
+            raise ValueError(f"Invalid defaults file format: {defaults_file} - must be a YAML dictionary")
+
+    except yaml.YAMLError as e:
+        raise ValueError(f"Error parsing defaults file {defaults_file}: {str(e)}") from e
+    except PermissionError as e:
+        raise ValueError(f"Permission denied when reading defaults file: {defaults_file}") from e
+    except Exception as e:
+        raise ValueError(f"Error reading defaults file {defaults_file}: {str(e)}") from e
+
+    _defaults_cache[cache_key] = (st.st_mtime_ns, st.st_size, yaml_content)
+    return yaml_content
+
+
+def resolve_filter_path(filter_path, defaults_file=None):
+    """Resolve a filter path, reusing earlier resolutions while the resolved file is unchanged.
+
+    Cached per filter string, defaults file directory and working directory.
+    A hit costs one stat() of the resolved file and of each location searched
+    before it; if it disappeared, its mtime or mode changed, or a filter now
+    exists at an earlier location, the full search runs again. Misses are not
+    cached, so a newly created filter is picked up on the next call.
+    """
+    defaults_dir = os.path.dirname(os.path.abspath(defaults_file)) if defaults_file else None
+    cache_key = (filter_path, defaults_dir, os.getcwd())
+    cached = _filter_path_cache.get(cache_key)
+    if cached:
+        path, mtime_ns, mode = cached
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        candidates = _filter_candidates(filter_path, defaults_file)
+        earlier = candidates[:candidates.index(path)] if path in candidates else candidates
+        if (
+            st is not None and (st.st_mtime_ns, st.st_mode) == (mtime_ns, mode)
+            and not any(os.path.exists(candidate) for candidate in earlier)
+        ):
+            return path
+
+    resolved = _resolve_filter_path_uncached(filter_path, defaults_file)
+    if resolved:
+        st = os.stat(resolved)
+        _filter_path_cache[cache_key] = (resolved, st.st_mtime_ns, st.st_mode)
+    return resolved
+
+
+def _filter_candidates(filter_path, defaults_file=None):
+    """Return the locations a filter path may resolve to, in search order."""
+    # If it's already an absolute path, just use it
+    if os.path.isabs(filter_path):
+        return [filter_path]
+    # Try multiple locations for relative paths
+    paths = [
+        # 1. Relative to current working directory
+        os.path.abspath(filter_path),
+
+        # 2. Relative to the defaults file directory (if provided)
+        os.path.join(os.path.dirname(os.path.abspath(defaults_file)), filter_path) if defaults_file else None,
+
+        # 3. Relative to the .pandoc/filters directory
+        os.path.join(os.path.expanduser("~"), ".pandoc", "filters", os.path.basename(filter_path))
+    ]
+    # Remove None entries
+    return [p for p in paths if p]
+
+
+def _resolve_filter_path_uncached(filter_path, defaults_file=None):
+    """Resolve a filter path by trying multiple possible locations.
+
+    Args:
+    ----
+        filter_path: The original filter path (absolute or relative)
+        defaults_file: Optional path to the defaults file for context
+
+    Returns:
+    -------
+        Resolved absolute path to the filter if found, or None if not found
+
+    """
+    # Try each path
+    for path in _filter_candidates(filter_path, defaults_file):
+        if os.path.exists(path):
+            # Check if executable and try to make it executable if not
+            if not os.access(path, os.X_OK):
+                try:
+                    os.chmod(path, os.stat(path).st_mode | 0o111)
+                    logger.info("Made filter executable: %s", path)
+                except Exception as e:
+                    logger.warning("Could not make filter executable: %s - %s", path, e)
+                    continue
+
+            logger.debug("Using filter: %s", path)
+            return path
+
+    return None
+
+
+def validate_filters(filters, defaults_file=None):
+    """Validate filter paths and ensure they exist and are executable."""
+    validated_filters = []
+
+    for filter_path in filters:
+        resolved_path = resolve_filter_path(filter_path, defaults_file)
+        if resolved_path:
+            validated_filters.append(resolved_path)
+        else:
+            raise ValueError(f"Filter not found in any of the searched locations: {filter_path}")
+
+    return validated_filters
 
-    print(arguments)
 
+def format_result_info(filters=None, defaults_file=None, validated_filters=None):
+    """Format filter and defaults file information for result messages."""
+    filter_info = ""
+    defaults_info = ""
+
+    if filters and validated_filters:
+        filter_names = [os.path.basename(f) for f in validated_filters]
+        filter_info = f" with filters: {', '.join(filter_names)}"
+
+    if defaults_file:
+        defaults_basename = os.path.basename(defaults_file)
+        defaults_info = f" using defaults file: {defaults_basename}"
+
+    return filter_info, defaults_info
+
+
+@dataclass
+class ConversionRequest:
+    """Validated arguments of a single conversion."""
+
+    contents: str | None
+    input_file: str | None
+    input_format: str
+    output_format: str
+    output_file: str | None
+    reference_doc: str | None
+    filters: list[str]
+    defaults_file: str | None
+    defaults: dict | None = None
+    embed_output: bool = False
+    pdf_engine: str | None = None
+    parallel_sections: int | None = None
+    # Chapter files of a book build, used instead of contents/input_file
+    input_files: list[str] | None = None
+
+
+@dataclass
+class ConversionResult:
+    """Outcome of a single conversion."""
+
+    output: str | None
+    validated_filters: list[str]
+    served_from_cache: bool = False
+    result_id: str | None = None
+    total_chars: int | None = None
+    data: bytes | None = None
+    sections: dict | None = None
+    chapters: dict | None = None
+    # Shared with an identical conversion that was already running
+    coalesced: bool = False
+
+
+def page_result(result: ConversionResult) -> ConversionResult:
+    """Move an output too large for one message into the result store, keeping only its first page."""
+    store = get_store()
+    if store.needs_paging(result.output):
+        stored = store.put(result.output)
+        result.result_id = stored.result_id
+        result.total_chars = stored.total_chars
+        result.output = result.output[:store.page_chars]
+    return result
+
+
+def parse_conversion_arguments(arguments: dict | None) -> ConversionRequest:
+    """Validate convert-contents arguments, raising ValueError for invalid input."""
     if not arguments:
         raise ValueError("Missing arguments")
 
@@ -182,10 +796,30 @@ async def handle_call_tool(
     reference_doc = arguments.get("reference_doc")
     filters = arguments.get("filters", [])
     defaults_file = arguments.get("defaults_file")
+    embed_output = bool(arguments.get("embed_output", False))
+    pdf_engine = arguments.get("pdf_engine")
+    parallel_sections = arguments.get("parallel_sections")
+    input_files = arguments.get("input_files")
+    yaml_content = None
 
     # Validate input parameters
-    if not contents and not input_file:
-        raise ValueError("Either 'contents' or 'input_file' must be provided")
+    if input_files is not None:
+        if contents or input_file:
+            raise ValueError("Use only one of 'contents', 'input_file' and 'input_files'")
+        if (
+            not isinstance(input_files, list) or not input_files
+            or not all(isinstance(path, str) and path for path in input_files)
+        ):
+            raise ValueError("input_files parameter must be a non-empty array of file paths")
+        if len(input_files) > MAX_CHAPTERS:
+            raise ValueError(f"input_files takes at most {MAX_CHAPTERS} chapters")
+        if parallel_sections is not None:
+            raise ValueError("parallel_sections cannot be combined with input_files; chapters are parsed in parallel")
+    elif not contents and not input_file:
+        raise ValueError("Either 'contents', 'input_file' or 'input_files' must be provided")
+
+    if embed_output and output_file:
+        raise ValueError("Use either output_file or embed_output, not both")
 
     # Validate reference_doc if provided
     if reference_doc:
@@ -194,33 +828,39 @@ async def handle_call_tool(
         if not os.path.exists(reference_doc):
             raise ValueError(f"Reference document not found: {reference_doc}")
 
+    # Validate pdf_engine if provided
+    if pdf_engine:
+        if output_format != "pdf":
+            raise ValueError("pdf_engine parameter is only supported for pdf output format")
+        if pdf_engine not in (AUTO, *ENGINES):
+            raise ValueError(
+                f"Unsupported PDF engine: '{pdf_engine}'. Supported engines are: {', '.join((AUTO, *ENGINES))}"
+            )
+
+    # Validate parallel_sections if provided
+    if parallel_sections is not None:
+        if isinstance(parallel_sections, bool) or not isinstance(parallel_sections, int) or not (
+            2 <= parallel_sections <= MAX_SECTIONS
+        ):
+            raise ValueError(f"parallel_sections must be an integer between 2 and {MAX_SECTIONS}")
+        section_format(input_file, input_format)
+
     # Validate defaults_file if provided
     if defaults_file:
-        if not os.path.exists(defaults_file):
-            raise ValueError(f"Defaults file not found: {defaults_file}")
-
-        # Check if it's a valid YAML file and readable
-        try:
-            with open(defaults_file) as f:
-                yaml_content = yaml.safe_load(f)
-
-            # Validate the YAML structure
-            if not isinstance(yaml_content, dict):
-                raise ValueError(f"Invalid defaults file format: {defaults_file} - must be a YAML dictionary")
-
-            # Check if the defaults file specifies an output format that conflicts with the requested format
-            if 'to' in yaml_content and yaml_content['to'] != output_format:
-                print(
-                    f"Warning: Defaults file specifies output format '{yaml_content['to']}' "
-                    f"but requested format is '{output_format}'. Using requested format."
-                )
+        yaml_content = load_defaults_file(defaults_file)
+        if (parallel_sections or input_files) and yaml_content.get("filters"):
+            raise ValueError(
+                f"A defaults file that declares filters cannot be combined with "
+                f"{'input_files' if input_files else 'parallel_sections'}; "
+                "pass the filters through the filters parameter instead"
+            )
 
-        except yaml.YAMLError as e:
-            raise ValueError(f"Error parsing defaults file {defaults_file}: {str(e)}") from e
-        except PermissionError as e:
-            raise ValueError(f"Permission denied when reading defaults file: {defaults_file}") from e
-        except Exception as e:
-            raise ValueError(f"Error reading defaults file {defaults_file}: {str(e)}") from e
+        # Check if the defaults file specifies an output format that conflicts with the requested format
+        if 'to' in yaml_content and yaml_content['to'] != output_format:
+            logger.warning(
+                "Defaults file specifies output format '%s' but requested format is '%s'. Using requested format.",
+                yaml_content['to'], output_format,
+            )
 
     # Define supported formats
     supported_formats = {'html', 'markdown', 'pdf', 'docx', 'rst', 'latex', 'epub', 'txt', 'ipynb', 'odt'}
@@ -231,8 +871,8 @@ async def handle_call_tool(
 
     # Validate output_file requirement for advanced formats
     advanced_formats = {'pdf', 'docx', 'rst', 'latex', 'epub'}
-    if output_format in advanced_formats and not output_file:
-        raise ValueError(f"output_file path is required for {output_format} format")
+    if output_format in advanced_formats and not output_file and not embed_output:
+        raise ValueError(f"output_file path is required for {output_format} format (or set embed_output)")
 
     # Validate filters if provided
     if filters:
@@ -243,226 +883,1286 @@ async def handle_call_tool(
             if not isinstance(filter_path, str):
                 raise ValueError("Each filter must be a string path")
 
-    def resolve_filter_path(filter_path, defaults_file=None):
-        """Resolve a filter path by trying multiple possible locations.
+    return ConversionRequest(
+        contents=contents,
+        input_file=input_file,
+        input_format=input_format,
+        output_format=output_format,
+        output_file=output_file,
+        reference_doc=reference_doc,
+        filters=filters or [],
+        defaults_file=defaults_file,
+        defaults=yaml_content,
+        embed_output=embed_output,
+        pdf_engine=pdf_engine,
+        parallel_sections=parallel_sections,
+        input_files=input_files,
+    )
 
-        Args:
-        ----
-            filter_path: The original filter path (absolute or relative)
-            defaults_file: Optional path to the defaults file for context
 
-        Returns:
-        -------
-            Resolved absolute path to the filter if found, or None if not found
+def parse_output_requests(arguments: dict | None) -> list[ConversionRequest]:
+    """Validate arguments into one request per output.
 
-        """
-        # If it's already an absolute path, just use it
-        if os.path.isabs(filter_path):
-            paths = [filter_path]
-        else:
-            # Try multiple locations for relative paths
-            paths = [
-                # 1. Relative to current working directory
-                os.path.abspath(filter_path),
+    Without ``outputs`` this is a single request. With ``outputs``, every entry
+    shares the input, filters and defaults file and adds its own format, file
+    and (for docx) reference document.
+    """
+    if not arguments or not arguments.get("outputs"):
+        return [parse_conversion_arguments(arguments)]
 
-                # 2. Relative to the defaults file directory (if provided)
-                os.path.join(os.path.dirname(os.path.abspath(defaults_file)), filter_path) if defaults_file else None,
+    outputs = arguments["outputs"]
+    if not isinstance(outputs, list) or not all(isinstance(output, dict) for output in outputs):
+        raise ValueError("outputs parameter must be an array of objects")
+    if "output_format" in arguments or "output_file" in arguments:
+        raise ValueError("Use either output_format/output_file or outputs, not both")
 
-                # 3. Relative to the .pandoc/filters directory
-                os.path.join(os.path.expanduser("~"), ".pandoc", "filters", os.path.basename(filter_path))
-            ]
-            # Remove None entries
-            paths = [p for p in paths if p]
-
-        # Try each path
-        for path in paths:
-            if os.path.exists(path):
-                # Check if executable and try to make it executable if not
-                if not os.access(path, os.X_OK):
-                    try:
-                        os.chmod(path, os.stat(path).st_mode | 0o111)
-                        print(f"Made filter executable: {path}")
-                    except Exception as e:
-                        print(f"Warning: Could not make filter executable: {path} - {str(e)}")
-                        continue
-
-                print(f"Using filter: {path}")
-                return path
+    shared = {
+        key: value for key, value in arguments.items() if key not in ("outputs", "reference_doc", "embed_output")
+    }
+    requests = []
+    for output in outputs:
+        output_arguments = {**shared, **output}
+        # A top-level reference_doc styles every docx output
+        if arguments.get("reference_doc") and output.get("output_format", "").lower() == "docx":
+            output_arguments.setdefault("reference_doc", arguments["reference_doc"])
+        # A top-level embed_output embeds every output that isn't written to a file
+        if arguments.get("embed_output") and not output.get("output_file"):
+            output_arguments.setdefault("embed_output", True)
+        requests.append(parse_conversion_arguments(output_arguments))
 
-        return None
+    if len(requests) > 1 and (requests[0].defaults or {}).get("filters"):
+        raise ValueError(
+            "A defaults file that declares filters cannot be combined with multiple outputs; "
+            "pass the filters through the filters parameter instead"
+        )
+    return requests
 
-    def validate_filters(filters, defaults_file=None):
-        """Validate filter paths and ensure they exist and are executable."""
-        validated_filters = []
 
-        for filter_path in filters:
-            resolved_path = resolve_filter_path(filter_path, defaults_file)
-            if resolved_path:
-                validated_filters.append(resolved_path)
-            else:
-                raise ValueError(f"Filter not found in any of the searched locations: {filter_path}")
+def build_pandoc_args(request: ConversionRequest,
+                      validated_filters: list[str]) -> tuple[list[str], list[str], list[str]]:
+    """Return the defaults, filter and writer arguments for a conversion, in command line order."""
+    defaults_args = []
+    filter_args = []
+    writer_args = []
 
-        return validated_filters
+    # Add defaults file if provided - ensure it's properly formatted for Pandoc
+    if request.defaults_file:
+        # Make sure the path is absolute
+        defaults_args.extend(["--defaults", os.path.abspath(request.defaults_file)])
 
-    def format_result_info(filters=None, defaults_file=None, validated_filters=None):
-        """Format filter and defaults file information for result messages."""
-        filter_info = ""
-        defaults_info = ""
+    # Handle filter arguments
+    for filter_path in validated_filters:
+        filter_args.extend(["--filter", filter_path])
 
-        if filters and validated_filters:
-            filter_names = [os.path.basename(f) for f in validated_filters]
-            filter_info = f" with filters: {', '.join(filter_names)}"
+    # Handle PDF-specific conversion if needed
+    if request.output_format == "pdf":
+        writer_args.extend(engine_args(request.pdf_engine or DEFAULT_ENGINE))
 
-        if defaults_file:
-            defaults_basename = os.path.basename(defaults_file)
-            defaults_info = f" using defaults file: {defaults_basename}"
+    # Handle reference doc for docx format
+    if request.reference_doc and request.output_format == "docx":
+        writer_args.extend([
+            "--reference-doc", request.reference_doc
+        ])
 
-        return filter_info, defaults_info
+    return defaults_args, filter_args, writer_args
 
-    try:
-        # Prepare conversion arguments
-        extra_args = []
 
-        # Add defaults file if provided - ensure it's properly formatted for Pandoc
-        if defaults_file:
-            # Make sure the path is absolute
-            defaults_file_abs = os.path.abspath(defaults_file)
-            extra_args.extend(["--defaults", defaults_file_abs])
+def output_dir_for(request: ConversionRequest) -> str | None:
+    """Return the directory filters receive as PANDOC_OUTPUT_DIR (the output file's directory)."""
+    if request.output_file:
+        return os.path.dirname(os.path.abspath(request.output_file))
+    return None
+
+
+def runs_filters(request: ConversionRequest, validated_filters: list[str]) -> bool:
+    """Return True if the conversion runs filters, from the request or its defaults file.
+
+    Filters may write files into PANDOC_OUTPUT_DIR that a cached output can't
+    bring back.
+    """
+    if validated_filters:
+        return True
+    return bool(request.defaults_file and load_defaults_file(request.defaults_file).get("filters"))
+
+
+def conversion_cache_key(request: ConversionRequest, extra_args: list[str], validated_filters: list[str]) -> str:
+    """Build the result cache key for a conversion.
+
+    Covers the input bytes, formats, pandoc arguments, pandoc version and the
+    content of every file pandoc reads besides the input.
+    """
+    if request.input_files:
+        # Chapters are read with the requested format whatever their extension
+        input_digest = hashlib.sha256(
+            "\n".join(file_digest(path) for path in request.input_files).encode("ascii")
+        ).hexdigest()
+        input_ext = "chapters"
+    elif request.input_file:
+        input_digest = file_digest(request.input_file)
+        input_ext = os.path.splitext(request.input_file)[1].lower()
+    else:
+        input_digest = hashlib.sha256(request.contents.encode("utf-8")).hexdigest()
+        input_ext = None
+    referenced_files = [request.defaults_file, request.reference_doc, *validated_filters]
+    return ResultCache.make_key(
+        input_sha256=input_digest,
+        input_ext=input_ext,
+        input_format=request.input_format,
+        output_format=request.output_format,
+        # Embedded outputs are the bytes pandoc would write to a file
+        to_file=bool(request.output_file) or request.embed_output,
+        extra_args=extra_args,
+        # Sectioned reads merge the sections' ASTs, which can differ slightly from a single pass
+        parallel_sections=request.parallel_sections,
+        referenced_files=[file_fingerprint(path) for path in referenced_files if path],
+        pandoc_version=get_capabilities().version,
+    )
+
 
-        # Set environment variables for filters
-        env = os.environ.copy()
+def read_cached(cache: ResultCache, cache_key: str, output_file: str | None,
+                embed_output: bool = False) -> tuple[bool, str | bytes | None]:
+    """Look a conversion up in the result cache; returns (hit, converted text or embedded bytes)."""
+    with stage("cache"):
         if output_file:
-            # Set PANDOC_OUTPUT_DIR to the directory of the output file
-            output_dir = os.path.dirname(os.path.abspath(output_file))
-            env["PANDOC_OUTPUT_DIR"] = output_dir
-        else:
-            output_dir = None
+            return cache.copy_to(cache_key, output_file), None
+        if embed_output:
+            data = cache.get_bytes(cache_key)
+            return data is not None, data
+        converted_output = cache.get_text(cache_key)
+        return converted_output is not None, converted_output
 
-        # Validate filters once and reuse the result
-        validated_filters = validate_filters(filters, defaults_file) if filters else []
-
-        # Handle filter arguments
-        for filter_path in validated_filters:
-            extra_args.extend(["--filter", filter_path])
-
-        # Handle PDF-specific conversion if needed
-        if output_format == "pdf":
-            extra_args.extend([
-                "--pdf-engine=xelatex",
-                "-V", "geometry:margin=1in"
-            ])
-
-        # Handle reference doc for docx format
-        if reference_doc and output_format == "docx":
-            extra_args.extend([
-                "--reference-doc", reference_doc
-            ])
-
-        # No special processing needed for content
-
-        # Convert content using pypandoc
-        if input_file:
-            if not os.path.exists(input_file):
-                raise ValueError(f"Input file not found: {input_file}")
-
-
-            if output_file:
-                # Convert file to file
-                converted_output = pypandoc.convert_file(
-                    input_file,
-                    output_format,
-                    outputfile=output_file,
-                    extra_args=extra_args
+
+def store_cached(cache: ResultCache | None, cache_key: str | None, output_file: str | None,
+                 converted_output: str | bytes | None) -> None:
+    """Store a fresh conversion result in the result cache, if caching is enabled."""
+    if cache is None or cache_key is None:
+        return
+    with stage("cache"):
+        if output_file:
+            cache.put_file(cache_key, output_file)
+        elif isinstance(converted_output, bytes):
+            cache.put_bytes(cache_key, converted_output)
+        elif converted_output:
+            cache.put_text(cache_key, converted_output)
+
+
+def check_embed_size(request: ConversionRequest, data: bytes) -> None:
+    """Reject embedded outputs over the configured size limit."""
+    max_bytes = get_store().max_embed_bytes
+    if len(data) > max_bytes:
+        raise ValueError(
+            f"{request.output_format} output is {len(data)} bytes, over the {max_bytes} byte limit for "
+            "embedded outputs; provide output_file instead"
+        )
+
+
+def describe_input(request: ConversionRequest) -> str:
+    """Name a request's input for messages: contents, file or chapters."""
+    if request.input_files:
+        return f"{len(request.input_files)} chapter files"
+    return "file" if request.input_file else "contents"
+
+
+def conversion_error(request: ConversionRequest, e: Exception, output_format: str | None = None) -> ValueError:
+    """Turn a conversion failure into a categorized, user-facing ValueError."""
+    # Handle Pandoc conversion errors
+    error_prefix = "Error converting"
+    error_details = str(e)
+
+    if isinstance(e, ProcessKilledError):
+        error_prefix = "Killed while converting"
+    elif isinstance(e, PandocError) and e.returncode in FILTER_EXIT_CODES:
+        error_prefix = "Filter error during conversion"
+    elif isinstance(e, FileNotFoundError) and e.filename == get_capabilities().path:
+        error_prefix = "Pandoc executable not found"
+        error_details = "Please ensure Pandoc is installed and available in your PATH"
+    elif "Filter not found" in error_details or "Filter is not executable" in error_details:
+        error_prefix = "Filter error during conversion"
+    elif "defaults" in error_details and request.defaults_file:
+        error_prefix = "Defaults file error during conversion"
+        # Add more context about the defaults file
+        error_details += f" (defaults file: {request.defaults_file})"
+    elif "pandoc" in error_details.lower() and "not found" in error_details.lower():
+        error_prefix = "Pandoc executable not found"
+        error_details = "Please ensure Pandoc is installed and available in your PATH"
+
+    return ValueError(
+        f"{error_prefix} {describe_input(request)} from {request.input_format} to "
+        f"{output_format or request.output_format}: {error_details}"
+    )
+
+
+def server_backend_eligible(request: ConversionRequest, validated_filters: list[str]) -> bool:
+    """Return True if the pandoc server API can run this conversion (text input, no files or filters)."""
+    return (
+        request.contents is not None
+        and not request.input_file
+        and not validated_filters
+        and not request.defaults_file
+        and not request.reference_doc
+        and not request.embed_output
+        and request.output_format != "pdf"
+    )
+
+
+async def resolve_pdf_engine(request: ConversionRequest) -> None:
+    """Replace the requested PDF engine (unset, or 'auto') with the engine that will run the job."""
+    if request.output_format != "pdf":
+        return
+    selector = get_selector()
+    features = set()
+    with stage("pdf_engine"):
+        if (request.pdf_engine or selector.default) == AUTO:
+            for input_file in request.input_files or [request.input_file]:
+                features |= await asyncio.to_thread(
+                    document_features, request.contents, input_file, request.input_format
                 )
+        request.pdf_engine = await asyncio.to_thread(selector.choose, request.pdf_engine, features)
 
-                # Create result message with filter and defaults information
-                filter_info, defaults_info = format_result_info(filters, defaults_file, validated_filters)
-                result_message = f"File successfully converted{filter_info}{defaults_info} and saved to: {output_file}"
-            else:
-                # Convert file to string
-                converted_output = pypandoc.convert_file(
-                    input_file,
-                    output_format,
-                    extra_args=extra_args
+
+async def read_sections_ast(request: ConversionRequest, reader_args: list[str]) -> tuple[str | None, dict]:
+    """Parse the input's top-level sections in parallel and merge them into one JSON AST.
+
+    Returns no AST when the input has nothing to split at, along with timings
+    for reporting the speedup.
+    """
+    input_format, sections = await asyncio.to_thread(
+        load_sections, request.contents, request.input_file, request.input_format, request.parallel_sections
+    )
+    if len(sections) < 2:
+        return None, {"sections": 1}
+    started = time.perf_counter()
+    parsed = await asyncio.gather(*(
+        get_pool().run(read_section, text=section, input_format=input_format, reader_args=reader_args)
+        for section in sections
+    ))
+    read_seconds = time.perf_counter() - started
+    with stage("merge"):
+        ast_json = await asyncio.to_thread(merge_asts, [section_ast for section_ast, _seconds in parsed])
+    return ast_json, {
+        "sections": len(sections),
+        "read_seconds": read_seconds,
+        "merge_seconds": time.perf_counter() - started - read_seconds,
+        "serial_read_seconds": sum(seconds for _section_ast, seconds in parsed),
+    }
+
+
+def read_chapter_file(path: str) -> bytes:
+    """Read one chapter of a book build."""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def read_book_ast(request: ConversionRequest, reader_args: list[str]) -> tuple[str, dict]:
+    """Parse a book's chapters, reusing cached chapter ASTs, and merge them into one JSON AST.
+
+    Chapters missing from the cache are parsed in parallel on the worker pool.
+    Returns the AST and how many chapters were parsed and reused.
+    """
+    cache = get_chapter_cache()
+    with stage("chapters"):
+        chapters = await asyncio.gather(*(asyncio.to_thread(read_chapter_file, path) for path in request.input_files))
+        defaults_sha256 = file_digest(request.defaults_file) if request.defaults_file else None
+        version = get_capabilities().version
+        keys = [
+            chapter_key(data, request.input_format, reader_args, defaults_sha256, version) for data in chapters
+        ]
+        asts = [cache.get(key) if cache is not None else None for key in keys]
+    # The same chapter listed twice is parsed once
+    missing = {key: data for key, data, ast_json in zip(keys, chapters, asts, strict=True) if ast_json is None}
+    parsed = await asyncio.gather(*(
+        get_pool().run(
+            read_section,
+            text=data.decode("utf-8", errors="replace"),
+            input_format=request.input_format,
+            reader_args=reader_args,
+        )
+        for data in missing.values()
+    ))
+    fresh = {key: ast_json for key, (ast_json, _seconds) in zip(missing, parsed, strict=True)}
+    if cache is not None:
+        for key, ast_json in fresh.items():
+            cache.put(key, ast_json)
+    asts = [cached if cached is not None else fresh[key] for key, cached in zip(keys, asts, strict=True)]
+    with stage("merge"):
+        ast_json = await asyncio.to_thread(merge_asts, asts)
+    return ast_json, {"chapters": len(chapters), "parsed": len(fresh), "cached": len(chapters) - len(fresh)}
+
+
+def section_speedup(sections: dict, seconds: float) -> dict:
+    """Summarize a sectioned conversion that took ``seconds`` in total.
+
+    The speedup is an estimate, not a measurement: it compares the parallel
+    parse and the merge with the sum of the section parse times, which stands
+    in for parsing the same input in a single pandoc pass (that pass is not
+    run). The writer pass runs once either way.
+    """
+    if sections["sections"] < 2:
+        return sections
+    return {
+        "sections": sections["sections"],
+        "seconds": round(seconds, 3),
+        "parse_seconds": round(sections["read_seconds"], 3),
+        "merge_seconds": round(sections["merge_seconds"], 3),
+        "estimated_single_pass_parse_seconds": round(sections["serial_read_seconds"], 3),
+        "estimated_speedup": round(
+            sections["serial_read_seconds"] / (sections["read_seconds"] + sections["merge_seconds"]), 2
+        ),
+    }
+
+
+def check_input_files(request: ConversionRequest) -> None:
+    """Raise ValueError if the input file, or a chapter file, does not exist."""
+    for input_file in request.input_files or [request.input_file]:
+        if input_file and not os.path.exists(input_file):
+            raise ValueError(f"Input file not found: {input_file}")
+
+
+def shared_output(leader: ConversionRequest, request: ConversionRequest,
+                  converted_output: str | bytes | None) -> str | bytes | None:
+    """Give a caller that joined ``leader``'s conversion its own copy of the output.
+
+    Both write to a file or embed the bytes (the conversion key covers that),
+    so the output moves between the leader's file and embedded bytes as
+    needed.
+    """
+    if request.output_file:
+        if not leader.output_file:
+            with open(request.output_file, "wb") as f:
+                f.write(converted_output)
+        elif os.path.abspath(leader.output_file) != os.path.abspath(request.output_file):
+            shutil.copyfile(leader.output_file, request.output_file)
+        return None
+    if request.embed_output and leader.output_file:
+        with open(leader.output_file, "rb") as f:
+            return f.read()
+    return converted_output
+
+
+def finished_result(request: ConversionRequest, converted_output: str | bytes | None, validated_filters: list[str],
+                    served_from_cache: bool = False) -> ConversionResult:
+    """Wrap a conversion's output: bytes for embedded outputs, text when there is no output file."""
+    if request.embed_output:
+        check_embed_size(request, converted_output)
+        return ConversionResult(None, validated_filters, served_from_cache, data=converted_output)
+    return ConversionResult(None if request.output_file else converted_output, validated_filters, served_from_cache)
+
+
+async def produce_output(request: ConversionRequest, validated_filters: list[str], pandoc_args: tuple,
+                         cache: ResultCache | None,
+                         cache_key: str | None) -> tuple[str | bytes | None, dict | None, dict | None]:
+    """Run a conversion that missed the result cache on the fastest path available for it.
+
+    ``pandoc_args`` are the argument groups of ``build_pandoc_args``. Returns
+    the converted output and the section and chapter statistics of split
+    conversions.
+    """
+    defaults_args, filter_args, writer_args = pandoc_args
+    extra_args = defaults_args + filter_args + writer_args
+    # Python filters can run in-process on a shared AST, unless the defaults file adds its own filters
+    run_filters_in_process = (
+        validated_filters
+        and get_filter_mode() == "inprocess"
+        and not (request.defaults or {}).get("filters")
+    )
+
+    converted = False
+    converted_output = None
+    sections = chapters = None
+
+    # Books are parsed chapter by chapter and large markdown/html inputs section by section, in parallel;
+    # the merged AST is then written in one pass
+    if request.input_files or request.parallel_sections:
+        started = time.perf_counter()
+        if request.input_files:
+            ast_json, chapters = await read_book_ast(request, defaults_args)
+        else:
+            ast_json, sections = await read_sections_ast(request, defaults_args)
+        if ast_json is not None:
+            if validated_filters:
+                ast_json = await get_pool().run(
+                    apply_filters,
+                    ast_json=ast_json,
+                    filters=validated_filters,
+                    output_format=request.output_format,
+                    output_dir=output_dir_for(request),
+                    in_process=get_filter_mode() == "inprocess",
                 )
+            # A trailing --from wins over anything a defaults file sets
+            converted_output = await run_conversion(
+                contents=ast_json,
+                input_file=None,
+                input_format="json",
+                output_format=request.output_format,
+                output_file=request.output_file,
+                extra_args=[*defaults_args, *writer_args, "--from=json"],
+                to_bytes=request.embed_output,
+            )
+            await asyncio.to_thread(store_cached, cache, cache_key, request.output_file, converted_output)
+            converted = True
+        if sections is not None:
+            sections = section_speedup(sections, time.perf_counter() - started)
+
+    # Plain text conversions go to a warm pandoc server when that backend is enabled
+    server_pool = get_server_pool()
+    if not converted and server_pool is not None and server_backend_eligible(request, validated_filters):
+        try:
+            async with get_pool().slot():
+                with stage("pandoc_server"):
+                    converted_output = await asyncio.to_thread(
+                        server_pool.convert,
+                        request.contents,
+                        request.input_format,
+                        request.output_format,
+                        request.output_file,
+                    )
+        except PandocServerError:
+            # Fall back to the subprocess path, which also reports pandoc's own error message
+            converted_output = None
         else:
-            # No special processing needed for content
-
-            if output_file:
-                # Convert content to file
-                pypandoc.convert_text(
-                    contents,
-                    output_format,
-                    format=input_format,
-                    outputfile=output_file,
-                    extra_args=extra_args
+            await asyncio.to_thread(store_cached, cache, cache_key, request.output_file, converted_output)
+            converted = True
+
+    # xelatex PDFs reuse a dumped preamble format when the format cache is enabled
+    format_dir = get_format_dir() if "--pdf-engine=xelatex" in writer_args else None
+    if not converted and format_dir and not run_filters_in_process and not request.embed_output:
+        try:
+            converted_output = await get_pool().run(
+                convert_pdf_with_format,
+                contents=request.contents,
+                input_file=request.input_file,
+                input_format=request.input_format,
+                output_file=request.output_file,
+                extra_args=extra_args,
+                format_dir=format_dir,
+            )
+        except LatexFormatError as e:
+            logger.info("LaTeX format cache not used, falling back to pandoc's PDF build: %s", e)
+        else:
+            await asyncio.to_thread(store_cached, cache, cache_key, request.output_file, converted_output)
+            converted = True
+
+    # Convert in the worker pool so a slow conversion (e.g. a PDF build) doesn't block the event loop
+    if not converted:
+        if request.embed_output and run_filters_in_process:
+            # Filter the AST in-process, then let pandoc write the bytes to stdout
+            ast_json = await get_pool().run(
+                read_ast_with_filters,
+                contents=request.contents,
+                input_file=request.input_file,
+                input_format=request.input_format,
+                reader_args=defaults_args,
+                filters=validated_filters,
+                output_format=request.output_format,
+            )
+            converted_output = await run_conversion(
+                contents=ast_json,
+                input_file=None,
+                input_format="json",
+                output_format=request.output_format,
+                output_file=None,
+                extra_args=[*defaults_args, *writer_args, "--from=json"],
+                to_bytes=True,
+            )
+        elif run_filters_in_process:
+            converted_output = await get_pool().run(
+                convert_with_filters,
+                contents=request.contents,
+                input_file=request.input_file,
+                input_format=request.input_format,
+                output_format=request.output_format,
+                output_file=request.output_file,
+                reader_args=defaults_args,
+                writer_args=defaults_args + writer_args,
+                filters=validated_filters,
+                output_dir=output_dir_for(request),
+            )
+        else:
+            converted_output = await run_conversion(
+                contents=request.contents,
+                input_file=request.input_file,
+                input_format=request.input_format,
+                output_format=request.output_format,
+                output_file=request.output_file,
+                extra_args=extra_args,
+                to_bytes=request.embed_output,
+            )
+        await asyncio.to_thread(store_cached, cache, cache_key, request.output_file, converted_output)
+    return converted_output, sections, chapters
+
+
+async def convert(request: ConversionRequest) -> ConversionResult:
+    """Run a validated conversion, raising ValueError with a categorized message on failure."""
+    try:
+        # Validate filters once and reuse the result
+        with stage("resolve_filters"):
+            validated_filters = validate_filters(request.filters, request.defaults_file) if request.filters else []
+
+        check_input_files(request)
+
+        await resolve_pdf_engine(request)
+        pandoc_args = build_pandoc_args(request, validated_filters)
+        extra_args = [arg for group in pandoc_args for arg in group]
+
+        # Serve repeated conversions from the result cache without launching pandoc; filtered conversions always run
+        cache = None if runs_filters(request, validated_filters) else get_cache()
+        cache_key = None
+        served_from_cache = False
+        converted_output = None
+        if cache is not None:
+            with stage("cache"):
+                cache_key = await asyncio.to_thread(conversion_cache_key, request, extra_args, validated_filters)
+            served_from_cache, converted_output = await asyncio.to_thread(
+                read_cached, cache, cache_key, request.output_file, request.embed_output
+            )
+
+        sections = chapters = None
+        coalesced = False
+        if not served_from_cache:
+            if request.output_file:
+                # An output linked to a cache entry by an earlier hit must not be overwritten in place
+                unshare(request.output_file)
+            flights = get_flights()
+            if flights is None:
+                converted_output, sections, chapters = await produce_output(
+                    request, validated_filters, pandoc_args, cache, cache_key
                 )
+            else:
+                # Identical conversions running at the same time share one run, keyed like the result cache
+                if cache_key is None:
+                    # Hashing the input and statting the referenced files stays off the event loop
+                    with stage("cache"):
+                        cache_key = await asyncio.to_thread(
+                            conversion_cache_key, request, extra_args, validated_filters
+                        )
+
+                async def lead():
+                    return request, await produce_output(request, validated_filters, pandoc_args, cache, cache_key)
+
+                (leader, (converted_output, sections, chapters)), coalesced = await flights.run(cache_key, lead)
+                if coalesced:
+                    converted_output = shared_output(leader, request, converted_output)
+
+        if not request.output_file and not converted_output:
+            raise ValueError("Conversion resulted in empty output")
+
+        result = finished_result(request, converted_output, validated_filters, served_from_cache)
+        result.sections = sections
+        result.chapters = chapters
+        result.coalesced = coalesced
+        return result
+
+    except Exception as e:
+        raise conversion_error(request, e) from e
 
-                # Create result message with filter and defaults information
-                filter_info, defaults_info = format_result_info(filters, defaults_file, validated_filters)
-                result_message = (
-                    f"Content successfully converted{filter_info}{defaults_info} and saved to: {output_file}"
+
+async def supervised_outputs(requests: list[ConversionRequest]) -> list[ConversionResult]:
+    """Run ``convert_outputs`` under the timeout and resource limits of its output formats.
+
+    Its processes are killed when it times out or the calling task is
+    cancelled; killed conversions are counted in the current trace.
+    """
+    limits = get_limits().for_formats([request.output_format for request in requests])
+    try:
+        async with supervise(limits):
+            return await convert_outputs(requests)
+    except BaseException as e:
+        reason = kill_reason(e)
+        current = current_trace()
+        if reason and current is not None:
+            current.add_kill(reason)
+        if isinstance(e, ProcessKilledError):
+            # The timeout fires outside convert(), so its error is not categorized yet
+            formats = ", ".join(request.output_format for request in requests)
+            raise conversion_error(requests[0], e, output_format=formats) from e
+        raise
+
+
+async def convert_outputs(requests: list[ConversionRequest]) -> list[ConversionResult]:
+    """Convert one input to every requested output.
+
+    The input is read once into a pandoc JSON AST and filtered once per
+    distinct output format; the writers then run concurrently from those ASTs.
+    Outputs already in the result cache are served from it, and the input is
+    not read at all if every output is. The writers run pandoc directly: the
+    LaTeX format cache, coalescing and the pandoc server backend are only
+    used by single-output conversions.
+    """
+    if len(requests) == 1:
+        return [await convert(requests[0])]
+
+    first = requests[0]
+    formats = ", ".join(request.output_format for request in requests)
+    try:
+        with stage("resolve_filters"):
+            validated_filters = validate_filters(first.filters, first.defaults_file) if first.filters else []
+        defaults_args, _filter_args, _writer_args = build_pandoc_args(first, validated_filters)
+
+        check_input_files(first)
+        for request in requests:
+            await resolve_pdf_engine(request)
+
+        cache = None if runs_filters(first, validated_filters) else get_cache()
+        results: list[ConversionResult | None] = [None] * len(requests)
+        pending = []
+        for index, request in enumerate(requests):
+            _defaults_args, filter_args, writer_args = build_pandoc_args(request, validated_filters)
+            cache_key = None
+            if cache is not None:
+                with stage("cache"):
+                    cache_key = await asyncio.to_thread(
+                        conversion_cache_key, request, defaults_args + filter_args + writer_args, validated_filters
+                    )
+                hit, converted_output = await asyncio.to_thread(
+                    read_cached, cache, cache_key, request.output_file, request.embed_output
                 )
+                if hit:
+                    results[index] = finished_result(request, converted_output, validated_filters, True)
+                    continue
+            if request.output_file:
+                unshare(request.output_file)
+            pending.append((index, request, cache_key, defaults_args + writer_args))
+
+        if pending:
+            # Filters see the format they write to: the input is read once, then filtered once per distinct format
+            output_formats = list(dict.fromkeys(request.output_format for _index, request, _key, _args in pending))
+            filter_formats = output_formats if validated_filters else output_formats[:1]
+            in_process = get_filter_mode() == "inprocess"
+            output_dir = next((output_dir_for(request) for request in requests if request.output_file), None)
+            started = time.perf_counter()
+            ast_json = sections = chapters = None
+            if first.input_files:
+                ast_json, chapters = await read_book_ast(first, defaults_args)
+            elif first.parallel_sections:
+                ast_json, sections = await read_sections_ast(first, defaults_args)
+            if ast_json is None and len(filter_formats) == 1:
+                # Read and filter in one pool call
+                filtered = [await get_pool().run(
+                    read_ast_with_filters,
+                    contents=first.contents,
+                    input_file=first.input_file,
+                    input_format=first.input_format,
+                    reader_args=defaults_args,
+                    filters=validated_filters,
+                    output_format=filter_formats[0],
+                    output_dir=output_dir,
+                    in_process=in_process,
+                )]
             else:
-                # Convert content to string
-                converted_output = pypandoc.convert_text(
-                    contents,
-                    output_format,
-                    format=input_format,
-                    extra_args=extra_args
+                if ast_json is None:
+                    ast_json = await get_pool().run(
+                        read_ast_with_filters,
+                        contents=first.contents,
+                        input_file=first.input_file,
+                        input_format=first.input_format,
+                        reader_args=defaults_args,
+                        filters=[],
+                        output_format=filter_formats[0],
+                        output_dir=output_dir,
+                        in_process=in_process,
+                    )
+                filtered = [ast_json]
+                if validated_filters:
+                    reader_options = await get_pool().run(
+                        probe_reader_options, input_format=first.input_format, reader_args=defaults_args
+                    )
+                    filtered = await asyncio.gather(*(
+                        get_pool().run(
+                            apply_filters,
+                            ast_json=ast_json,
+                            filters=validated_filters,
+                            output_format=output_format,
+                            output_dir=output_dir,
+                            in_process=in_process,
+                            reader_options=reader_options,
+                        )
+                        for output_format in filter_formats
+                    ))
+            asts = dict(zip(filter_formats, filtered, strict=True))
+
+            def write(request: ConversionRequest, writer_args: list[str]):
+                return run_conversion(
+                    contents=asts.get(request.output_format, filtered[0]),
+                    input_file=None,
+                    input_format="json",
+                    output_format=request.output_format,
+                    output_file=request.output_file,
+                    extra_args=[*writer_args, "--from=json"],
+                    to_bytes=request.embed_output,
                 )
 
-        if output_file:
-            notify_with_result = result_message
+            written = await asyncio.gather(*(
+                write(request, writer_args) for _index, request, _cache_key, writer_args in pending
+            ), return_exceptions=True)
+            if sections is not None:
+                sections = section_speedup(sections, time.perf_counter() - started)
+
+            failures = []
+            for (index, request, cache_key, _writer_args), converted_output in zip(pending, written, strict=True):
+                if isinstance(converted_output, BaseException):
+                    failures.append(f"{request.output_format}: {converted_output}")
+                    continue
+                if not request.output_file and not converted_output:
+                    failures.append(f"{request.output_format}: Conversion resulted in empty output")
+                    continue
+                await asyncio.to_thread(store_cached, cache, cache_key, request.output_file, converted_output)
+                try:
+                    results[index] = finished_result(request, converted_output, validated_filters)
+                    results[index].sections = sections
+                    results[index].chapters = chapters
+                except ValueError as e:
+                    failures.append(f"{request.output_format}: {e}")
+            if failures:
+                raise ValueError("; ".join(failures))
+
+        return results
+
+    except Exception as e:
+        raise conversion_error(first, e, output_format=formats) from e
+
+
+OUTPUT_MEDIA_TYPES = {
+    "markdown": ("md", "text/markdown"),
+    "html": ("html", "text/html"),
+    "txt": ("txt", "text/plain"),
+    "rst": ("rst", "text/x-rst"),
+    "latex": ("tex", "application/x-latex"),
+    "ipynb": ("ipynb", "application/x-ipynb+json"),
+    "pdf": ("pdf", "application/pdf"),
+    "docx": ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "odt": ("odt", "application/vnd.oasis.opendocument.text"),
+    "epub": ("epub", "application/epub+zip"),
+}
+BINARY_OUTPUT_FORMATS = {"pdf", "docx", "odt", "epub"}
+
+
+def embedded_resource(request: ConversionRequest, result: ConversionResult) -> types.EmbeddedResource:
+    """Wrap an embedded output as an MCP resource: a base64 blob for binary formats, text otherwise."""
+    extension, mime_type = OUTPUT_MEDIA_TYPES[request.output_format]
+    uri = f"mcp-pandoc://output/converted.{extension}"
+    if request.output_format in BINARY_OUTPUT_FORMATS:
+        contents = types.BlobResourceContents(
+            uri=uri, mimeType=mime_type, blob=base64.b64encode(result.data).decode("ascii")
+        )
+    else:
+        contents = types.TextResourceContents(uri=uri, mimeType=mime_type, text=result.data.decode("utf-8"))
+    return types.EmbeddedResource(type="resource", resource=contents)
+
+
+def format_conversion_message(request: ConversionRequest, result: ConversionResult) -> str:
+    """Build the convert-contents reply text for a finished conversion."""
+    filters = request.filters
+    defaults_file = request.defaults_file
+    validated_filters = result.validated_filters
+    cache_info = " (served from cache)" if result.served_from_cache else ""
+    if result.coalesced:
+        cache_info = " (shared with an identical conversion already running)"
+    if request.output_format == "pdf":
+        cache_info = f" (PDF engine: {request.pdf_engine}){cache_info}"
+    if result.sections and result.sections["sections"] > 1:
+        cache_info += (
+            f" (parsed in {result.sections['sections']} parallel sections in {result.sections['parse_seconds']}s "
+            f"and merged in {result.sections['merge_seconds']}s, "
+            f"an estimated {result.sections['estimated_speedup']}x the speed of a single-pass parse; "
+            f"{result.sections['seconds']}s in total)"
+        )
+    elif result.sections:
+        cache_info += " (no top-level headings to split at; converted in a single pass)"
+    if result.chapters:
+        cache_info += (
+            f" (built from {result.chapters['chapters']} chapters: {result.chapters['parsed']} parsed, "
+            f"{result.chapters['cached']} reused from the chapter cache)"
+        )
+    if request.input_files:
+        source = f"{len(request.input_files)} chapter files"
+    else:
+        source = "File" if request.input_file else "Content"
+
+    if request.embed_output:
+        filter_info, defaults_info = format_result_info(filters, defaults_file, validated_filters)
+        return (
+            f"{source} successfully converted to {request.output_format}{filter_info}{defaults_info} and returned "
+            f"as an embedded resource ({len(result.data)} bytes){cache_info}"
+        )
+
+    if request.output_file:
+        # Create result message with filter and defaults information
+        filter_info, defaults_info = format_result_info(filters, defaults_file, validated_filters)
+        return (
+            f"{source} successfully converted{filter_info}{defaults_info} and saved to: "
+            f"{request.output_file}{cache_info}"
+        )
+
+    # Add filter and defaults information to the notification
+    filter_info, defaults_info = format_result_info(filters, defaults_file, validated_filters)
+    # Adjust format for inline display
+    if filter_info:
+        filter_info = f" (with filters: {', '.join([os.path.basename(f) for f in validated_filters])})"
+    if defaults_info:
+        defaults_info = f" (using defaults file: {os.path.basename(defaults_file)})"
+
+    page_info = ""
+    if result.result_id:
+        page_info = (
+            f'The result is {result.total_chars} characters long; only the first {len(result.output)} are shown. '
+            f'Call read-conversion-result with result_id "{result.result_id}" and offset {len(result.output)} '
+            f'to read the rest.\n'
+        )
+
+    return (
+        f'Following are the converted contents in {request.output_format} format{filter_info}{defaults_info}'
+        f'{cache_info}.\n'
+        f'Ask user if they expect to save this file. If so, provide the output_file parameter with '
+        f'complete path.\n'
+        f'{page_info}'
+        f'Converted Contents:\n\n{result.output}'
+    )
+
+
+def parallel_limit(arguments: dict) -> int:
+    """Return the validated max_parallel argument, defaulting to and capped at the pool's worker count."""
+    # Parallelism beyond the pool's worker count would only queue, so cap it there
+    pool_workers = get_pool().max_workers
+    max_parallel = arguments.get("max_parallel") or pool_workers
+    if not isinstance(max_parallel, int) or max_parallel < 1:
+        raise ValueError("max_parallel must be a positive integer")
+    return min(max_parallel, pool_workers)
+
+
+async def convert_batch(arguments: dict | None) -> dict:
+    """Run many conversions concurrently and report the outcome of each one.
+
+    Every spec is validated before any conversion starts. Invalid or failing
+    items are reported individually and never abort the rest of the batch.
+    """
+    if not arguments:
+        raise ValueError("Missing arguments")
+
+    specs = arguments.get("conversions")
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("conversions parameter must be a non-empty array of conversion specs")
+    max_parallel = parallel_limit(arguments)
+
+    items: list[dict] = []
+    item_requests: list[list[ConversionRequest] | None] = []
+    with stage("validate"):
+        for index, spec in enumerate(specs):
+            item = {"index": index, "output_file": spec.get("output_file") if isinstance(spec, dict) else None}
+            try:
+                if not isinstance(spec, dict):
+                    raise ValueError("Each conversion spec must be an object")
+                item_requests.append(parse_output_requests(spec))
+            except ValueError as e:
+                item_requests.append(None)
+                item.update(status="invalid", error=str(e))
+            items.append(item)
+
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    def describe(request: ConversionRequest, result: ConversionResult) -> dict:
+        described = {"served_from_cache": result.served_from_cache}
+        if result.coalesced:
+            described["coalesced"] = True
+        if request.pdf_engine:
+            described["pdf_engine"] = request.pdf_engine
+        if result.sections:
+            described["sections"] = result.sections
+        if result.chapters:
+            described["chapters"] = result.chapters
+        if result.output is not None:
+            page_result(result)
+            described["output"] = result.output
+        if result.result_id:
+            described.update(result_id=result.result_id, total_chars=result.total_chars)
+        if result.data is not None:
+            described.update(
+                output_base64=base64.b64encode(result.data).decode("ascii"),
+                mime_type=OUTPUT_MEDIA_TYPES[request.output_format][1],
+                bytes=len(result.data),
+            )
+        return described
+
+    async def run_item(item: dict, requests: list[ConversionRequest]) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                results = await supervised_outputs(requests)
+            except Exception as e:
+                item.update(status="error", error=str(e))
+                reason = kill_reason(e)
+                if reason:
+                    item["killed"] = reason
+            else:
+                item["status"] = "ok"
+                if len(requests) == 1:
+                    item.update(describe(requests[0], results[0]))
+                else:
+                    item["outputs"] = [
+                        {
+                            "output_format": request.output_format,
+                            "output_file": request.output_file,
+                            **describe(request, result),
+                        }
+                        for request, result in zip(requests, results, strict=True)
+                    ]
+            item["seconds"] = round(time.perf_counter() - started, 3)
+
+    await asyncio.gather(*(
+        run_item(item, requests) for item, requests in zip(items, item_requests, strict=True) if requests is not None
+    ))
+
+    succeeded = sum(1 for item in items if item["status"] == "ok")
+    return {
+        "total": len(items),
+        "succeeded": succeeded,
+        "failed": len(items) - succeeded,
+        "max_parallel": max_parallel,
+        "items": items,
+    }
+
+
+DIRECTORY_OPTIONS = ("input_format", "output_format", "reference_doc", "filters", "defaults_file", "pdf_engine")
+
+
+async def convert_directory(arguments: dict | None) -> dict:
+    """Mirror an input tree into an output tree, converting only new and changed files.
+
+    Every file is converted with the same options, at most ``max_parallel``
+    at a time. The manifest in the output directory is saved even when the
+    build fails part way, so the next build picks up where this one stopped.
+    """
+    if not arguments:
+        raise ValueError("Missing arguments")
+
+    with stage("validate"):
+        if not arguments.get("input_dir") or not arguments.get("output_dir"):
+            raise ValueError("input_dir and output_dir are required")
+        input_dir = os.path.abspath(arguments["input_dir"])
+        output_dir = os.path.abspath(arguments["output_dir"])
+        if not os.path.isdir(input_dir):
+            raise ValueError(f"Input directory not found: {arguments['input_dir']}")
+        if output_dir == input_dir:
+            raise ValueError("output_dir must differ from input_dir")
+        patterns = {}
+        for key in ("include", "exclude"):
+            value = arguments.get(key) or []
+            if not isinstance(value, list) or not all(isinstance(pattern, str) for pattern in value):
+                raise ValueError(f"{key} parameter must be an array of glob patterns")
+            patterns[key] = value
+        max_parallel = parallel_limit(arguments)
+
+        options = {key: arguments[key] for key in DIRECTORY_OPTIONS if key in arguments}
+        # Placeholder paths: the options are validated once, then every file gets its own request
+        template = parse_conversion_arguments({
+            **options,
+            "input_file": os.path.join(input_dir, "input"),
+            "output_file": os.path.join(output_dir, "output"),
+        })
+        validated_filters = validate_filters(template.filters, template.defaults_file)
+        referenced_files = [template.defaults_file, template.reference_doc, *validated_filters]
+        options_key = ResultCache.make_key(
+            options=options,
+            referenced_files=[file_fingerprint(path) for path in referenced_files if path],
+            pandoc_version=get_capabilities().version,
+        )
+        extension = OUTPUT_MEDIA_TYPES[template.output_format][0]
+        include = patterns["include"] or INPUT_PATTERNS.get(template.input_format, ["*"])
+
+    def scan():
+        manifest = Manifest(input_dir, output_dir)
+        inputs = find_inputs(input_dir, include, patterns["exclude"], skip_dir=output_dir)
+        return manifest, inputs, manifest.plan(inputs, options_key, extension, force=bool(arguments.get("force")))
+
+    with stage("scan"):
+        manifest, inputs, plan = await asyncio.to_thread(scan)
+        deleted = sum(manifest.remove(relative) for relative in plan.stale)
+
+    semaphore = asyncio.Semaphore(max_parallel)
+    failures: list[dict] = []
+
+    async def convert_file(relative: str) -> None:
+        output_file = os.path.join(output_dir, output_path_for(relative, extension))
+        request = replace(template, input_file=os.path.join(input_dir, relative), output_file=output_file)
+        async with semaphore:
+            try:
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                await supervised_outputs([request])
+            except Exception as e:
+                manifest.failed(relative)
+                failure = {"input": relative, "error": str(e)}
+                reason = kill_reason(e)
+                if reason:
+                    failure["killed"] = reason
+                failures.append(failure)
+            else:
+                manifest.converted(relative, plan.fingerprints[relative], options_key, extension)
+
+    try:
+        await asyncio.gather(*(convert_file(relative) for relative in plan.convert))
+    finally:
+        manifest.save()
+
+    return {
+        "input_dir": input_dir,
+        "output_dir": output_dir,
+        "total": len(inputs),
+        "converted": len(plan.convert) - len(failures),
+        "skipped": len(plan.skipped),
+        "failed": len(failures),
+        "deleted": deleted,
+        "max_parallel": max_parallel,
+        "failures": sorted(failures, key=lambda failure: failure["input"]),
+    }
+
+
+# Notifications are sent in the background; keep a reference until each one is out
+_notifications: set[asyncio.Task] = set()
+
+
+def send_notification(coroutine) -> None:
+    """Send an MCP notification without waiting for it; a client that went away is not an error."""
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _notifications.add(task)
+
+    def sent(task: asyncio.Task) -> None:
+        _notifications.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Notification not sent: %s", task.exception())
+
+    task.add_done_callback(sent)
+
+
+async def run_job(job: Job) -> list[dict]:
+    """Run a submitted conversion under its own trace, reporting every stage it enters to the job.
+
+    Paged results belong to the job, which keeps them readable until it expires.
+    """
+    with trace(job.tool) as current, owned_by(job.job_id):
+        current.on_stage = get_jobs().stage_listener(job)
+        contents = await call_tool(job.tool, job.arguments)
+    return [item.model_dump(mode="json", exclude_none=True) for item in contents]
+
+
+def submit_conversion(arguments: dict | None) -> Job:
+    """Validate convert-contents arguments and start them as a background job.
+
+    The submitting session, if any, is sent a log notification each time
+    the job changes state or stage.
+    """
+    with stage("validate"):
+        parse_output_requests(arguments)
+    jobs = get_jobs()
+    job = jobs.submit("convert-contents", dict(arguments), run_job)
+    try:
+        session = server.request_context.session
+    except LookupError:
+        # Called outside an MCP request (tests, benchmarks)
+        return job
+
+    def notify(changed: Job) -> None:
+        send_notification(session.send_log_message(
+            level="info", data=changed.summary(jobs.ttl_seconds), logger="mcp-pandoc.jobs"
+        ))
+
+    jobs.subscribe(job.job_id, notify)
+    return job
+
+
+async def wait_for_job(arguments: dict) -> Job:
+    """Return the job named in ``arguments`` after waiting up to ``wait_seconds`` for it to finish.
+
+    While waiting, a caller that sent a progress token gets a progress
+    notification each time the job changes state or stage.
+    """
+    wait_seconds = arguments.get("wait_seconds") or 0
+    if not isinstance(wait_seconds, int | float) or not 0 <= wait_seconds <= MAX_WAIT_SECONDS:
+        raise ValueError(f"wait_seconds must be between 0 and {MAX_WAIT_SECONDS}")
+    jobs = get_jobs()
+    job_id = arguments["job_id"]
+    try:
+        context = server.request_context
+        progress_token = context.meta.progressToken if context.meta else None
+    except LookupError:
+        progress_token = None
+    if progress_token is None or not wait_seconds:
+        return await jobs.wait(job_id, wait_seconds)
+
+    updates = 0
+
+    def progress(changed: Job) -> None:
+        nonlocal updates
+        updates += 1
+        message = f"{changed.status}: {changed.stage}" if changed.stage else changed.status
+        send_notification(context.session.send_progress_notification(
+            progress_token, updates, message=message, related_request_id=context.request_id
+        ))
+
+    with jobs.listening(job_id, progress):
+        return await jobs.wait(job_id, wait_seconds)
+
+
+def server_stats() -> dict:
+    """Collect the metrics registry and the state of every server component."""
+    server_pool = get_server_pool()
+    cache = get_cache()
+    assets = get_assets()
+    chapters = get_chapter_cache()
+    flights = get_flights()
+    capabilities = get_capabilities()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        **get_registry().stats(),
+        "process": {
+            "cpu_seconds": round(own.ru_utime + own.ru_stime, 3),
+            "max_rss_kib": own.ru_maxrss,
+            "children_cpu_seconds": round(children.ru_utime + children.ru_stime, 3),
+            "children_max_rss_kib": children.ru_maxrss,
+        },
+        "pool": get_pool().stats(),
+        "cache": cache.stats() if cache is not None else None,
+        "assets": assets.stats() if assets is not None else None,
+        "chapters": chapters.stats() if chapters is not None else None,
+        "flights": flights.stats() if flights is not None else None,
+        "results": get_store().stats(),
+        "pandoc_server": server_pool.stats() if server_pool is not None else None,
+        "pdf_engines": get_selector().stats(),
+        "jobs": get_jobs().stats(),
+        "limits": get_limits().stats(),
+        "pandoc": {"path": capabilities.path, "version": capabilities.version},
+    }
+
+
+@server.call_tool()
+async def handle_call_tool(
+    name: str, arguments: dict | None
+) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
+    """Handle tool execution requests.
+
+    Tools can modify server state and notify clients of changes.
+    """
+    if name not in [
+        "convert-contents", "convert-batch", "convert-directory", "read-conversion-result", "submit-conversion",
+        "conversion-status", "fetch-conversion", "server-stats",
+    ]:
+        raise ValueError(f"Unknown tool: {name}")
+
+    logger.debug("%s called with %s", name, arguments)
+
+    if name == "server-stats":
+        return [types.TextContent(type="text", text=json.dumps(server_stats(), indent=2))]
+
+    with trace(name):
+        return await call_tool(name, arguments)
+
+
+async def call_tool(
+    name: str, arguments: dict | None
+) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
+    """Run a conversion tool call under the caller's trace."""
+    if name == "read-conversion-result":
+        if not arguments or not arguments.get("result_id"):
+            raise ValueError("result_id is required")
+        page = get_store().read(arguments["result_id"], arguments.get("offset", 0), arguments.get("length"))
+        end = page["offset"] + len(page["text"])
+        if page["next_offset"] is None:
+            position = "end of result"
         else:
-            if not converted_output:
-                raise ValueError("Conversion resulted in empty output")
-
-            # Add filter and defaults information to the notification
-            filter_info, defaults_info = format_result_info(filters, defaults_file, validated_filters)
-            # Adjust format for inline display
-            if filter_info:
-                filter_info = f" (with filters: {', '.join([os.path.basename(f) for f in validated_filters])})"
-            if defaults_info:
-                defaults_info = f" (using defaults file: {os.path.basename(defaults_file)})"
-
-            notify_with_result = (
-                f'Following are the converted contents in {output_format} format{filter_info}{defaults_info}.\n'
-                f'Ask user if they expect to save this file. If so, provide the output_file parameter with '
-                f'complete path.\n'
-                f'Converted Contents:\n\n{converted_output}'
+            position = f"continue with offset {page['next_offset']}"
+        return [
+            types.TextContent(
+                type="text",
+                text=f"Characters {page['offset']}-{end} of {page['total_chars']} ({position}):\n\n{page['text']}"
             )
+        ]
 
+    if name == "submit-conversion":
+        job = submit_conversion(arguments)
         return [
             types.TextContent(
                 type="text",
-                text=notify_with_result
+                text=f"Conversion job submitted. Call fetch-conversion with job_id \"{job.job_id}\" to collect "
+                     f"the result, or conversion-status to follow its progress.\n\n"
+                     f"{json.dumps(job.summary(), indent=2)}"
             )
         ]
 
-    except Exception as e:
-        # Handle Pandoc conversion errors
-        error_prefix = "Error converting"
-        error_details = str(e)
-
-        if "Filter not found" in error_details or "Filter is not executable" in error_details:
-            error_prefix = "Filter error during conversion"
-        elif "defaults" in error_details and defaults_file:
-            error_prefix = "Defaults file error during conversion"
-            # Add more context about the defaults file
-            error_details += f" (defaults file: {defaults_file})"
-        elif "pandoc" in error_details.lower() and "not found" in error_details.lower():
-            error_prefix = "Pandoc executable not found"
-            error_details = "Please ensure Pandoc is installed and available in your PATH"
-
-        error_msg = (
-            f"{error_prefix} {'file' if input_file else 'contents'} from {input_format} to "
-            f"{output_format}: {error_details}"
+    if name == "conversion-status":
+        jobs = get_jobs()
+        if not arguments or not arguments.get("job_id"):
+            summary = [job.summary(jobs.ttl_seconds) for job in jobs.jobs()]
+        else:
+            summary = (await wait_for_job(arguments)).summary(jobs.ttl_seconds)
+        return [types.TextContent(type="text", text=json.dumps(summary, indent=2))]
+
+    if name == "fetch-conversion":
+        if not arguments or not arguments.get("job_id"):
+            raise ValueError("job_id is required")
+        job = await wait_for_job(arguments)
+        if job.status == "failed":
+            raise ValueError(f"Conversion job {job.job_id} failed: {job.error}")
+        if job.status != "succeeded":
+            stage_info = f", stage: {job.stage}" if job.stage else ""
+            return [
+                types.TextContent(
+                    type="text",
+                    text=f"Conversion job {job.job_id} is {job.status}{stage_info}. Call fetch-conversion again "
+                         f"later, or conversion-status with wait_seconds to wait for it."
+                )
+            ]
+        return [
+            types.EmbeddedResource.model_validate(item) if item["type"] == "resource"
+            else types.TextContent.model_validate(item)
+            for item in job.result
+        ]
+
+    if name in ("convert-batch", "convert-directory"):
+        summary = await (convert_batch(arguments) if name == "convert-batch" else convert_directory(arguments))
+        return [
+            types.TextContent(
+                type="text",
+                text=json.dumps(summary, indent=2)
+            )
+        ]
+
+    with stage("validate"):
+        requests = parse_output_requests(arguments)
+    results = await supervised_outputs(requests)
+
+    with stage("format"):
+        results = [page_result(result) for result in results]
+        message = "\n\n".join(
+            format_conversion_message(request, result) for request, result in zip(requests, results, strict=True)
         )
-        raise ValueError(error_msg) from e
+    return [
+        types.TextContent(
+            type="text",
+            text=message
+        ),
+        *(
+            embedded_resource(request, result)
+            for request, result in zip(requests, results, strict=True) if request.embed_output
+        ),
+    ]
+
+
+def warmup() -> None:
+    """Probe pandoc and run a trivial conversion so the first real call doesn't pay for either.
+
+    Also imports the filter libraries when Python filters run in-process.
+    """
+    started = time.perf_counter()
+    get_capabilities()
+    run_pandoc_text("# warmup", None, "markdown", "html", None, [])
+    if get_filter_mode() == "inprocess":
+        filter_libraries()
+    logger.info("Warmup finished in %.3fs", time.perf_counter() - started)
+
 
 async def main():
     """Run the mcp-pandoc server using stdin/stdout streams."""
+    import mcp.server.stdio
+
     async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
         await server.run(
             read_stream,
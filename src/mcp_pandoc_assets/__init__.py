@@ -0,0 +1,257 @@
+"""Content-addressed cache of rendered assets, such as diagram images, for pandoc filters.
+
+Diagram filters (mermaid, graphviz, PlantUML, ...) usually start a renderer,
+often a headless browser, for every diagram on every conversion. With this
+cache a filter asks for an asset by the diagram source, the renderer and its
+options. The first request renders it, and every later request gets the
+stored file. That holds in any document, conversion or process that shares
+the directory.
+
+This package only uses the standard library and is installed next to
+``mcp_pandoc``, so a filter imports it without loading the server. The
+server passes the cache directory to filters as ``MCP_PANDOC_ASSET_DIR``
+when the cache is enabled. A Python filter uses it like this::
+
+    from mcp_pandoc_assets import get_assets
+
+    def render(path):
+        subprocess.run(["mmdc", "--input", "-", "--output", path], input=source.encode(), check=True)
+
+    assets = get_assets()  # None when the cache is disabled
+    image = assets.get_or_render(source, "mmdc", render, suffix=".png", options={"theme": "dark"})
+
+The returned image is a hard link (or a copy) of the cached asset in the
+conversion's output directory, so the document keeps working after the
+cache evicts the asset.
+
+Concurrent requests for the same asset wait for a single render. The cache
+evicts the least recently used assets when it grows past ``max_bytes``.
+Assets used in the last ``EVICTION_GRACE_SECONDS`` are never evicted.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Callable
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+ASSET_VERSION = 1
+ASSET_DIR_ENV = "MCP_PANDOC_ASSET_DIR"
+ASSET_MAX_BYTES_ENV = "MCP_PANDOC_ASSET_MAX_BYTES"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+EVICTION_GRACE_SECONDS = 60
+
+
+class AssetCache:
+    """Size-bounded, content-addressed store of rendered assets.
+
+    Like the server's result cache, the change time of an asset is its last
+    access time, so the LRU order is shared between processes. Touching an
+    asset leaves its modification time alone, and with it the modification
+    time of every output directory it is linked into.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """Create a cache rooted at ``directory`` holding at most ``max_bytes``."""
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.directory, ".locks"), exist_ok=True)
+        self._lock_path = os.path.join(self.directory, ".lock")
+        self._approx_bytes: int | None = None
+        self.hits = 0
+        self.renders = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(source: str | bytes, renderer: str, options: dict | None = None) -> str:
+        """Hash an asset's source, renderer and renderer options into its key."""
+        digest = hashlib.sha256(source if isinstance(source, bytes) else source.encode("utf-8")).hexdigest()
+        payload = json.dumps(
+            {"v": ASSET_VERSION, "source": digest, "renderer": renderer, "options": options or {}},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str, suffix: str) -> str:
+        """Return where the asset ``key`` is stored in the cache."""
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    @contextlib.contextmanager
+    def _rendering(self, key: str):
+        # One lock file per key prefix: renders of different assets rarely wait on each other,
+        # and lock files never need to be deleted
+        with open(os.path.join(self.directory, ".locks", key[:2]), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _use(self, path: str) -> bool:
+        try:
+            # Setting the times to their current values still updates the change time
+            st = os.stat(path)
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        except FileNotFoundError:
+            return False
+        self.hits += 1
+        return True
+
+    def get_or_render(self, source: str | bytes, renderer: str, render: Callable[[str], object],
+                      suffix: str = ".png", options: dict | None = None, output_dir: str | None = None) -> str:
+        """Return the path of the asset for ``source`` in ``output_dir``, calling ``render(path)`` on a cache miss.
+
+        ``renderer`` names the tool (and version, if its output changes between
+        versions) and ``options`` holds every setting that changes the result.
+        ``render`` must write the asset to the path it is given, which ends in
+        ``suffix``. ``output_dir`` defaults to ``PANDOC_OUTPUT_DIR`` and then
+        to the current directory; the asset is hard-linked there, or copied
+        when that fails.
+        """
+        key = self.make_key(source, renderer, options)
+        path = self.path_for(key, suffix)
+        output_dir = os.path.abspath(output_dir or os.environ.get("PANDOC_OUTPUT_DIR") or os.curdir)
+        destination = os.path.join(output_dir, key[:16] + suffix)
+        while True:
+            if not self._use(path):
+                with self._rendering(key):
+                    # Another filter may have rendered it while this one waited for the lock
+                    if not self._use(path):
+                        self._render(path, render)
+            try:
+                _place(path, destination)
+            except FileNotFoundError:
+                # Evicted by another process between the render and the link
+                continue
+            return destination
+
+    def _render(self, path: str, render: Callable[[str], object]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        base, suffix = os.path.splitext(path)
+        # Keep the suffix: renderers pick the image format from the output file name
+        tmp_path = f"{base}.{os.getpid()}.tmp{suffix}"
+        try:
+            render(tmp_path)
+            size = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+            if not size:
+                raise ValueError(f"Renderer produced no output for asset {os.path.basename(path)}")
+            os.replace(tmp_path, path)
+        finally:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+        self.renders += 1
+        if self._approx_bytes is not None:
+            self._approx_bytes += size
+        # Other processes render into the same directory, so rescan periodically as well as when over budget
+        if self._approx_bytes is None or self._approx_bytes > self.max_bytes or self.renders % 100 == 0:
+            self.evict()
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        with open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            dirs[:] = [name for name in dirs if name != ".locks"]
+            for name in files:
+                if name.startswith(".") or ".tmp" in name:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_ctime, st.st_size, path))
+        return entries
+
+    def evict(self) -> None:
+        """Delete least recently used assets until the cache fits in ``max_bytes``.
+
+        Assets used within the last ``EVICTION_GRACE_SECONDS`` are kept even
+        when that leaves the cache over budget.
+        """
+        with self._exclusive():
+            entries = self._entries()
+            total = sum(size for _ctime, size, _path in entries)
+            recent = time.time() - EVICTION_GRACE_SECONDS
+            for ctime, size, path in sorted(entries):
+                if total <= self.max_bytes or ctime > recent:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                    self.evictions += 1
+                total -= size
+            self._approx_bytes = total
+
+    def stats(self) -> dict:
+        """Return the size of the cache and this process's hit/render counters."""
+        entries = self._entries()
+        return {
+            "directory": self.directory,
+            "max_bytes": self.max_bytes,
+            "assets": len(entries),
+            "bytes": sum(size for _ctime, size, _path in entries),
+            "hits": self.hits,
+            "renders": self.renders,
+            "evictions": self.evictions,
+        }
+
+
+def _place(path: str, destination: str) -> None:
+    """Hard-link (or copy) the cached asset ``path`` to ``destination``, replacing what is there."""
+    with contextlib.suppress(FileNotFoundError):
+        if os.path.samefile(path, destination):
+            return
+    directory = os.path.dirname(destination)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".asset-")
+    os.close(fd)
+    os.unlink(tmp_path)
+    try:
+        try:
+            os.link(path, tmp_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # Another file system, or hard links aren't permitted here
+            shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+_assets: AssetCache | None = None
+
+
+def get_assets() -> AssetCache | None:
+    """Return the asset cache the server passed to this filter, or None when the cache is disabled.
+
+    The cache is found through ``MCP_PANDOC_ASSET_DIR`` and bounded by
+    ``MCP_PANDOC_ASSET_MAX_BYTES``.
+    """
+    global _assets
+    directory = os.environ.get(ASSET_DIR_ENV)
+    if not directory:
+        return None
+    if _assets is None or _assets.directory != os.path.abspath(os.path.expanduser(directory)):
+        _assets = AssetCache(directory, int(os.environ.get(ASSET_MAX_BYTES_ENV) or DEFAULT_MAX_BYTES))
+    return _assets
@@ -3,17 +3,50 @@
 This file tests enhanced functionality beyond basic conversions:
 1. Defaults file support (YAML configuration files) - Added in PR #24
 2. Enhanced filter support with path resolution - Added in PR #24
-3. Future advanced features will be added here
+3. Bounded worker pool for conversions off the event loop
+4. Content-addressed conversion result cache
+5. convert-batch tool for parallel conversions
+6. In-process execution of panflute/pandocfilters Python filters
+7. Multi-output conversions (parse once, write many)
+8. Cached defaults files and filter path resolution
+9. Persistent pandoc server backend
+10. Paged delivery of large converted results
+11. Binary outputs returned in memory as embedded resources
+12. Precompiled LaTeX preamble formats for xelatex PDFs
+13. Selectable and auto-benchmarked PDF engines
+14. Parallel sectioned parsing of large markdown/html inputs
+15. Benchmark harness statistics and regression comparison
+16. Per-call traces, child process metrics and the server-stats tool
+17. Cached pandoc capability probe, lazy imports and warmup
+18. Blocking and asyncio pandoc drivers with exit-code error categories
+19. Background conversion jobs (submit, status, fetch) with optional SQLite storage
+20. Timeouts, cancellation and CPU/memory limits for child processes
+21. Content-addressed cache of rendered diagram assets for filters
+22. Incremental convert-directory tool with a change manifest
+23. Book builds from ordered chapter files with a per-chapter AST cache
+24. Single-flight coalescing of identical conversions in flight
+25. Standalone HTTP service (server.py): coalescing, backpressure, streaming and uploads
+26. Future advanced features will be added here
 
 Focuses on testing advanced feature functionality and integration.
 """
+import asyncio
+import json
+import logging
 import os
+import re
 import sys
 import tempfile
+import threading
+import time
 
 import pytest
 import yaml
 
+SRC_PATH = os.path.join(os.path.dirname(__file__), '..', 'src')
+if SRC_PATH not in sys.path:
+    sys.path.insert(0, SRC_PATH)
+
 
 class TestDefaultsFileSupport:
     """Test the defaults file functionality added in PR #24"""
@@ -340,3 +373,2531 @@ class TestVersionUpdate:
         assert yaml
         assert pandocfilters
         assert panflute
+
+
+class TestConversionPool:
+    """Test the bounded worker pool used to run conversions off the event loop"""
+
+    @pytest.mark.asyncio
+    async def test_runs_blocking_work_off_the_event_loop(self):
+        """Blocking work runs in a worker thread, not on the event loop thread"""
+        from mcp_pandoc.pool import ConversionPool
+
+        pool = ConversionPool(max_workers=2)
+        try:
+            worker_thread = await pool.run(threading.get_ident)
+            assert worker_thread != threading.get_ident()
+        finally:
+            pool.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_concurrency_cap(self):
+        """No more than max_workers jobs run at the same time"""
+        from mcp_pandoc.pool import ConversionPool
+
+        pool = ConversionPool(max_workers=2)
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def job():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        try:
+            await asyncio.gather(*(pool.run(job) for _ in range(6)))
+        finally:
+            pool.shutdown()
+
+        assert max(peak) <= 2
+
+    @pytest.mark.asyncio
+    async def test_queue_full_fails_fast(self):
+        """Callers beyond the queue limit are rejected instead of waiting"""
+        from mcp_pandoc.pool import ConversionPool
+
+        pool = ConversionPool(max_workers=1, max_queue=1)
+        release = threading.Event()
+        try:
+            running = asyncio.ensure_future(pool.run(release.wait))
+            await asyncio.sleep(0.01)
+            queued = asyncio.ensure_future(pool.run(lambda: "queued"))
+            await asyncio.sleep(0.01)
+
+            with pytest.raises(ValueError, match="queue is full"):
+                await pool.run(lambda: "rejected")
+
+            release.set()
+            assert await running is True
+            assert await queued == "queued"
+        finally:
+            release.set()
+            pool.shutdown()
+
+    def test_invalid_executor_rejected(self):
+        """Only thread and process executors are supported"""
+        from mcp_pandoc.pool import ConversionPool
+
+        with pytest.raises(ValueError, match="Unsupported executor"):
+            ConversionPool(executor="fiber")
+
+    @pytest.mark.asyncio
+    async def test_handle_call_tool_converts_through_pool(self):
+        """convert-contents still returns converted text when run through the pool"""
+        from mcp_pandoc import server
+
+        result = await server.handle_call_tool(
+            "convert-contents",
+            {"contents": "# Pooled", "input_format": "markdown", "output_format": "html"}
+        )
+
+        assert "<h1" in result[0].text
+        assert "Pooled" in result[0].text
+
+
+class TestResultCache:
+    """Test the content-addressed conversion result cache"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        import shutil
+
+        from mcp_pandoc import cache
+        cache.configure(directory=None)
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_text_round_trip_and_counters(self):
+        """Stored text is returned on a hit and counted"""
+        from mcp_pandoc.cache import ResultCache
+
+        cache = ResultCache(os.path.join(self.temp_dir, "cache"))
+        key = cache.make_key(input_sha256="abc", output_format="html")
+
+        assert cache.get_text(key) is None
+        cache.put_text(key, "<p>cached</p>")
+        assert cache.get_text(key) == "<p>cached</p>"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_binary_copy_to_output_file(self):
+        """Cached binary outputs are copied to the requested output path"""
+        from mcp_pandoc.cache import ResultCache
+
+        cache = ResultCache(os.path.join(self.temp_dir, "cache"))
+        source = os.path.join(self.temp_dir, "source.docx")
+        with open(source, "wb") as f:
+            f.write(b"PK\x03\x04binary")
+        key = cache.make_key(input_sha256="abc", output_format="docx")
+
+        cache.put_file(key, source)
+        destination = os.path.join(self.temp_dir, "nested", "copy.docx")
+        assert cache.copy_to(key, destination)
+        with open(destination, "rb") as f:
+            assert f.read() == b"PK\x03\x04binary"
+
+    def test_lru_eviction(self):
+        """Least recently used entries are evicted once the size limit is exceeded"""
+        from mcp_pandoc.cache import ResultCache
+
+        cache = ResultCache(os.path.join(self.temp_dir, "cache"), max_bytes=250)
+        keys = [cache.make_key(n=n) for n in range(3)]
+        for n, key in enumerate(keys):
+            cache.put_text(key, "x" * 100)
+            entry = cache._entry_path(key)
+            os.utime(entry, (1000 + n, 1000 + n))
+
+        cache.evict()
+
+        assert cache.get_text(keys[0]) is None
+        assert cache.get_text(keys[2]) == "x" * 100
+        assert cache.stats()["evictions"] == 1
+
+    def test_key_changes_with_referenced_file_content(self):
+        """Editing a referenced file (e.g. a filter) changes the cache key"""
+        from mcp_pandoc.cache import ResultCache, file_fingerprint
+
+        filter_path = os.path.join(self.temp_dir, "filter.py")
+        with open(filter_path, "w") as f:
+            f.write("# v1")
+        first = ResultCache.make_key(files=[file_fingerprint(filter_path)])
+
+        with open(filter_path, "w") as f:
+            f.write("# version 2")
+        second = ResultCache.make_key(files=[file_fingerprint(filter_path)])
+
+        assert first != second
+
+    def test_key_covers_parallel_sections_and_digest_memo_bounded(self, monkeypatch):
+        """Sectioned and single-pass reads are cached apart; file digests are memoized for a bounded number of files"""
+        from mcp_pandoc import cache
+        from mcp_pandoc.server import conversion_cache_key, parse_conversion_arguments
+
+        arguments = {"contents": "# Title", "output_format": "html"}
+        single = conversion_cache_key(parse_conversion_arguments(arguments), [], [])
+        sectioned = conversion_cache_key(parse_conversion_arguments({**arguments, "parallel_sections": 2}), [], [])
+        assert single != sectioned
+
+        monkeypatch.setattr(cache, "MAX_DIGEST_MEMO", 3)
+        monkeypatch.setattr(cache, "_digest_memo", type(cache._digest_memo)())
+        paths = []
+        for index in range(5):
+            paths.append(os.path.join(self.temp_dir, f"file{index}"))
+            with open(paths[-1], "w") as f:
+                f.write(str(index))
+            cache.file_digest(paths[-1])
+            cache.file_digest(paths[0])
+        assert len(cache._digest_memo) == 3
+        assert os.path.abspath(paths[0]) in {path for path, _mtime, _size in cache._digest_memo}
+
+    @pytest.mark.asyncio
+    async def test_repeated_conversion_served_from_cache(self):
+        """A repeated convert-contents call is answered from the cache"""
+        from mcp_pandoc import cache, server
+
+        result_cache = cache.configure(directory=os.path.join(self.temp_dir, "cache"))
+        arguments = {"contents": "# Cached", "input_format": "markdown", "output_format": "html"}
+
+        first = await server.handle_call_tool("convert-contents", arguments)
+        second = await server.handle_call_tool("convert-contents", arguments)
+
+        assert "served from cache" not in first[0].text
+        assert "served from cache" in second[0].text
+        assert "Cached</h1>" in second[0].text
+        assert result_cache.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_cached_outputs_are_linked_and_never_overwritten_in_place(self):
+        """A hit hard-links the entry to the output file; converting into that file again leaves the entry intact"""
+        from mcp_pandoc import cache, server
+
+        result_cache = cache.configure(directory=os.path.join(self.temp_dir, "cache"))
+        output_file = os.path.join(self.temp_dir, "out.html")
+        arguments = {"contents": "# Linked", "output_format": "html", "output_file": output_file}
+
+        await server.handle_call_tool("convert-contents", arguments)
+        second = await server.handle_call_tool("convert-contents", arguments)
+        assert "served from cache" in second[0].text
+        assert os.stat(output_file).st_nlink == 2
+        mtime = os.stat(output_file).st_mtime_ns
+        await server.handle_call_tool("convert-contents", arguments)
+        assert os.stat(output_file).st_mtime_ns == mtime
+
+        await server.handle_call_tool("convert-contents", {**arguments, "contents": "# Changed"})
+        assert "Changed" in open(output_file).read()
+        third = await server.handle_call_tool("convert-contents", arguments)
+        assert "served from cache" in third[0].text and "Linked" in open(output_file).read()
+        assert result_cache.stats()["hits"] == 3
+
+    @pytest.mark.asyncio
+    async def test_filtered_conversions_skip_the_cache(self):
+        """Filters may write files of their own, which a cached result can't restore"""
+        from mcp_pandoc import cache, server
+
+        result_cache = cache.configure(directory=os.path.join(self.temp_dir, "cache"))
+        side_filter = os.path.join(self.temp_dir, "side_filter.sh")
+        with open(side_filter, "w") as f:
+            f.write(f'#!/bin/sh\necho image > "{self.temp_dir}/figure.png"\ncat\n')
+        os.chmod(side_filter, 0o755)
+        figure = os.path.join(self.temp_dir, "figure.png")
+        arguments = {"contents": "# Figure", "output_format": "html", "filters": [side_filter],
+                     "output_file": os.path.join(self.temp_dir, "report.html")}
+
+        await server.handle_call_tool("convert-contents", arguments)
+        os.remove(figure)
+        second = await server.handle_call_tool("convert-contents", arguments)
+        assert "served from cache" not in second[0].text
+        assert os.path.exists(figure)
+        assert result_cache.stats()["stores"] == 0
+
+
+class TestConvertBatch:
+    """Test the convert-batch tool"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        import shutil
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    @pytest.mark.asyncio
+    async def test_tool_is_listed(self):
+        """convert-batch is advertised next to convert-contents"""
+        from mcp_pandoc import server
+
+        tools = {tool.name: tool for tool in await server.handle_list_tools()}
+
+        assert "convert-batch" in tools
+        assert tools["convert-batch"].inputSchema["properties"]["conversions"]["items"] == (
+            tools["convert-contents"].inputSchema
+        )
+
+    @pytest.mark.asyncio
+    async def test_failures_do_not_abort_batch(self):
+        """Invalid and failing items are reported while the rest still convert"""
+        import json
+
+        from mcp_pandoc import server
+
+        output_file = os.path.join(self.temp_dir, "chapter.html")
+        result = await server.handle_call_tool("convert-batch", {
+            "conversions": [
+                {"contents": "# One", "output_format": "html", "output_file": output_file},
+                {"contents": "# Two", "output_format": "docx"},
+                {"input_file": os.path.join(self.temp_dir, "missing.md"), "output_format": "html"},
+                {"contents": "# Three", "output_format": "rst", "output_file": os.path.join(self.temp_dir, "c.rst")},
+            ],
+            "max_parallel": 2,
+        })
+        summary = json.loads(result[0].text)
+
+        assert summary["total"] == 4
+        assert summary["succeeded"] == 2
+        assert [item["status"] for item in summary["items"]] == ["ok", "invalid", "error", "ok"]
+        assert "output_file path is required" in summary["items"][1]["error"]
+        assert "Input file not found" in summary["items"][2]["error"]
+        assert summary["items"][0]["output_file"] == output_file
+        assert "seconds" in summary["items"][0]
+        assert os.path.exists(output_file)
+
+    @pytest.mark.asyncio
+    async def test_empty_batch_rejected(self):
+        """A batch needs at least one conversion"""
+        from mcp_pandoc import server
+
+        with pytest.raises(ValueError, match="non-empty array"):
+            await server.handle_call_tool("convert-batch", {"conversions": []})
+
+
+PANFLUTE_FILTER = '''#!/usr/bin/env python3
+import panflute as pf
+
+def action(elem, doc):
+    if isinstance(elem, pf.Str) and elem.text == "hello":
+        return pf.Str("HELLO-" + doc.format)
+
+def main(doc=None):
+    return pf.run_filter(action, doc=doc)
+
+if __name__ == "__main__":
+    main()
+'''
+
+PANDOCFILTERS_FILTER = '''#!/usr/bin/env python3
+from pandocfilters import Str, toJSONFilter
+
+def caps(key, value, format, meta):
+    if key == "Str" and value == "world":
+        return Str("WORLD")
+
+def main():
+    toJSONFilter(caps)
+
+if __name__ == "__main__":
+    main()
+'''
+
+RAW_JSON_FILTER = '''#!/usr/bin/env python3
+import json
+import sys
+
+doc = json.load(sys.stdin)
+doc["blocks"].append({"t": "Para", "c": [{"t": "Str", "c": "raw-" + sys.argv[1]}]})
+json.dump(doc, sys.stdout)
+'''
+
+
+class TestInProcessFilters:
+    """Test running Python filters in-process on a shared AST"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.filters = []
+        for name, source in [("pf.py", PANFLUTE_FILTER), ("pdf.py", PANDOCFILTERS_FILTER),
+                             ("raw.py", RAW_JSON_FILTER)]:
+            path = os.path.join(self.temp_dir, name)
+            with open(path, "w") as f:
+                f.write(source)
+            os.chmod(path, 0o755)
+            self.filters.append(path)
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        import shutil
+
+        from mcp_pandoc import filters
+        filters.configure(mode="subprocess")
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    async def _convert(self, mode):
+        from mcp_pandoc import filters, server
+
+        filters.configure(mode=mode)
+        result = await server.handle_call_tool("convert-contents", {
+            "contents": "hello world", "output_format": "html", "filters": self.filters
+        })
+        return result[0].text.split("Converted Contents:")[1].strip()
+
+    @pytest.mark.asyncio
+    async def test_inprocess_matches_subprocess_output(self):
+        """Both modes apply the same chain, in order, with the target format"""
+        subprocess_output = await self._convert("subprocess")
+        inprocess_output = await self._convert("inprocess")
+
+        assert inprocess_output == subprocess_output
+        assert "HELLO-html WORLD" in inprocess_output
+        assert "raw-html" in inprocess_output
+
+    def test_filter_modules_are_imported_once(self):
+        """Library-based filters are cached; plain scripts fall back to subprocesses"""
+        from mcp_pandoc import filters
+
+        pf_path, pdf_path, raw_path = self.filters
+        assert filters._load_filter_module(pf_path) is filters._load_filter_module(pf_path)
+        assert filters._load_filter_module(pdf_path) is not None
+        assert filters._load_filter_module(raw_path) is None
+
+    def test_invalid_mode_rejected(self):
+        """Only subprocess and inprocess modes exist"""
+        from mcp_pandoc import filters
+
+        with pytest.raises(ValueError, match="Unsupported filter mode"):
+            filters.configure(mode="threaded")
+
+    def test_filter_variables_stay_scoped_to_the_filter(self):
+        """Filters see pandoc's variables; the process environment and other threads never do"""
+        import json
+
+        from mcp_pandoc import filters
+
+        env_filter = os.path.join(self.temp_dir, "env.py")
+        with open(env_filter, "w") as f:
+            f.write('''#!/usr/bin/env python3
+import json
+import os
+import re
+import threading
+
+import panflute as pf
+
+def main(doc=None):
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(os.environ.get("PANDOC_OUTPUT_DIR")))
+    thread.start()
+    thread.join()
+    options = json.loads(os.environ["PANDOC_READER_OPTIONS"])
+    words = [os.path.basename(os.environ["PANDOC_OUTPUT_DIR"]), "tab-stop-%d" % options["tab-stop"], str(seen[0])]
+    return pf.run_filter(lambda elem, doc: None, doc=doc,
+                         finalize=lambda doc: doc.content.append(pf.Para(*[pf.Str(word) for word in words])))
+
+if __name__ == "__main__":
+    main()
+''')
+        os.chmod(env_filter, 0o755)
+        raw_filter = os.path.join(self.temp_dir, "raw_env.py")
+        with open(raw_filter, "w") as f:
+            f.write(RAW_JSON_FILTER.replace("import sys", "import os\nimport sys").replace(
+                '"raw-" + sys.argv[1]', '"raw-%d" % json.loads(os.environ["PANDOC_READER_OPTIONS"])["tab-stop"]'
+            ))
+        os.chmod(raw_filter, 0o755)
+
+        output_dir = os.path.join(self.temp_dir, "site")
+        ast_json = filters.read_ast_with_filters(
+            "Text", None, "markdown", ["--tab-stop=2"], [env_filter, raw_filter], "html", output_dir
+        )
+        blocks = json.loads(ast_json)["blocks"]
+        assert [inline["c"] for inline in blocks[1]["c"] if inline["t"] == "Str"] == ["site", "tab-stop-2", "None"]
+        assert blocks[2]["c"][0]["c"] == "raw-2"
+        assert "PANDOC_OUTPUT_DIR" not in os.environ and "PANDOC_READER_OPTIONS" not in os.environ
+
+
+COUNTING_FILTER = '''#!/usr/bin/env python3
+import json
+import os
+import re
+import sys
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "runs.log"), "a") as log:
+    log.write(sys.argv[1] + "\\n")
+json.dump(json.load(sys.stdin), sys.stdout)
+'''
+
+
+class TestMultipleOutputs:
+    """Test writing several formats from one parse of the input"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.filter_path = os.path.join(self.temp_dir, "counting.py")
+        with open(self.filter_path, "w") as f:
+            f.write(COUNTING_FILTER)
+        os.chmod(self.filter_path, 0o755)
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        import shutil
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    @pytest.mark.asyncio
+    async def test_outputs_share_one_parse(self):
+        """Every output is written while the filter chain runs once per distinct output format"""
+        from mcp_pandoc import server
+
+        html_file = os.path.join(self.temp_dir, "report.html")
+        docx_file = os.path.join(self.temp_dir, "report.docx")
+        result = await server.handle_call_tool("convert-contents", {
+            "contents": "# Report\n\nBody text.",
+            "filters": [self.filter_path],
+            "outputs": [
+                {"output_format": "html", "output_file": html_file},
+                {"output_format": "docx", "output_file": docx_file},
+                {"output_format": "rst", "output_file": os.path.join(self.temp_dir, "report.rst")},
+                {"output_format": "html", "output_file": os.path.join(self.temp_dir, "copy.html")},
+            ],
+        })
+
+        assert os.path.exists(html_file)
+        assert os.path.exists(docx_file)
+        assert f"saved to: {html_file}" in result[0].text
+        assert f"saved to: {docx_file}" in result[0].text
+        with open(os.path.join(self.temp_dir, "runs.log")) as log:
+            assert sorted(log.read().split()) == ["docx", "html", "rst"]
+
+    @pytest.mark.asyncio
+    async def test_filters_see_each_output_format(self):
+        """A filter's output can depend on the format it writes to, also for sectioned reads"""
+        from mcp_pandoc import server
+
+        format_filter = os.path.join(self.temp_dir, "format.py")
+        with open(format_filter, "w") as f:
+            f.write(
+                "#!/usr/bin/env python3\n"
+                "import json, sys\n"
+                "doc = json.load(sys.stdin)\n"
+                "doc['blocks'].append({'t': 'Para', 'c': [{'t': 'Str', 'c': 'written-as-' + sys.argv[1]}]})\n"
+                "json.dump(doc, sys.stdout)\n"
+            )
+        os.chmod(format_filter, 0o755)
+        for extra in ({}, {"parallel_sections": 2}):
+            result = await server.handle_call_tool("convert-contents", {
+                "contents": "# One\n\nFirst.\n\n# Two\n\nSecond.",
+                "filters": [format_filter],
+                "outputs": [{"output_format": "html"}, {"output_format": "markdown"}],
+                **extra,
+            })
+            text = "\n".join(item.text for item in result)
+            assert "<p>written-as-html</p>" in text and "written-as-markdown" in text
+            assert text.count("written-as-html") == 1
+
+    @pytest.mark.asyncio
+    async def test_text_outputs_are_returned(self):
+        """Outputs without a file are returned inline"""
+        from mcp_pandoc import server
+
+        result = await server.handle_call_tool("convert-contents", {
+            "contents": "# Inline",
+            "outputs": [{"output_format": "html"}, {"output_format": "markdown"}],
+        })
+
+        assert "<h1" in result[0].text
+        assert "# Inline" in result[0].text
+
+    @pytest.mark.asyncio
+    async def test_outputs_are_validated_individually(self):
+        """Each output is validated like a single conversion"""
+        from mcp_pandoc import server
+
+        with pytest.raises(ValueError, match="output_file path is required for docx"):
+            await server.handle_call_tool("convert-contents", {
+                "contents": "# Report",
+                "outputs": [{"output_format": "html"}, {"output_format": "docx"}],
+            })
+
+        with pytest.raises(ValueError, match="not both"):
+            await server.handle_call_tool("convert-contents", {
+                "contents": "# Report", "output_format": "html", "outputs": [{"output_format": "rst"}],
+            })
+
+
+class TestResolutionCaches:
+    """Test the mtime-validated caches for defaults files and filter paths"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        import shutil
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_defaults_file_parsed_once_until_changed(self):
+        """The parsed defaults are reused until the file changes"""
+        from mcp_pandoc import server
+
+        defaults_path = os.path.join(self.temp_dir, "defaults.yaml")
+        with open(defaults_path, "w") as f:
+            yaml.dump({"standalone": True}, f)
+
+        first = server.load_defaults_file(defaults_path)
+        assert server.load_defaults_file(defaults_path) is first
+
+        with open(defaults_path, "w") as f:
+            yaml.dump({"standalone": False, "toc": True}, f)
+        os.utime(defaults_path, ns=(0, os.stat(defaults_path).st_mtime_ns + 1_000_000))
+
+        assert server.load_defaults_file(defaults_path) == {"standalone": False, "toc": True}
+
+    def test_invalid_defaults_file_still_rejected(self):
+        """Validation errors are raised on every call, not cached"""
+        from mcp_pandoc import server
+
+        defaults_path = os.path.join(self.temp_dir, "list.yaml")
+        with open(defaults_path, "w") as f:
+            f.write("- not\n- a\n- dict\n")
+
+        for _ in range(2):
+            with pytest.raises(ValueError, match="must be a YAML dictionary"):
+                server.load_defaults_file(defaults_path)
+
+    def test_filter_resolution_cached_until_file_changes(self, caplog):
+        """Filter paths are resolved once and re-resolved when the file goes away"""
+        from mcp_pandoc import server
+
+        filter_path = os.path.join(self.temp_dir, "cached_filter.py")
+        with open(filter_path, "w") as f:
+            f.write("#!/usr/bin/env python3\n")
+        os.chmod(filter_path, 0o755)
+
+        with caplog.at_level(logging.DEBUG, logger="mcp_pandoc"):
+            assert server.resolve_filter_path(filter_path) == filter_path
+            assert server.resolve_filter_path(filter_path) == filter_path
+        assert caplog.text.count("Using filter") == 1
+
+        os.remove(filter_path)
+        assert server.resolve_filter_path(filter_path) is None
+
+    def test_filter_resolution_prefers_new_earlier_location(self, monkeypatch):
+        """A filter created later at a higher-priority location replaces a cached resolution"""
+        from mcp_pandoc import server
+
+        defaults_dir = os.path.join(self.temp_dir, "defaults")
+        work_dir = os.path.join(self.temp_dir, "work")
+        os.makedirs(defaults_dir)
+        os.makedirs(work_dir)
+        monkeypatch.chdir(work_dir)
+        defaults_path = os.path.join(defaults_dir, "defaults.yaml")
+        next_to_defaults = os.path.join(defaults_dir, "priority_filter.py")
+        with open(next_to_defaults, "w") as f:
+            f.write("#!/usr/bin/env python3\n")
+        os.chmod(next_to_defaults, 0o755)
+
+        assert server.resolve_filter_path("priority_filter.py", defaults_path) == next_to_defaults
+        assert server.resolve_filter_path("priority_filter.py", defaults_path) == next_to_defaults
+
+        # The working directory is searched first
+        with open(os.path.join(work_dir, "priority_filter.py"), "w") as f:
+            f.write("#!/usr/bin/env python3\n")
+        os.chmod(os.path.join(work_dir, "priority_filter.py"), 0o755)
+        assert server.resolve_filter_path("priority_filter.py", defaults_path) == os.path.join(
+            work_dir, "priority_filter.py"
+        )
+
+
+FAKE_PANDOC_SERVER = '''#!/usr/bin/env python3
+import base64
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply(200, "3.0-fake")
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if request["to"] == "docx":
+            output = base64.b64encode(b"PK-fake-docx").decode("ascii")
+            self.reply(200, {"output": output, "base64": True, "messages": []})
+        elif request["to"] == "html":
+            self.reply(200, {"output": "<p>" + request["text"].upper() + "</p>", "base64": False, "messages": []})
+        else:
+            self.reply(500, {"error": "unsupported by fake server"})
+
+
+port = int(sys.argv[sys.argv.index("--port") + 1])
+ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+'''
+
+
+class TestPandocServerBackend:
+    """Test the optional pool of warm pandoc server processes"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.fake_pandoc = os.path.join(self.temp_dir, "fake-pandoc")
+        with open(self.fake_pandoc, "w") as f:
+            f.write(FAKE_PANDOC_SERVER.replace("#!/usr/bin/env python3", f"#!{sys.executable}", 1))
+        os.chmod(self.fake_pandoc, 0o755)
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        import shutil
+
+        from mcp_pandoc import pandoc_server
+        pandoc_server.configure(backend="subprocess")
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_pool_converts_over_keep_alive_connections(self):
+        """Text and base64 outputs come back from a warm worker"""
+        from mcp_pandoc.pandoc_server import PandocServerPool
+
+        pool = PandocServerPool(workers=1, pandoc_path=self.fake_pandoc).start()
+        try:
+            assert pool.available
+            assert pool.convert("hello", "markdown", "html") == "<p>HELLO</p>"
+            assert pool.convert("again", "markdown", "html") == "<p>AGAIN</p>"
+
+            docx_path = os.path.join(self.temp_dir, "out.docx")
+            assert pool.convert("hello", "markdown", "docx", docx_path) == ""
+            with open(docx_path, "rb") as f:
+                assert f.read() == b"PK-fake-docx"
+        finally:
+            pool.close()
+
+    def test_dead_worker_is_restarted(self):
+        """A worker whose process died is restarted and the request retried"""
+        from mcp_pandoc.pandoc_server import PandocServerPool
+
+        pool = PandocServerPool(workers=1, pandoc_path=self.fake_pandoc).start()
+        try:
+            pool._workers[0]._process.kill()
+            pool._workers[0]._process.wait()
+
+            assert pool.convert("back", "markdown", "html") == "<p>BACK</p>"
+            assert pool.stats()["restarts"] == 1
+        finally:
+            pool.close()
+
+    def test_dropped_worker_restarted_with_backoff(self, monkeypatch):
+        """A worker that cannot be restarted is dropped, then restarted in the background once pandoc serves again"""
+        from mcp_pandoc import pandoc_server
+        from mcp_pandoc.pandoc_server import PandocServerError, PandocServerPool
+
+        monkeypatch.setattr(pandoc_server, "_RETRY_INITIAL", 0.05)
+        broken = os.path.join(self.temp_dir, "broken-pandoc")
+        with open(broken, "w") as f:
+            f.write("#!/bin/sh\nexit 1\n")
+        os.chmod(broken, 0o755)
+
+        pool = PandocServerPool(workers=1, pandoc_path=self.fake_pandoc).start()
+        try:
+            worker = pool._workers[0]
+            worker.pandoc_path = broken
+            worker._process.kill()
+            worker._process.wait()
+            with pytest.raises(PandocServerError):
+                pool.convert("gone", "markdown", "html")
+            assert not pool.available and pool.stats()["retrying"] == 1
+
+            # Failed attempts back off; once pandoc serves again the worker rejoins the pool
+            time.sleep(0.2)
+            assert not pool.available and worker.restarts >= 2
+            worker.pandoc_path = self.fake_pandoc
+            deadline = time.monotonic() + 10
+            while not pool.available and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert pool.available and pool.stats()["retrying"] == 0
+            assert pool.convert("back", "markdown", "html") == "<p>BACK</p>"
+        finally:
+            pool.close()
+        assert pool.stats()["retrying"] == 0
+
+    @pytest.mark.asyncio
+    async def test_server_errors_and_ineligible_requests_fall_back(self):
+        """Filters, server errors and unusable servers all use the subprocess path"""
+        from mcp_pandoc import pandoc_server, server
+
+        pandoc_server.configure(backend="server", workers=1, pandoc_path=self.fake_pandoc)
+        result = await server.handle_call_tool("convert-contents", {"contents": "hi there", "output_format": "html"})
+        assert "<p>HI THERE</p>" in result[0].text
+
+        # The fake server rejects markdown output, so pandoc itself runs
+        result = await server.handle_call_tool("convert-contents", {"contents": "*hi*", "output_format": "markdown"})
+        assert "*hi*" in result[0].text
+
+        request = server.parse_conversion_arguments({"contents": "x", "output_format": "html"})
+        assert server.server_backend_eligible(request, [])
+        assert not server.server_backend_eligible(request, ["/some/filter.py"])
+
+        # A pandoc that cannot serve requests leaves the backend unavailable
+        broken = os.path.join(self.temp_dir, "broken-pandoc")
+        with open(broken, "w") as f:
+            f.write("#!/bin/sh\nexit 1\n")
+        os.chmod(broken, 0o755)
+        pandoc_server.configure(backend="server", workers=1, pandoc_path=broken)
+        assert pandoc_server.get_server_pool() is None
+        result = await server.handle_call_tool("convert-contents", {"contents": "hi there", "output_format": "html"})
+        assert "<p>hi there</p>" in result[0].text
+
+
+class TestPagedResults:
+    """Test server-side storage and paging of large converted results"""
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        from mcp_pandoc import results
+        results.configure(page_chars=results.DEFAULT_PAGE_CHARS)
+
+    def test_pages_reassemble_original_text(self):
+        """Character offsets stay exact across multi-byte text and index marks"""
+        from mcp_pandoc.results import ResultStore
+
+        store = ResultStore(page_chars=50_000)
+        text = "".join(f"line {i} – ünïcødé ✓\r\n" for i in range(20_000))
+        stored = store.put(text)
+        try:
+            pieces, offset = [], 0
+            while offset is not None:
+                page = store.read(stored.result_id, offset)
+                assert len(page["text"]) <= 50_000
+                pieces.append(page["text"])
+                offset = page["next_offset"]
+            assert "".join(pieces) == text
+            assert store.read(stored.result_id, 70_001, 10)["text"] == text[70_001:70_011]
+        finally:
+            store.close()
+
+    def test_oldest_results_evicted(self):
+        """The store keeps at most max_results results"""
+        from mcp_pandoc.results import ResultStore
+
+        store = ResultStore(page_chars=10, max_results=2)
+        try:
+            first = store.put("a" * 100)
+            store.put("b" * 100)
+            store.put("c" * 100)
+            assert store.stats()["results"] == 2
+            assert not os.path.exists(first.path)
+            with pytest.raises(ValueError, match="Unknown or expired"):
+                store.read(first.result_id)
+        finally:
+            store.close()
+
+    @pytest.mark.asyncio
+    async def test_large_conversion_returns_first_page_and_handle(self):
+        """convert-contents returns a result_id that read-conversion-result pages through"""
+        import re
+
+        from mcp_pandoc import results, server
+
+        results.configure(page_chars=1000)
+        contents = "\n\n".join(f"Paragraph {i} with some text." for i in range(500))
+        expected = await asyncio.to_thread(server.run_pandoc_text, contents, None, "markdown", "html", None, [])
+
+        result = await server.handle_call_tool("convert-contents", {"contents": contents, "output_format": "html"})
+        message = result[0].text
+        result_id = re.search(r'result_id "([0-9a-f]+)"', message).group(1)
+        first_page = message.split("Converted Contents:\n\n", 1)[1]
+        assert first_page == expected[:1000]
+
+        pages, offset = [first_page], len(first_page)
+        while True:
+            reply = await server.handle_call_tool(
+                "read-conversion-result", {"result_id": result_id, "offset": offset}
+            )
+            header, text = reply[0].text.split(":\n\n", 1)
+            pages.append(text)
+            if "end of result" in header:
+                break
+            offset = int(header.rsplit(" ", 1)[1].rstrip(")"))
+        assert "".join(pages) == expected
+
+
+class TestEmbeddedOutputs:
+    """Test returning converted documents in memory as embedded resources"""
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        from mcp_pandoc import results
+        results.configure()
+
+    @pytest.mark.asyncio
+    async def test_docx_returned_as_blob_without_output_file(self):
+        """Binary output comes back as a base64 blob with the docx MIME type"""
+        import base64
+        import io
+        import zipfile
+
+        from mcp_pandoc import server
+
+        result = await server.handle_call_tool("convert-contents", {
+            "contents": "# Embedded\n\nHello", "output_format": "docx", "embed_output": True
+        })
+        assert "embedded resource" in result[0].text
+        resource = result[1].resource
+        assert resource.mimeType == server.OUTPUT_MEDIA_TYPES["docx"][1]
+        with zipfile.ZipFile(io.BytesIO(base64.b64decode(resource.blob))) as docx:
+            assert "Hello" in docx.read("word/document.xml").decode("utf-8")
+
+    @pytest.mark.asyncio
+    async def test_multiple_outputs_mix_files_and_embedded(self):
+        """A top-level embed_output only applies to outputs without an output_file"""
+        from mcp_pandoc import server
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            html_path = os.path.join(temp_dir, "out.html")
+            result = await server.handle_call_tool("convert-contents", {
+                "contents": "*mixed*",
+                "embed_output": True,
+                "outputs": [
+                    {"output_format": "html", "output_file": html_path},
+                    {"output_format": "epub"},
+                    {"output_format": "rst"},
+                ],
+            })
+            assert os.path.exists(html_path)
+        assert [item.resource.mimeType for item in result[1:]] == ["application/epub+zip", "text/x-rst"]
+        assert result[2].resource.text.strip() == "*mixed*"
+
+    @pytest.mark.asyncio
+    async def test_size_limit_and_conflicting_arguments(self):
+        """Oversized outputs and embed_output plus output_file are rejected"""
+        from mcp_pandoc import results, server
+
+        with pytest.raises(ValueError, match="either output_file or embed_output"):
+            server.parse_conversion_arguments({
+                "contents": "x", "output_format": "docx", "output_file": "/tmp/x.docx", "embed_output": True
+            })
+
+        results.configure(max_embed_bytes=100)
+        with pytest.raises(ValueError, match="byte limit for embedded outputs"):
+            await server.handle_call_tool("convert-contents", {
+                "contents": "too big", "output_format": "odt", "embed_output": True
+            })
+
+
+FAKE_XELATEX = '''#!/usr/bin/env python3
+import os
+import re
+import sys
+
+with open(os.environ["FAKE_XELATEX_LOG"], "a") as log:
+    if "-ini" in sys.argv:
+        key = next(arg for arg in sys.argv if arg.startswith("-jobname=")).split("=", 1)[1]
+        with open("preamble.tex") as f:
+            if "UNDUMPABLE" in f.read():
+                sys.exit(1)
+        log.write("dump\\n")
+        with open(key + ".fmt", "w") as f:
+            f.write("format")
+    else:
+        fmt = next(arg for arg in sys.argv if arg.startswith("-fmt=")).split("=", 1)[1]
+        log.write("compile " + fmt + "\\n")
+        with open("doc.pdf", "w") as f:
+            f.write("%PDF-fake " + fmt)
+        with open("doc.log", "w") as f:
+            f.write("")
+'''
+
+
+class TestLatexFormatCache:
+    """Test the dumped-preamble format cache for xelatex PDFs"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.format_dir = os.path.join(self.temp_dir, "formats")
+        self.log_path = os.path.join(self.temp_dir, "xelatex.log")
+        self.fake_xelatex = os.path.join(self.temp_dir, "xelatex")
+        with open(self.fake_xelatex, "w") as f:
+            f.write(FAKE_XELATEX.replace("#!/usr/bin/env python3", f"#!{sys.executable}", 1))
+        os.chmod(self.fake_xelatex, 0o755)
+        self.base_format = os.path.join(self.temp_dir, "xelatex.fmt")
+        with open(self.base_format, "w") as f:
+            f.write("base")
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        import shutil
+
+        from mcp_pandoc import latex_format
+        latex_format.configure()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _log(self):
+        with open(self.log_path) as f:
+            return f.read().split()
+
+    def test_format_dumped_once_and_rebuilt_on_change(self, monkeypatch):
+        """A preamble is dumped once, reused, and redumped when it or TeX changes"""
+        from mcp_pandoc import latex_format
+
+        monkeypatch.setenv("FAKE_XELATEX_LOG", self.log_path)
+        monkeypatch.setattr(latex_format, "_tex_tools", lambda: (self.fake_xelatex, self.base_format, "x"))
+        cache = latex_format.FormatCache(self.format_dir)
+        tex = "\\documentclass{article}\n\\begin{document}\nHi\n\\end{document}\n"
+
+        for name in ("a.pdf", "b.pdf"):
+            with tempfile.TemporaryDirectory() as work_dir:
+                cache.compile(tex, work_dir, os.path.join(self.temp_dir, name))
+        assert self._log().count("dump") == 1
+        assert self._log().count("compile") == 2
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            cache.compile(tex.replace("article", "report"), work_dir, os.path.join(self.temp_dir, "c.pdf"))
+        os.utime(self.base_format, ns=(0, os.stat(self.base_format).st_mtime_ns + 1_000_000))
+        with tempfile.TemporaryDirectory() as work_dir:
+            cache.compile(tex, work_dir, os.path.join(self.temp_dir, "d.pdf"))
+        assert self._log().count("dump") == 3
+
+    def test_undumpable_preamble_remembered(self, monkeypatch):
+        """A preamble that cannot be dumped fails fast on later calls"""
+        from mcp_pandoc import latex_format
+
+        monkeypatch.setenv("FAKE_XELATEX_LOG", self.log_path)
+        monkeypatch.setattr(latex_format, "_tex_tools", lambda: (self.fake_xelatex, self.base_format, "x"))
+        cache = latex_format.FormatCache(self.format_dir)
+        preamble = "\\documentclass{article}\n% UNDUMPABLE\n"
+
+        for _ in range(2):
+            with pytest.raises(latex_format.LatexFormatError, match="cannot be dumped|dumping the preamble failed"):
+                cache.format_for(preamble)
+        assert len([name for name in os.listdir(self.format_dir) if name.endswith(".failed")]) == 1
+
+    def test_disabled_without_tex_tools(self, monkeypatch):
+        """A configured directory is ignored when xelatex or mylatexformat is missing"""
+        from mcp_pandoc import latex_format
+
+        monkeypatch.setattr(latex_format, "_tex_tools", lambda: None)
+        latex_format.configure(directory=self.format_dir)
+        assert latex_format.get_format_dir() is None
+
+
+class TestPdfEngines:
+    """Test PDF engine selection and the auto-benchmarked engine choice"""
+
+    def teardown_method(self):
+        """Reset the process-wide selector"""
+        from mcp_pandoc import pdf_engines
+        pdf_engines.configure(default="xelatex")
+
+    def test_document_features_detected(self):
+        """Math, raw LaTeX and non-Latin text are detected in the source"""
+        from mcp_pandoc.pdf_engines import document_features
+
+        assert document_features("# Plain\n\nText.", None, "markdown") == set()
+        assert document_features("Euler: $e^{i\\pi} = -1$", None, "markdown") == {"math"}
+        assert "raw_latex" in document_features("\\newpage\n\nText", None, "markdown")
+        assert "unicode" in document_features("Привет", None, "markdown")
+        assert document_features("<p>no math</p>", None, "html") == set()
+
+    def test_auto_picks_fastest_capable_engine(self):
+        """Auto mode uses the fastest engine that supports the document's features"""
+        from mcp_pandoc.pdf_engines import EngineSelector
+
+        selector = EngineSelector("auto")
+        selector.timings = {"typst": 0.3, "wkhtmltopdf": 0.5, "xelatex": 2.0}
+        assert selector.choose(None, set()) == "typst"
+        assert selector.choose(None, {"math", "unicode"}) == "typst"
+        assert selector.choose("auto", {"raw_latex"}) == "xelatex"
+        assert selector.choose("wkhtmltopdf", {"math"}) == "wkhtmltopdf"
+
+        selector.timings = {}
+        with pytest.raises(ValueError, match="No working PDF engine"):
+            selector.choose(None, set())
+
+    def test_first_auto_job_does_not_wait_for_benchmark(self, monkeypatch):
+        """Until the background benchmark finishes, auto jobs use the installed engines' typical speed order"""
+        from mcp_pandoc import pdf_engines
+
+        release = threading.Event()
+        runs = []
+
+        def slow_benchmark():
+            runs.append(1)
+            release.wait(10)
+            return {"xelatex": 0.5, "typst": 0.9}
+
+        monkeypatch.setattr(pdf_engines, "benchmark", slow_benchmark)
+        monkeypatch.setattr(pdf_engines, "installed_engines", lambda: ["xelatex", "typst"])
+        selector = pdf_engines.EngineSelector("xelatex")
+        assert selector.choose(None, set()) == "xelatex"
+        assert not runs
+
+        started = time.perf_counter()
+        assert selector.choose("auto", set()) == "typst"
+        assert selector.choose("auto", {"raw_latex"}) == "xelatex"
+        assert time.perf_counter() - started < 1 and selector.stats()["timings"] is None
+
+        release.set()
+        selector._benchmark.join(10)
+        assert selector.choose("auto", set()) == "xelatex"
+        assert runs == [1]
+
+    def test_explicit_engine_used_in_pandoc_args(self):
+        """An explicit engine is validated and passed to pandoc"""
+        from mcp_pandoc.server import build_pandoc_args, parse_conversion_arguments
+
+        request = parse_conversion_arguments({
+            "contents": "# Hi", "output_format": "pdf", "output_file": "/tmp/out.pdf", "pdf_engine": "typst",
+        })
+        assert build_pandoc_args(request, [])[2] == ["--pdf-engine=typst"]
+
+        with pytest.raises(ValueError, match="only supported for pdf"):
+            parse_conversion_arguments({"contents": "# Hi", "output_format": "html", "pdf_engine": "typst"})
+        with pytest.raises(ValueError, match="Unsupported PDF engine"):
+            parse_conversion_arguments({
+                "contents": "# Hi", "output_format": "pdf", "output_file": "/tmp/out.pdf", "pdf_engine": "troff",
+            })
+
+    @pytest.mark.asyncio
+    async def test_auto_engine_resolved_before_conversion(self, monkeypatch):
+        """The server default 'auto' is replaced by a concrete engine per request"""
+        from mcp_pandoc import pdf_engines
+        from mcp_pandoc.server import parse_conversion_arguments, resolve_pdf_engine
+
+        selector = pdf_engines.EngineSelector("auto")
+        selector.timings = {"wkhtmltopdf": 0.4, "lualatex": 1.5}
+        monkeypatch.setattr(pdf_engines, "_selector", selector)
+
+        plain = parse_conversion_arguments({"contents": "# Hi", "output_format": "pdf", "output_file": "/tmp/a.pdf"})
+        await resolve_pdf_engine(plain)
+        assert plain.pdf_engine == "wkhtmltopdf"
+
+        maths = parse_conversion_arguments({"contents": "$x^2$", "output_format": "pdf", "output_file": "/tmp/b.pdf"})
+        await resolve_pdf_engine(maths)
+        assert maths.pdf_engine == "lualatex"
+
+
+class TestParallelSections:
+    """Test splitting large markdown/html inputs into sections parsed in parallel"""
+
+    DOCUMENT = (
+        "---\ntitle: Manual\n---\n\n"
+        "# Intro\n\nFirst[^a] with a [link][home].\n\n```\n# not a heading\n```\n\n## Intro\n\nMore.\n\n"
+        "# Intro\n\nSecond[^b], back to [the start](#intro).\n\n## Intro\n\nText.\n\n"
+        "# Usage\n\nThird[^a].\n\n"
+        "[home]: https://example.com\n\n[^a]: Note A.\n\n    Continued.\n\n[^b]: Note B.\n"
+    )
+
+    def test_split_at_top_level_headings(self):
+        """Sections start at level-1 headings and carry the definitions they need"""
+        from mcp_pandoc.sections import split_sections
+
+        sections = split_sections(self.DOCUMENT, "markdown", 3)
+        assert len(sections) == 3
+        assert sections[0].startswith("---\ntitle: Manual")
+        assert "# not a heading" in sections[0]
+        assert sections[1].startswith("# Intro") and sections[2].startswith("# Usage")
+        assert all("[home]: https://example.com" in section for section in sections)
+        assert "[^a]: Note A." in sections[0] and "[^b]:" not in sections[0]
+        assert "[^b]: Note B." in sections[1] and "[^a]:" not in sections[1]
+        assert "    Continued." in sections[2]
+
+        assert split_sections("No headings here.", "markdown", 4) == ["No headings here."]
+        assert len(split_sections("<h2>A</h2><p>x</p><h2>B</h2><p>y</p>", "html", 4)) == 2
+
+    def test_merged_identifiers_match_single_pass(self):
+        """Repeated headings across sections are numbered as in a single pass"""
+        import pypandoc
+
+        from mcp_pandoc.sections import merge_asts, read_section, split_sections
+
+        sections = split_sections(self.DOCUMENT, "markdown", 3)
+        merged = merge_asts([read_section(section, "markdown", [])[0] for section in sections])
+        expected = pypandoc.convert_text(self.DOCUMENT, "html", format="markdown")
+        assert pypandoc.convert_text(merged, "html", format="json") == expected
+
+    @pytest.mark.asyncio
+    async def test_header_references_across_sections(self):
+        """Implicit header references resolve to the first heading with that text, in any section"""
+        from mcp_pandoc.sections import merge_asts
+        from mcp_pandoc.server import convert, parse_conversion_arguments
+
+        document = (
+            "# Intro!\n\nSee [Usage], [the setup][Set Up] and [Intro][], not \\[Usage\\] or [Home].\n\n"
+            "# Intro\n\nBack to [intro], [start](#intro) and [*emphatic* Set   up].\n\n"
+            "# Set Up\n\nText.\n\n# Usage\n\nAgain [Intro] and [Set Up]{.x}.\n\n"
+            "# Home\n\n[Home]: https://example.com\n"
+        )
+        single = await convert(parse_conversion_arguments({"contents": document, "output_format": "html"}))
+        sectioned = await convert(parse_conversion_arguments({
+            "contents": document, "output_format": "html", "parallel_sections": 4,
+        }))
+        assert sectioned.sections["sections"] == 4
+        assert sectioned.output == single.output
+        assert '<a href="#intro-1">Intro</a>' in single.output and "[Usage]" in single.output
+
+        # A placeholder without a matching heading keeps its text
+        placeholder = (
+            '{"pandoc-api-version":[1,23,1,1],"meta":{},"blocks":[{"t":"Para","c":[{"t":"Link","c":'
+            '[["",[],[]],[{"t":"Str","c":"Gone"}],["mcp-pandoc-heading:Gone",""]]}]}]}'
+        )
+        assert '"Link"' not in merge_asts([placeholder]) and '"Gone"' in merge_asts([placeholder])
+
+    @pytest.mark.asyncio
+    async def test_definitions_inside_paragraphs_kept(self):
+        """Definition-like lines that continue a paragraph stay in it, as in a single pass"""
+        from mcp_pandoc.server import convert, parse_conversion_arguments
+
+        document = (
+            "# One\n\nSee [x] here.\n[x]: http://a.com\n\nNext para\n\n"
+            "# Two\n\nA note[^n] and [y].\n[^n]: not a note\n\n"
+            "[y]: http://b.com\n    \"Title\"\n[z]: http://c.com\n\nLast [z].\n"
+        )
+        single = await convert(parse_conversion_arguments({"contents": document, "output_format": "html"}))
+        sectioned = await convert(parse_conversion_arguments({
+            "contents": document, "output_format": "html", "parallel_sections": 2,
+        }))
+        assert sectioned.sections["sections"] == 2
+        assert sectioned.output == single.output
+        assert "[x]: http://a.com</p>" in single.output and 'title="Title"' in single.output
+
+    @pytest.mark.asyncio
+    async def test_sectioned_conversion_reports_speedup(self):
+        """convert-contents with parallel_sections matches the single-pass output and reports timings"""
+        from mcp_pandoc.server import convert, parse_conversion_arguments
+
+        single = await convert(parse_conversion_arguments({"contents": self.DOCUMENT, "output_format": "html"}))
+        request = parse_conversion_arguments({
+            "contents": self.DOCUMENT, "output_format": "html", "parallel_sections": 3,
+        })
+        result = await convert(request)
+        assert result.output == single.output
+        assert result.sections["sections"] == 3
+        assert result.sections["estimated_speedup"] > 0 and result.sections["merge_seconds"] >= 0
+
+        flat = await convert(parse_conversion_arguments({
+            "contents": "Just a paragraph.", "output_format": "html", "parallel_sections": 2,
+        }))
+        assert flat.sections == {"sections": 1}
+        assert "<p>Just a paragraph.</p>" in flat.output
+
+    def test_invalid_parallel_sections_rejected(self):
+        """Only markdown and html inputs can be split, into 2 to 64 sections"""
+        from mcp_pandoc.server import parse_conversion_arguments
+
+        with pytest.raises(ValueError, match="only supported for markdown"):
+            parse_conversion_arguments({"contents": "x", "input_format": "rst", "parallel_sections": 2})
+        with pytest.raises(ValueError, match="only supported for markdown"):
+            parse_conversion_arguments({"input_file": "/tmp/in.docx", "parallel_sections": 2})
+        with pytest.raises(ValueError, match="between 2 and 64"):
+            parse_conversion_arguments({"contents": "x", "parallel_sections": 1})
+
+
+class TestBenchmarkHarness:
+    """Test the benchmark harness's statistics and regression comparison"""
+
+    @staticmethod
+    def _bench():
+        import importlib.util
+        path = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "bench.py")
+        spec = importlib.util.spec_from_file_location("mcp_pandoc_bench", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def test_percentiles(self):
+        """Percentiles interpolate between samples"""
+        bench = self._bench()
+        stats = bench.summarize([0.4, 0.1, 0.2, 0.3])
+        assert stats["min"] == 0.1 and stats["p50"] == 0.25 and stats["runs"] == 4
+        assert bench.percentile([1.0], 0.99) == 1.0
+
+    def test_compare_flags_regressions_beyond_threshold(self):
+        """Slower cases, lower throughput, higher RSS and new failures are reported"""
+        bench = self._bench()
+        baseline = {
+            "cases": {
+                "md->html/x1/plain": {"p50": 0.100},
+                "md->docx/x1/plain": {"p50": 0.100},
+                "md->rst/x1/plain": {"p50": 0.001},
+                "md->odt/x1/plain": {"p50": 0.100},
+                "txt->html/x1/plain": {"error": "unsupported"},
+            },
+            "throughput": {"md->html/x50/c4": {"per_second": 40.0}},
+            "peak_rss_kib": {"server": 50_000, "children": 80_000},
+        }
+        current = {
+            "cases": {
+                "md->html/x1/plain": {"p50": 0.150},
+                "md->docx/x1/plain": {"p50": 0.110},
+                "md->rst/x1/plain": {"p50": 0.003},
+                "md->odt/x1/plain": {"error": "boom"},
+                "txt->html/x1/plain": {"error": "unsupported"},
+            },
+            "throughput": {"md->html/x50/c4": {"per_second": 20.0}},
+            "peak_rss_kib": {"server": 51_000, "children": 120_000},
+        }
+        regressions = bench.compare(baseline, current, threshold=0.2)
+        assert len(regressions) == 4
+        assert any(message.startswith("md->html/x1/plain") for message in regressions)
+        assert any("now fails" in message for message in regressions)
+        assert any("per_second" not in message and "/s ->" in message for message in regressions)
+        assert any("children" in message for message in regressions)
+        assert bench.compare(baseline, baseline) == []
+
+
+class TestMetrics:
+    """Test per-call traces, child process accounting and the server-stats tool"""
+
+    def test_trace_records_stages_and_children(self):
+        """Stages accumulate and reaped children add their CPU time and peak RSS"""
+        from mcp_pandoc import driver, metrics
+
+        registry = metrics.get_registry()
+        before = registry.calls.get("unit-test", {}).get("ok", 0)
+        with metrics.trace("unit-test") as current:
+            with metrics.stage("read"):
+                process = metrics.run_process(
+                    [sys.executable, "-c", "import sys; sys.stdout.write(sys.stdin.read().upper())"], input=b"hi"
+                )
+            with metrics.stage("read"):
+                pass
+        assert process.returncode == 0 and process.stdout == b"HI"
+        assert list(current.stages) == ["read"]
+        assert current.children == 1 and current.child_max_rss_kib > 0
+        assert registry.calls["unit-test"]["ok"] == before + 1
+
+        with pytest.raises(RuntimeError, match='Pandoc died with exitcode .*Unknown input format'):
+            driver.run_pandoc(["--from=nonexistent-format"], input=b"")
+        with pytest.raises(ValueError), metrics.trace("unit-test") as failed:
+            raise ValueError("boom")
+        assert failed.status == "error" and failed.error == "boom"
+
+    def test_histogram(self):
+        """Buckets are cumulative and quantiles report the bucket bound"""
+        from mcp_pandoc.metrics import Histogram
+
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 5.0):
+            histogram.observe(value)
+        stats = histogram.as_dict()
+        assert stats["buckets"] == {"0.1": 1, "1.0": 3, "+Inf": 4}
+        assert stats["p50"] == 1.0 and stats["p99"] == float("inf")
+        assert Histogram().quantile(0.5) is None
+
+    def test_json_log_line(self):
+        """Trace log records serialize as one JSON object with the trace fields"""
+        from mcp_pandoc import metrics
+
+        current = metrics.Trace("convert-contents")
+        current.seconds = 0.25
+        current.add_stage("pandoc", 0.2)
+        record = logging.LogRecord("mcp_pandoc", logging.INFO, __file__, 1, "done", None, None)
+        record.trace = current.as_dict()
+        entry = json.loads(metrics.JsonFormatter().format(record))
+        assert entry["event"] == "trace" and entry["tool"] == "convert-contents"
+        assert entry["stages"] == {"pandoc": 0.2}
+        with pytest.raises(ValueError, match="Unsupported log format"):
+            metrics.configure(log_format="xml")
+
+    @pytest.mark.asyncio
+    async def test_server_stats_tool(self):
+        """server-stats reports the stages and child usage of finished conversions"""
+        from mcp_pandoc import server
+
+        await server.handle_call_tool("convert-contents", {"contents": "# Stats\n\nText", "output_format": "html"})
+        result = await server.handle_call_tool("server-stats", {})
+        stats = json.loads(result[0].text)
+        assert stats["calls"]["convert-contents"]["ok"] >= 1
+        assert {"validate", "pandoc", "format"} <= set(stats["stages"])
+        assert stats["children"] >= 1 and stats["child_max_rss_kib"] > 0
+        assert stats["pool"]["executor"] == "thread" and "pdf_engines" in stats
+
+
+class TestColdStart:
+    """Test the cached pandoc probe, lazy imports and warmup"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """Restore the default probe cache"""
+        import shutil
+
+        from mcp_pandoc import capabilities
+
+        capabilities.configure()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_probe_cached_on_disk_until_binaries_change(self, monkeypatch):
+        """A second start reads the probe file; a changed binary fingerprint probes again"""
+        from mcp_pandoc import capabilities
+
+        probe_file = os.path.join(self.temp_dir, "probe.json")
+        capabilities.configure(probe_file=probe_file)
+        probed = capabilities.get_capabilities()
+        assert probed.version and "markdown" in probed.input_formats and "docx" in probed.output_formats
+        assert os.path.exists(probe_file)
+
+        def fail():
+            raise AssertionError("probed again")
+
+        monkeypatch.setattr(capabilities, "probe", fail)
+        capabilities.configure(probe_file=probe_file)
+        assert capabilities.get_capabilities() == probed
+
+        monkeypatch.setattr(capabilities, "probe_key", lambda: "upgraded")
+        capabilities.configure(probe_file=probe_file)
+        with pytest.raises(AssertionError, match="probed again"):
+            capabilities.get_capabilities()
+
+    def test_probe_cached_on_disk_with_pandoc_on_path(self, monkeypatch):
+        """A pandoc found on the PATH is stored by its full path, so the next start still reads the probe file"""
+        import pypandoc
+
+        from mcp_pandoc import capabilities
+
+        pandoc_dir = os.path.dirname(pypandoc.get_pandoc_path())
+        monkeypatch.delenv("PYPANDOC_PANDOC", raising=False)
+        monkeypatch.setenv("PATH", pandoc_dir + os.pathsep + os.environ.get("PATH", ""))
+        # Make pypandoc search again, which finds the PATH entry first and returns the bare name
+        monkeypatch.setattr(pypandoc, "__pandoc_path", None)
+        assert pypandoc.get_pandoc_path() == "pandoc"
+
+        probe_file = os.path.join(self.temp_dir, "probe.json")
+        capabilities.configure(probe_file=probe_file)
+        probed = capabilities.get_capabilities()
+        assert probed.path == os.path.join(pandoc_dir, "pandoc")
+
+        def fail():
+            raise AssertionError("probed again")
+
+        monkeypatch.setattr(capabilities, "probe", fail)
+        capabilities.configure(probe_file=probe_file)
+        assert capabilities.get_capabilities() == probed
+
+    def test_package_import_defers_heavy_modules(self):
+        """Importing the package (e.g. for --help) loads neither the MCP stack nor the filter libraries"""
+        import subprocess
+
+        code = (
+            "import sys, mcp_pandoc; "
+            "print(sorted(m for m in ('mcp', 'panflute', 'pandocfilters', 'pypandoc', 'yaml') if m in sys.modules))"
+        )
+        process = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+            env={**os.environ, "PYTHONPATH": SRC_PATH},
+        )
+        assert process.stdout.strip() == "[]"
+
+    def test_warmup(self, monkeypatch):
+        """Warmup probes pandoc and runs a conversion"""
+        from mcp_pandoc import capabilities, server
+
+        capabilities.configure(probe_file=os.path.join(self.temp_dir, "probe.json"))
+        calls = []
+        real = server.run_pandoc_text
+        monkeypatch.setattr(server, "run_pandoc_text", lambda *args: calls.append(args) or real(*args))
+        server.warmup()
+        assert calls and os.path.exists(os.path.join(self.temp_dir, "probe.json"))
+
+
+class TestPandocDriver:
+    """Test the blocking, asyncio and pypandoc pandoc drivers"""
+
+    def teardown_method(self):
+        """Restore the default driver"""
+        from mcp_pandoc import driver
+
+        driver.configure(driver="blocking")
+
+    @pytest.mark.asyncio
+    async def test_asyncio_driver_matches_blocking(self):
+        """Every driver produces the same text and binary outputs"""
+        from mcp_pandoc import driver, server
+
+        outputs = {}
+        for name in driver.DRIVERS:
+            driver.configure(driver=name)
+            text = await server.run_conversion("# Title\n\nSome *text*", None, "markdown", "html", None, [])
+            docx = await server.run_conversion("# Title", None, "markdown", "docx", None, [], to_bytes=True)
+            outputs[name] = (text, docx[:2])
+        assert outputs["asyncio"] == outputs["blocking"] == outputs["pypandoc"]
+        assert "<em>text</em>" in outputs["asyncio"][0] and outputs["asyncio"][1] == b"PK"
+        with pytest.raises(ValueError, match="Unsupported driver"):
+            driver.configure(driver="threads")
+
+    @pytest.mark.asyncio
+    async def test_exit_codes_kept_and_categorized(self):
+        """Pandoc's exit code survives pickling and a failing Lua filter is reported as a filter error"""
+        import pickle
+
+        from mcp_pandoc import driver, server
+
+        with pytest.raises(driver.PandocError) as caught:
+            await driver.run_pandoc_async(["--from=nonexistent-format"], input=b"")
+        assert caught.value.returncode == 21 and caught.value.name == "PandocUnknownReaderError"
+        copied = pickle.loads(pickle.dumps(caught.value))
+        assert copied.returncode == 21 and str(copied) == str(caught.value)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            lua_filter = os.path.join(temp_dir, "fail.lua")
+            with open(lua_filter, "w") as f:
+                f.write('function Para(el) error("broken filter") end\n')
+            for name in ("asyncio", "pypandoc"):
+                driver.configure(driver=name)
+                with pytest.raises(ValueError, match="Filter error during conversion contents.*exitcode \"83\""):
+                    await server.handle_call_tool(
+                        "convert-contents", {"contents": "Text", "output_format": "html", "filters": [lua_filter]}
+                    )
+
+    @pytest.mark.asyncio
+    async def test_cancelled_conversion_kills_pandoc(self, monkeypatch):
+        """Cancelling the awaiting task kills the pandoc process and frees its slot"""
+        import types
+
+        from mcp_pandoc import driver, server
+        from mcp_pandoc.pool import get_pool
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # A stand-in pandoc that records its pid and never finishes
+            fake_pandoc = os.path.join(temp_dir, "pandoc")
+            pid_file = os.path.join(temp_dir, "pid")
+            with open(fake_pandoc, "w") as f:
+                f.write(f"#!/bin/sh\necho $$ > {pid_file}\nexec sleep 60\n")
+            os.chmod(fake_pandoc, 0o755)
+            monkeypatch.setattr(driver, "get_capabilities", lambda: types.SimpleNamespace(path=fake_pandoc))
+            driver.configure(driver="asyncio")
+
+            task = asyncio.create_task(server.run_conversion("Text", None, "markdown", "html", None, []))
+            while not os.path.exists(pid_file) or not open(pid_file).read().strip():
+                await asyncio.sleep(0.01)
+            assert get_pool().stats()["active"] == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            with pytest.raises(ProcessLookupError):
+                os.kill(int(open(pid_file).read()), 0)
+            assert get_pool().stats()["active"] == 0
+
+
+class TestConversionJobs:
+    """Test submit-conversion, conversion-status and fetch-conversion"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """Restore an in-memory job store"""
+        import shutil
+
+        from mcp_pandoc import jobs
+
+        jobs.configure(database="", ttl_seconds=jobs.DEFAULT_TTL_SECONDS)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    @pytest.mark.asyncio
+    async def test_submitted_job_returns_convert_contents_result(self):
+        """A job reports its stages and its result matches a direct convert-contents call"""
+        from mcp_pandoc import jobs, server
+
+        store = jobs.configure(database="")
+        arguments = {"contents": "# Job\n\nBackground *text*", "output_format": "html"}
+        submitted = await server.handle_call_tool("submit-conversion", arguments)
+        job_id = json.loads(submitted[0].text.split("\n\n", 1)[1])["job_id"]
+        stages = []
+        store.subscribe(job_id, lambda job: stages.append(job.stage))
+
+        status = await server.handle_call_tool("conversion-status", {"job_id": job_id, "wait_seconds": 30})
+        summary = json.loads(status[0].text)
+        assert summary["status"] == "succeeded" and summary["expires_in_seconds"] > 0
+        assert "pandoc" in stages
+
+        fetched = await server.handle_call_tool("fetch-conversion", {"job_id": job_id})
+        direct = await server.handle_call_tool("convert-contents", arguments)
+        assert fetched[0].text == direct[0].text and "<em>text</em>" in fetched[0].text
+        listed = json.loads((await server.handle_call_tool("conversion-status", {}))[0].text)
+        assert [job["job_id"] for job in listed] == [job_id]
+        assert server.server_stats()["jobs"]["succeeded"] == 1
+
+    @pytest.mark.asyncio
+    async def test_invalid_failed_and_unknown_jobs(self):
+        """Bad arguments fail at submit time; conversion errors surface from fetch-conversion"""
+        from mcp_pandoc import jobs, server
+
+        jobs.configure(database="")
+        with pytest.raises(ValueError, match="Unsupported output format"):
+            await server.handle_call_tool("submit-conversion", {"contents": "x", "output_format": "nope"})
+        failing_filter = os.path.join(self.temp_dir, "failing_filter.sh")
+        with open(failing_filter, "w") as f:
+            f.write("#!/bin/sh\necho 'filter broke' >&2\nexit 3\n")
+        os.chmod(failing_filter, 0o755)
+        submitted = await server.handle_call_tool(
+            "submit-conversion", {"contents": "x", "output_format": "html", "filters": [failing_filter]}
+        )
+        job_id = json.loads(submitted[0].text.split("\n\n", 1)[1])["job_id"]
+        with pytest.raises(ValueError, match=f"Conversion job {job_id} failed: .*filter broke"):
+            await server.handle_call_tool("fetch-conversion", {"job_id": job_id, "wait_seconds": 30})
+        with pytest.raises(ValueError, match="Unknown or expired job_id"):
+            await server.handle_call_tool("fetch-conversion", {"job_id": "missing"})
+        with pytest.raises(ValueError, match="wait_seconds must be between"):
+            await server.handle_call_tool("conversion-status", {"job_id": job_id, "wait_seconds": 3600})
+
+    @pytest.mark.asyncio
+    async def test_jobs_persist_in_sqlite_and_expire(self):
+        """Finished jobs survive a restart, unfinished ones are failed, and expired ones are dropped"""
+        from mcp_pandoc import jobs, server
+
+        database = os.path.join(self.temp_dir, "jobs.db")
+        store = jobs.configure(database=database)
+        submitted = await server.handle_call_tool("submit-conversion", {"contents": "# Kept", "output_format": "markdown"})
+        job_id = json.loads(submitted[0].text.split("\n\n", 1)[1])["job_id"]
+        await store.wait(job_id, 30)
+        interrupted = jobs.Job(job_id="interrupted", tool="convert-contents", arguments={}, status="running")
+        store._save(interrupted)
+
+        restarted = jobs.configure(database=database)
+        fetched = await server.handle_call_tool("fetch-conversion", {"job_id": job_id})
+        assert "Kept" in fetched[0].text
+        assert restarted.get("interrupted").status == "failed"
+
+        expiring = jobs.configure(database=database, ttl_seconds=0)
+        time.sleep(0.01)
+        with pytest.raises(ValueError, match="Unknown or expired job_id"):
+            expiring.get(job_id)
+
+    @pytest.mark.asyncio
+    async def test_paged_job_results_live_as_long_as_the_job(self):
+        """A job's result_id stays readable after more paged results than the result store keeps"""
+        from mcp_pandoc import jobs, results, server
+
+        store = jobs.configure(database="")
+        result_store = results.configure(page_chars=1000)
+        try:
+            job_ids = []
+            for i in range(results.DEFAULT_MAX_RESULTS + 8):
+                submitted = await server.handle_call_tool(
+                    "submit-conversion", {"contents": f"Job {i} " + "word " * 2000, "output_format": "markdown"}
+                )
+                job_ids.append(json.loads(submitted[0].text.split("\n\n", 1)[1])["job_id"])
+            for job_id in job_ids:
+                await store.wait(job_id, 60)
+            # Unowned results are still evicted past the limit
+            for _ in range(results.DEFAULT_MAX_RESULTS):
+                result_store.put("x" * 2000)
+            assert result_store.stats()["pinned"] == len(job_ids)
+
+            fetched = await server.handle_call_tool("fetch-conversion", {"job_id": job_ids[0]})
+            result_id = re.search(r'result_id "([0-9a-f]+)"', fetched[0].text).group(1)
+            page = await server.handle_call_tool("read-conversion-result", {"result_id": result_id, "offset": 1000})
+            assert "word" in page[0].text
+
+            store.ttl_seconds = 0
+            time.sleep(0.01)
+            with pytest.raises(ValueError, match="Unknown or expired job_id"):
+                store.get(job_ids[0])
+            assert result_store.stats()["pinned"] == 0
+            with pytest.raises(ValueError, match="Unknown or expired result_id"):
+                result_store.read(result_id)
+        finally:
+            results.configure(page_chars=results.DEFAULT_PAGE_CHARS)
+
+    @pytest.mark.asyncio
+    async def test_notifications_over_mcp_session(self):
+        """The submitting session gets log notifications and a waiting status call gets progress"""
+        from mcp.shared.memory import create_connected_server_and_client_session
+
+        from mcp_pandoc import jobs, server
+
+        jobs.configure(database="")
+        slow_filter = os.path.join(self.temp_dir, "slow_filter.sh")
+        with open(slow_filter, "w") as f:
+            f.write("#!/bin/sh\nsleep 0.5\ncat\n")
+        os.chmod(slow_filter, 0o755)
+        logged, progress = [], []
+
+        async def on_log(params):
+            logged.append(params.data)
+
+        async def on_progress(value, total, message):
+            progress.append(message)
+
+        async with create_connected_server_and_client_session(server.server, logging_callback=on_log) as client:
+            submitted = await client.call_tool(
+                "submit-conversion", {"contents": "# Slow", "output_format": "html", "filters": [slow_filter]}
+            )
+            job_id = json.loads(submitted.content[0].text.split("\n\n", 1)[1])["job_id"]
+            status = await client.call_tool(
+                "conversion-status", {"job_id": job_id, "wait_seconds": 30}, progress_callback=on_progress
+            )
+            assert json.loads(status.content[0].text)["status"] == "succeeded"
+            await asyncio.sleep(0.1)
+        assert "succeeded" in progress
+        assert [entry["status"] for entry in logged][-1] == "succeeded"
+        assert any(entry["stage"] == "pandoc" for entry in logged)
+
+
+def process_gone(pid: int) -> bool:
+    """True once ``pid`` has exited (a zombie waiting for init to reap it counts as gone)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Uses process groups, rlimits and /proc")
+class TestProcessLimits:
+    """Test timeouts, cancellation and resource limits of conversion processes"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+        # A filter that starts a grandchild and waits for it, recording both pids
+        self.pid_file = os.path.join(self.temp_dir, "pids")
+        self.slow_filter = os.path.join(self.temp_dir, "slow_filter.sh")
+        with open(self.slow_filter, "w") as f:
+            f.write(f"#!/bin/sh\necho $$ >> {self.pid_file}\nsleep 60 &\necho $! >> {self.pid_file}\nwait\n")
+        os.chmod(self.slow_filter, 0o755)
+
+    def teardown_method(self):
+        """Restore the default limits"""
+        import shutil
+
+        from mcp_pandoc import limits
+
+        limits.configure(timeout=limits.DEFAULT_TIMEOUT, max_cpu_seconds="", max_memory_mib="")
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    async def wait_for_pids(self) -> list[int]:
+        """Wait until the slow filter has recorded itself and its grandchild"""
+        while not os.path.exists(self.pid_file) or len(open(self.pid_file).read().split()) < 2:
+            await asyncio.sleep(0.01)
+        return [int(pid) for pid in open(self.pid_file).read().split()]
+
+    def test_limit_specs(self):
+        """Per-format entries override the default and the most generous limit of a multi-output call wins"""
+        from mcp_pandoc import limits
+
+        table = limits.LimitTable(timeout="300,pdf=900,html=0", max_cpu_seconds="60", max_memory_mib="")
+        assert table.for_formats(["docx"]) == limits.Limits(timeout_seconds=300, cpu_seconds=60)
+        assert table.for_formats(["docx", "pdf"]).timeout_seconds == 900
+        assert table.for_formats(["pdf", "html"]).timeout_seconds is None
+        assert table.stats()["timeout_seconds"] == {"*": 300, "pdf": 900, "html": None}
+        with pytest.raises(ValueError, match="timeout must look like"):
+            limits.parse_spec("pdf=slow", "timeout")
+        assert str(limits.ProcessKilledError("memory_limit", 512)) == "exceeded the memory limit of 512 MiB"
+
+    @pytest.mark.asyncio
+    async def test_timeout_kills_filter_process_group(self):
+        """A timed-out conversion kills the filter and its grandchild and is reported as a timeout"""
+        from mcp_pandoc import limits, metrics, server
+
+        limits.configure(timeout="1")
+        before = metrics.get_registry().calls.get("convert-contents", {}).get("timeout", 0)
+        started = time.monotonic()
+        with pytest.raises(ValueError, match="Killed while converting contents from markdown to html: timed out"):
+            await server.handle_call_tool(
+                "convert-contents", {"contents": "Text", "output_format": "html", "filters": [self.slow_filter]}
+            )
+        assert time.monotonic() - started < 10
+        pids = [int(pid) for pid in open(self.pid_file).read().split()]
+        for _ in range(100):
+            if all(process_gone(pid) for pid in pids):
+                break
+            await asyncio.sleep(0.05)
+        assert all(process_gone(pid) for pid in pids)
+        assert metrics.get_registry().calls["convert-contents"]["timeout"] == before + 1
+        assert server.server_stats()["killed"]["timeout"] >= 1
+
+    @pytest.mark.asyncio
+    async def test_cancellation_kills_processes(self):
+        """Cancelling the tool call (as an MCP cancellation does) kills its process groups"""
+        from mcp_pandoc import metrics, server
+
+        before = metrics.get_registry().calls.get("convert-contents", {}).get("cancelled", 0)
+        task = asyncio.create_task(server.handle_call_tool(
+            "convert-contents", {"contents": "Text", "output_format": "html", "filters": [self.slow_filter]}
+        ))
+        pids = await self.wait_for_pids()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        for _ in range(100):
+            if all(process_gone(pid) for pid in pids):
+                break
+            await asyncio.sleep(0.05)
+        assert all(process_gone(pid) for pid in pids)
+        assert metrics.get_registry().calls["convert-contents"]["cancelled"] == before + 1
+
+    @pytest.mark.asyncio
+    async def test_cpu_and_memory_limits(self):
+        """Children over their CPU time or address space cap are reported as killed by that limit"""
+        from mcp_pandoc import driver, limits, metrics
+
+        async with limits.supervise(limits.Limits(cpu_seconds=1)):
+            with pytest.raises(limits.ProcessKilledError, match="CPU time limit of 1s"):
+                await asyncio.to_thread(metrics.run_process, [sys.executable, "-c", "while True: pass"])
+
+        async with limits.supervise(limits.Limits(memory_mib=200)):
+            with pytest.raises(limits.ProcessKilledError) as caught:
+                await asyncio.to_thread(driver.run_pandoc, ["--from=markdown", "--to=html"], input=b"Text")
+        assert caught.value.reason == "memory_limit"
+
+        # The caps are set before exec, so pandoc sizes its heap reservation to fit a generous cap
+        async with limits.supervise(limits.Limits(cpu_seconds=60, memory_mib=2048)):
+            assert b"<p>Text</p>" in await asyncio.to_thread(
+                driver.run_pandoc, ["--from=markdown", "--to=html"], input=b"Text"
+            )
+            assert b"<p>Text</p>" in await driver.run_pandoc_async(["--from=markdown", "--to=html"], input=b"Text")
+        assert "preexec_fn" not in limits.spawn_options()
+
+    @pytest.mark.asyncio
+    async def test_limits_reach_process_pool_workers(self):
+        """Conversions shipped to a worker process run under the caller's CPU and memory caps"""
+        from mcp_pandoc import limits, metrics, pool
+
+        process_pool = pool.ConversionPool(max_workers=1, executor="process")
+        try:
+            async with limits.supervise(limits.Limits(cpu_seconds=1)):
+                with pytest.raises(limits.ProcessKilledError, match="CPU time limit of 1s"):
+                    await process_pool.run(metrics.run_process, [sys.executable, "-c", "while True: pass"])
+            finished = await process_pool.run(metrics.run_process, [sys.executable, "-c", "print('done')"])
+            assert finished.stdout.strip() == b"done"
+        finally:
+            process_pool.shutdown()
+
+
+class TestAssetCache:
+    """Test the rendered-asset cache used by diagram filters"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """Restore the default (disabled) asset cache"""
+        import shutil
+
+        from mcp_pandoc import assets, filters
+
+        assets.configure(directory=None)
+        filters.configure(mode="subprocess")
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_renders_once_and_evicts_least_recently_used(self, monkeypatch):
+        """Identical requests share one render, even concurrently; old assets are evicted past the size bound"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        import mcp_pandoc_assets
+        from mcp_pandoc import assets, driver
+
+        monkeypatch.delenv(assets.ASSET_DIR_ENV, raising=False)
+        assert assets.configure() is None and driver.child_env() is None
+        cache = assets.configure(directory=os.path.join(self.temp_dir, "assets"), max_bytes=2500)
+        assert assets.ASSET_DIR_ENV not in os.environ
+        assert driver.child_env()[assets.ASSET_DIR_ENV] == cache.directory
+        output_dir = os.path.join(self.temp_dir, "out")
+        renders = []
+
+        def render(path):
+            renders.append(path)
+            time.sleep(0.2)
+            with open(path, "wb") as f:
+                f.write(b"x" * 1000)
+
+        def get(source, **options):
+            return cache.get_or_render(source, "mmdc", render, output_dir=output_dir, **options)
+
+        with ThreadPoolExecutor(4) as executor:
+            paths = set(executor.map(lambda _: get("graph TD; A-->B"), range(4)))
+        assert len(renders) == 1 and len(paths) == 1
+        image = paths.pop()
+        assert os.path.dirname(image) == output_dir and image.endswith(".png") and renders[0].endswith(".png")
+        themed = get("graph TD; A-->B", options={"theme": "dark"})
+        assert len(renders) == 2 and themed != image
+
+        with pytest.raises(ValueError, match="Renderer produced no output"):
+            cache.get_or_render("empty", "mmdc", lambda path: None, output_dir=output_dir)
+        monkeypatch.setattr(mcp_pandoc_assets, "EVICTION_GRACE_SECONDS", 0)
+        cached = cache.path_for(cache.make_key("graph TD; A-->B", "mmdc", {"theme": "dark"}), ".png")
+        # Using the older, unthemed asset again leaves the themed one least recently used
+        time.sleep(0.05)
+        assert get("graph TD; A-->B") == image and len(renders) == 2
+        time.sleep(0.05)
+        get("graph TD; C-->D")
+        assert not os.path.exists(cached) and os.path.exists(cache.path_for(cache.make_key("graph TD; A-->B", "mmdc"), ".png"))
+        # The document's copy outlives the cache entry
+        assert open(themed, "rb").read() == b"x" * 1000
+        stats = cache.stats()
+        assert stats["assets"] == 2 and stats["renders"] == 3 and stats["evictions"] == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mode", ["subprocess", "inprocess"])
+    async def test_filter_renders_each_diagram_once(self, mode):
+        """A filter finds the cache without loading the server package; re-runs reuse its renders"""
+        from mcp_pandoc import assets, filters, server
+
+        filters.configure(mode=mode)
+        cache = assets.configure(directory=os.path.join(self.temp_dir, "assets"))
+        log = os.path.join(self.temp_dir, "renders.log")
+        diagram_filter = os.path.join(self.temp_dir, "diagram_filter.py")
+        with open(diagram_filter, "w") as f:
+            f.write(f"""#!{sys.executable}
+import sys
+sys.path.insert(0, {os.path.abspath(SRC_PATH)!r})
+from pandocfilters import Image, Para, toJSONFilter
+from mcp_pandoc_assets import get_assets
+
+def render(source):
+    def write(path):
+        with open({log!r}, "a") as log:
+            log.write(source + "\\n")
+        with open(path, "w") as image:
+            image.write("<svg>" + source + "</svg>")
+    return write
+
+def diagrams(key, value, format, meta):
+    if key == "CodeBlock" and "diagram" in value[0][1]:
+        path = get_assets().get_or_render(value[1], "fake-renderer", render(value[1]), suffix=".svg")
+        return Para([Image(["", [], []], [], [path, ""])])
+
+def main():
+    toJSONFilter(diagrams)
+
+if __name__ == "__main__":
+    assert "mcp_pandoc" not in sys.modules
+    main()
+""")
+        os.chmod(diagram_filter, 0o755)
+        output_file = os.path.join(self.temp_dir, "site", "page.html")
+        os.makedirs(os.path.dirname(output_file))
+        contents = "```diagram\nA --> B\n```\n\n```diagram\nB --> C\n```\n\n```diagram\nA --> B\n```\n"
+        arguments = {"contents": contents, "output_format": "html", "filters": [diagram_filter],
+                     "output_file": output_file}
+        await server.handle_call_tool("convert-contents", arguments)
+        first = open(output_file).read()
+        await server.handle_call_tool("convert-contents", {**arguments, "contents": contents + "More"})
+        second = open(output_file).read()
+        assert open(log).read().splitlines() == ["A --> B", "B --> C"]
+        assert cache.directory not in first and cache.directory not in second
+        # The images are linked into the output's directory, so the page outlives the cache entries
+        site = os.path.dirname(output_file)
+        images = sorted(os.path.join(site, name) for name in os.listdir(site) if name.endswith(".svg"))
+        assert len(images) == 2 and all(image in first and image in second for image in images)
+        assert server.server_stats()["assets"]["assets"] == 2
+        assert assets.ASSET_DIR_ENV not in os.environ and "PANDOC_OUTPUT_DIR" not in os.environ
+
+
+class TestConvertDirectory:
+    """Test incremental directory conversion with convert-directory"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.temp_dir, "docs")
+        self.output_dir = os.path.join(self.temp_dir, "site")
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        import shutil
+
+        from mcp_pandoc import cache
+
+        cache.configure(directory="")
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def write(self, relative, text):
+        """Write an input file"""
+        path = os.path.join(self.input_dir, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    async def build(self, **arguments):
+        """Run convert-directory and return its summary"""
+        from mcp_pandoc import server
+
+        result = await server.handle_call_tool(
+            "convert-directory",
+            {"input_dir": self.input_dir, "output_dir": self.output_dir, "output_format": "html", **arguments},
+        )
+        return json.loads(result[0].text)
+
+    @pytest.mark.asyncio
+    async def test_rebuild_converts_only_changes(self):
+        """New and changed files are converted, touched ones skipped and removed ones' outputs deleted"""
+        intro = self.write("intro.md", "# Intro")
+        self.write("guide/setup.md", "# Setup")
+        self.write("drafts/wip.md", "# WIP")
+        self.write("logo.png", "not markdown")
+
+        summary = await self.build(exclude=["drafts/*"])
+        assert (summary["total"], summary["converted"], summary["skipped"]) == (2, 2, 0)
+        assert "<h1 id=\"setup\">Setup</h1>" in open(os.path.join(self.output_dir, "guide", "setup.html")).read()
+        assert not os.path.exists(os.path.join(self.output_dir, "drafts"))
+
+        os.utime(intro, (time.time() + 5, time.time() + 5))
+        self.write("guide/setup.md", "# Setup v2")
+        self.write("guide/usage.md", "# Usage")
+        summary = await self.build(exclude=["drafts/*"])
+        assert (summary["converted"], summary["skipped"], summary["failed"]) == (2, 1, 0)
+        assert "Setup v2" in open(os.path.join(self.output_dir, "guide", "setup.html")).read()
+
+        os.remove(intro)
+        summary = await self.build(exclude=["drafts/*"])
+        assert (summary["converted"], summary["skipped"], summary["deleted"]) == (0, 2, 1)
+        assert not os.path.exists(os.path.join(self.output_dir, "intro.html"))
+
+        summary = await self.build(exclude=["drafts/*"], output_format="markdown")
+        assert summary["converted"] == 2
+        assert sorted(os.listdir(os.path.join(self.output_dir, "guide"))) == ["setup.md", "usage.md"]
+
+    @pytest.mark.asyncio
+    async def test_failed_files_are_retried(self):
+        """A failing file is reported without stopping the others and is converted again on the next build"""
+        failing_filter = os.path.join(self.temp_dir, "failing_filter.sh")
+        with open(failing_filter, "w") as f:
+            f.write("#!/bin/sh\nast=$(cat)\ncase \"$ast\" in *BROKEN*) echo broken >&2; exit 3;; esac\necho \"$ast\"\n")
+        os.chmod(failing_filter, 0o755)
+        self.write("ok.md", "Fine")
+        broken = self.write("bad.md", "BROKEN")
+
+        summary = await self.build(filters=[failing_filter])
+        assert (summary["converted"], summary["failed"]) == (1, 1)
+        assert summary["failures"][0]["input"] == "bad.md" and "broken" in summary["failures"][0]["error"]
+
+        with open(broken, "w") as f:
+            f.write("Fixed")
+        summary = await self.build(filters=[failing_filter])
+        assert (summary["converted"], summary["skipped"], summary["failed"]) == (1, 1, 0)
+        with pytest.raises(ValueError, match="Input directory not found"):
+            await self.build(input_dir=os.path.join(self.temp_dir, "missing"))
+
+    @pytest.mark.asyncio
+    async def test_noop_rebuild_of_a_thousand_files(self):
+        """Rebuilding an unchanged tree of 1,000 files takes well under a second"""
+        from mcp_pandoc import cache
+
+        # Identical inputs: the result cache serves all but the first conversions, keeping the first build short
+        cache.configure(directory=os.path.join(self.temp_dir, "cache"))
+        for index in range(1000):
+            self.write(f"section{index % 10}/page{index}.md", "# Page\n\nText")
+        summary = await self.build()
+        assert (summary["converted"], summary["failed"]) == (1000, 0)
+
+        started = time.perf_counter()
+        summary = await self.build()
+        assert time.perf_counter() - started < 1.0
+        assert (summary["total"], summary["skipped"], summary["converted"]) == (1000, 1000, 0)
+
+
+class TestBookBuilds:
+    """Test input_files book builds and the chapter AST cache"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        """Restore the default chapter cache"""
+        import shutil
+
+        from mcp_pandoc import chapters
+
+        chapters.configure(max_bytes=chapters.DEFAULT_MAX_BYTES)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def write(self, name, text):
+        """Write a chapter file"""
+        path = os.path.join(self.temp_dir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    @pytest.mark.asyncio
+    async def test_edit_reparses_only_the_changed_chapter(self):
+        """Chapters are merged in order with unique header ids and only edited chapters are parsed again"""
+        from mcp_pandoc import chapters, server
+
+        cache = chapters.configure()
+        paths = [
+            self.write("01.md", "---\ntitle: The Book\n---\n\n# Intro\n\nFirst[^1].\n\n[^1]: A note."),
+            self.write("02.md", "# Intro\n\nSecond chapter."),
+            self.write("03.md", "# Outro\n\nThe end."),
+        ]
+        arguments = {"input_files": paths, "output_format": "html"}
+        result = await server.handle_call_tool("convert-contents", arguments)
+        html = result[0].text
+        assert "built from 3 chapters: 3 parsed, 0 reused" in html
+        assert html.index('id="intro"') < html.index('id="intro-1"') < html.index('id="outro"')
+        assert "A note." in html
+
+        self.write("02.md", "# Intro\n\nSecond chapter, revised.")
+        result = await server.handle_call_tool("convert-contents", arguments)
+        assert "built from 3 chapters: 1 parsed, 2 reused" in result[0].text
+        assert "Second chapter, revised." in result[0].text
+        assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 4
+
+        output_file = os.path.join(self.temp_dir, "book.docx")
+        result = await server.handle_call_tool(
+            "convert-contents", {"input_files": paths, "outputs": [
+                {"output_format": "docx", "output_file": output_file}, {"output_format": "markdown"},
+            ]},
+        )
+        assert os.path.getsize(output_file) > 0 and "revised" in result[0].text
+        assert "0 parsed, 3 reused" in result[0].text
+
+    @pytest.mark.asyncio
+    async def test_filters_run_once_on_the_whole_book(self):
+        """Filters see the merged book, so a Lua filter counting headers counts every chapter's"""
+        from mcp_pandoc import server
+
+        lua_filter = self.write("count.lua", (
+            "function Pandoc(doc)\n"
+            "  local count = 0\n"
+            "  for _, block in ipairs(doc.blocks) do if block.t == 'Header' then count = count + 1 end end\n"
+            "  doc.blocks:insert(pandoc.Para({pandoc.Str('headers=' .. count)}))\n"
+            "  return doc\n"
+            "end\n"
+        ))
+        paths = [self.write("a.md", "# A"), self.write("b.md", "# B\n\n## B2")]
+        result = await server.handle_call_tool(
+            "convert-contents", {"input_files": paths, "output_format": "markdown", "filters": [lua_filter]}
+        )
+        assert result[0].text.count("headers=") == 1 and "headers=3" in result[0].text
+
+    @pytest.mark.asyncio
+    async def test_invalid_book_arguments(self):
+        """input_files excludes contents, input_file and parallel_sections, and every chapter must exist"""
+        from mcp_pandoc import server
+
+        chapter = self.write("a.md", "# A")
+        with pytest.raises(ValueError, match="Use only one of"):
+            await server.handle_call_tool("convert-contents", {"input_files": [chapter], "contents": "x"})
+        with pytest.raises(ValueError, match="parallel_sections cannot be combined with input_files"):
+            await server.handle_call_tool("convert-contents", {"input_files": [chapter], "parallel_sections": 2})
+        with pytest.raises(ValueError, match="non-empty array of file paths"):
+            await server.handle_call_tool("convert-contents", {"input_files": []})
+        missing = os.path.join(self.temp_dir, "missing.md")
+        with pytest.raises(ValueError, match=f"2 chapter files from markdown to html: Input file not found: {missing}"):
+            await server.handle_call_tool(
+                "convert-contents", {"input_files": [chapter, missing], "output_format": "html"}
+            )
+
+
+class TestCoalescing:
+    """Test that identical conversions running at the same time share one pandoc run"""
+
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.temp_dir = tempfile.mkdtemp()
+        # A pass-through JSON filter that records each run and takes long enough for calls to overlap
+        self.runs_file = os.path.join(self.temp_dir, "runs")
+        self.slow_filter = os.path.join(self.temp_dir, "slow_filter.sh")
+        with open(self.slow_filter, "w") as f:
+            f.write(f"#!/bin/sh\necho $$ >> {self.runs_file}\nsleep 1\ncat\n")
+        os.chmod(self.slow_filter, 0o755)
+
+    def teardown_method(self):
+        """Restore coalescing"""
+        import shutil
+
+        from mcp_pandoc import flights
+
+        flights.configure(enabled=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def runs(self) -> list[int]:
+        """The pids of the filter runs so far"""
+        if not os.path.exists(self.runs_file):
+            return []
+        return [int(pid) for pid in open(self.runs_file).read().split()]
+
+    def arguments(self, output_file=None, **extra):
+        """convert-contents arguments running the slow filter"""
+        arguments = {"contents": "# Report\n\nQuarterly numbers.", "output_format": "docx",
+                     "filters": [self.slow_filter], **extra}
+        if output_file:
+            arguments["output_file"] = os.path.join(self.temp_dir, output_file)
+        return arguments
+
+    @pytest.mark.asyncio
+    async def test_identical_calls_share_one_run(self):
+        """Parallel identical calls run pandoc once and each gets its own output file or embedded copy"""
+        from mcp_pandoc import flights, server
+
+        table = flights.configure()
+        results = await asyncio.gather(
+            server.handle_call_tool("convert-contents", self.arguments("a.docx")),
+            server.handle_call_tool("convert-contents", self.arguments("b.docx")),
+            server.handle_call_tool("convert-contents", self.arguments(embed_output=True)),
+        )
+        assert len(self.runs()) == 1
+        assert table.stats() == {"in_flight": 0, "waiters": 0, "started": 1, "coalesced": 2}
+        with open(os.path.join(self.temp_dir, "a.docx"), "rb") as f:
+            first = f.read()
+        with open(os.path.join(self.temp_dir, "b.docx"), "rb") as f:
+            assert f.read() == first
+        assert results[2][1].resource.blob
+        messages = [result[0].text for result in results]
+        assert sum("shared with an identical conversion" in message for message in messages) == 2
+
+        # Different content is a different conversion
+        await asyncio.gather(
+            server.handle_call_tool("convert-contents", self.arguments("c.docx")),
+            server.handle_call_tool("convert-contents", self.arguments("d.docx", contents="Other")),
+        )
+        assert len(self.runs()) == 3
+
+        flights.configure(enabled=False)
+        await asyncio.gather(
+            server.handle_call_tool("convert-contents", self.arguments("e.docx")),
+            server.handle_call_tool("convert-contents", self.arguments("f.docx")),
+        )
+        assert len(self.runs()) == 5
+
+    @pytest.mark.asyncio
+    async def test_cancelling_the_leader_keeps_the_run_for_other_callers(self):
+        """A cancelled caller only stops waiting; the run is killed once no caller is left"""
+        from mcp_pandoc import flights, server
+
+        flights.configure()
+        leader = asyncio.create_task(server.handle_call_tool("convert-contents", self.arguments("a.docx")))
+        while not self.runs():
+            await asyncio.sleep(0.01)
+        follower = asyncio.create_task(server.handle_call_tool("convert-contents", self.arguments("b.docx")))
+        await asyncio.sleep(0.1)
+        leader.cancel()
+        result = await follower
+        assert "shared with an identical conversion" in result[0].text
+        assert os.path.getsize(os.path.join(self.temp_dir, "b.docx")) > 0
+        assert len(self.runs()) == 1
+
+        # Now a run that only ends when it is killed
+        os.unlink(self.runs_file)
+        with open(self.slow_filter, "w") as f:
+            f.write(f"#!/bin/sh\necho $$ >> {self.runs_file}\nsleep 60\ncat\n")
+        tasks = [
+            asyncio.create_task(server.handle_call_tool("convert-contents", self.arguments(name)))
+            for name in ("c.docx", "d.docx")
+        ]
+        while not self.runs():
+            await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for _ in range(100):
+            if process_gone(self.runs()[0]):
+                break
+            await asyncio.sleep(0.05)
+        assert process_gone(self.runs()[0])
+        assert not os.path.exists(os.path.join(self.temp_dir, "c.docx"))
+
+
+class TestHttpService:
+    """Test the standalone FastAPI service in server.py"""
+
+    def setup_method(self):
+        """Load a fresh copy of the service, with its own limiter, flights and metrics"""
+        import importlib.util
+
+        pytest.importorskip("fastapi")
+        pytest.importorskip("python_multipart")
+        spec = importlib.util.spec_from_file_location(
+            "http_service", os.path.join(os.path.dirname(__file__), "..", "server.py")
+        )
+        self.service = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.service)
+        self.temp_dir = tempfile.mkdtemp()
+        self.runs_file = os.path.join(self.temp_dir, "runs")
+
+    def teardown_method(self):
+        """Cleanup test fixtures"""
+        import shutil
+
+        # Every copy of the service adds its own log handler
+        logging.getLogger("pandoc-api").handlers.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def use_pandoc(self, monkeypatch, script: str | None = None) -> None:
+        """Put the bundled pandoc on the PATH, or a stand-in running ``script`` that records its pid in runs_file"""
+        import pypandoc
+
+        pandoc_dir = os.path.dirname(pypandoc.get_pandoc_path())
+        if script is not None:
+            pandoc_dir = os.path.join(self.temp_dir, "bin")
+            os.makedirs(pandoc_dir)
+            with open(os.path.join(pandoc_dir, "pandoc"), "w") as f:
+                f.write(f"#!/bin/sh\necho $$ >> {self.runs_file}\n{script}\n")
+            os.chmod(os.path.join(pandoc_dir, "pandoc"), 0o755)
+        monkeypatch.setenv("PATH", pandoc_dir + os.pathsep + os.environ.get("PATH", ""))
+
+    def runs(self) -> list[int]:
+        """The pids of the pandoc runs so far"""
+        if not os.path.exists(self.runs_file):
+            return []
+        return [int(pid) for pid in open(self.runs_file).read().split()]
+
+    def client(self):
+        """An ASGI client for requests that run concurrently on the test's event loop"""
+        import httpx
+
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=self.service.app), base_url="http://service")
+
+    @pytest.mark.asyncio
+    async def test_identical_jobs_share_one_run(self, monkeypatch):
+        """Identical /convert jobs arriving while one runs get its output without starting pandoc again"""
+        self.use_pandoc(monkeypatch, "cat > /dev/null\nsleep 0.5\nhead -c 300000 /dev/zero")
+        job = {"content": "# Report", "output_format": "docx"}
+        async with self.client() as client:
+            responses = await asyncio.gather(*(client.post("/convert", json=job) for _ in range(3)))
+            assert [response.status_code for response in responses] == [200, 200, 200]
+            assert all(response.content == bytes(300000) for response in responses)
+            assert len(self.runs()) == 1 and not self.service.flights
+
+            # Different content is a different job
+            other = await client.post("/convert", json={**job, "content": "# Other"})
+            assert other.status_code == 200 and len(self.runs()) == 2
+
+    @pytest.mark.asyncio
+    async def test_flight_keeps_a_bounded_window_of_output(self):
+        """A docx run is only joinable before its first byte is sent, and pandoc waits while the window is full"""
+        service = self.service
+
+        async def produce(flight):
+            for index in range(4 * service.MAX_AHEAD):
+                await flight.append(bytes([index]))
+
+        flight = service.Flight("key", produce)
+        with flight.attached() as token:
+            await flight.started()
+            assert service.flights["key"] is flight
+            received, peak = [], 0
+            async for chunk in flight.output(token):
+                received.append(chunk)
+                peak = max(peak, len(flight.chunks))
+                assert "key" not in service.flights
+                await asyncio.sleep(0)
+        assert received == [bytes([index]) for index in range(4 * service.MAX_AHEAD)]
+        assert peak <= service.MAX_AHEAD + 1
+        assert flight.status() == "ok"
+
+    def test_full_queue_rejected_with_retry_after(self, monkeypatch):
+        """With every slot busy and the queue full, /convert answers 429 with a Retry-After estimate"""
+        from fastapi.testclient import TestClient
+
+        service = self.service
+        self.use_pandoc(monkeypatch)
+        monkeypatch.setattr(service, "limiter", service.Limiter(1, 0))
+        service.limiter.sem = asyncio.Semaphore(0)      # the only slot is taken
+        service.limiter.avg_seconds = 2.5
+        with TestClient(service.app) as client:
+            response = client.post("/convert", json={"content": "# Busy", "output_format": "docx"})
+            assert response.status_code == 429 and response.headers["Retry-After"] == "3"
+            assert client.get("/stats").json()["rejected"] == 1
+            assert "pandoc_jobs_rejected_total 1" in client.get("/metrics").text
+            assert 'pandoc_requests_total{output_format="docx",status="rejected"} 1' in client.get("/metrics").text
+
+    @pytest.mark.asyncio
+    async def test_limiter_queues_then_rejects(self):
+        """Jobs beyond the slots wait in the queue; beyond the queue they are rejected at once"""
+        limiter = self.service.Limiter(1, 1)
+        release = asyncio.Event()
+
+        async def job():
+            async with limiter.slot():
+                await release.wait()
+
+        first = asyncio.create_task(job())
+        second = asyncio.create_task(job())
+        await asyncio.sleep(0.05)
+        assert (limiter.active, limiter.waiting) == (1, 1)
+        with pytest.raises(self.service.HTTPException) as rejected:
+            async with limiter.slot():
+                pass
+        assert rejected.value.status_code == 429 and int(rejected.value.headers["Retry-After"]) >= 1
+
+        release.set()
+        await asyncio.gather(first, second)
+        assert limiter.stats()["completed"] == 2 and limiter.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_async_subprocesses_killed(self, monkeypatch):
+        """A cancelled run() kills its command, and a timed-out conversion kills pandoc's process group with 504"""
+        service = self.service
+        self.use_pandoc(monkeypatch, "exec sleep 60")
+        task = asyncio.create_task(service.run(["pandoc"]))
+        while not self.runs():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert process_gone(self.runs()[0])
+
+        monkeypatch.setattr(service, "TIMEOUTS", {"*": 0.5})
+        async with self.client() as client:
+            response = await client.post("/convert", json={"content": "# Slow", "output_format": "docx"})
+        assert response.status_code == 504 and "timed out after 0.5s" in response.json()["detail"]
+        assert process_gone(self.runs()[1])
+        assert service.limiter.stats()["active"] == 0
+
+    @pytest.mark.asyncio
+    async def test_cpu_and_memory_caps(self, monkeypatch):
+        """pandoc starts under its format's caps: a generous memory cap still converts, a spent CPU cap is a 422"""
+        service = self.service
+        monkeypatch.setattr(service, "CPU_LIMITS", {"*": 1})
+        monkeypatch.setattr(service, "MEMORY_LIMITS", {"*": 2048})
+        self.use_pandoc(monkeypatch)
+        async with self.client() as client:
+            response = await client.post("/convert", json={"content": "# Capped", "output_format": "docx"})
+            assert response.status_code == 200 and response.content.startswith(b"PK")
+
+            self.use_pandoc(monkeypatch, "cat > /dev/null\nwhile :; do :; done")
+            response = await client.post("/convert", json={"content": "# Busy", "output_format": "docx"})
+        assert response.status_code == 422 and "CPU limit of 1s" in response.json()["detail"]
+
+    def test_docx_streamed_back(self, monkeypatch):
+        """A docx comes back as a streamed attachment, with and without coalescing"""
+        import io
+        import zipfile
+
+        from fastapi.testclient import TestClient
+
+        service = self.service
+        self.use_pandoc(monkeypatch)
+        for coalesce in (True, False):
+            monkeypatch.setattr(service, "COALESCE", coalesce)
+            with TestClient(service.app) as client:
+                job = {"content": "# Streamed\n\n" + "Paragraph text.\n\n" * 2000, "output_format": "docx"}
+                with client.stream("POST", "/convert", json=job) as response:
+                    assert response.status_code == 200
+                    assert response.headers["content-type"] == service.MEDIA["docx"]
+                    assert "content-length" not in response.headers
+                    assert response.headers["content-disposition"] == 'attachment; filename="out.docx"'
+                    data = b"".join(response.iter_bytes())
+            with zipfile.ZipFile(io.BytesIO(data)) as docx:
+                assert b"Streamed" in docx.read("word/document.xml")
+        assert service.metrics.requests[("docx", "ok")] == 2
+
+    @pytest.mark.asyncio
+    async def test_client_disconnect_kills_pandoc(self, monkeypatch):
+        """A client that goes away before the response starts gets pandoc killed and is recorded as cancelled (499)"""
+        service = self.service
+        self.use_pandoc(monkeypatch, "exec sleep 60")
+        body = json.dumps({"content": "# Abandoned", "output_format": "docx"}).encode("utf-8")
+        for coalesce in (True, False):
+            monkeypatch.setattr(service, "COALESCE", coalesce)
+            runs = len(self.runs())
+            gone = asyncio.Event()
+            pending = [{"type": "http.request", "body": body, "more_body": False}]
+            sent = []
+
+            async def receive(pending=pending, gone=gone):
+                if pending:
+                    return pending.pop()
+                await gone.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message, sent=sent):
+                sent.append(message)
+
+            scope = {
+                "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+                "scheme": "http", "path": "/convert", "raw_path": b"/convert", "query_string": b"", "root_path": "",
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                "client": ("127.0.0.1", 50000), "server": ("service", 80),
+            }
+            request = asyncio.create_task(service.app(scope, receive, send))
+            while len(self.runs()) == runs:
+                await asyncio.sleep(0.01)
+            gone.set()
+            await asyncio.wait_for(request, 10)
+            assert sent[0]["status"] == 499
+            # A shared run is cancelled once its last request is gone, and lets go of its slot as it unwinds
+            for _ in range(100):
+                if process_gone(self.runs()[-1]) and not service.limiter.stats()["active"]:
+                    break
+                await asyncio.sleep(0.05)
+            assert process_gone(self.runs()[-1])
+            assert service.limiter.stats()["active"] == 0 and not service.flights
+        assert service.metrics.requests[("docx", "cancelled")] == 2
+
+    def test_stream_endpoint_uploads(self, monkeypatch):
+        """/convert/stream converts raw and multipart bodies, and rejects bodies over MAX_BODY_BYTES with 413"""
+        import io
+        import zipfile
+
+        from fastapi.testclient import TestClient
+
+        service = self.service
+        self.use_pandoc(monkeypatch)
+        html = "<h1>Uploaded</h1>" + "<p>Paragraph text.</p>" * 2000
+
+        def document(data: bytes) -> bytes:
+            with zipfile.ZipFile(io.BytesIO(data)) as docx:
+                return docx.read("word/document.xml")
+
+        with TestClient(service.app) as client:
+            url = "/convert/stream?input_format=html&output_format=docx"
+            raw = client.post(url, content=html.encode("utf-8"), headers={"Content-Type": "text/html"})
+            assert raw.status_code == 200 and b"Uploaded" in document(raw.content)
+
+            # Chunked, without a Content-Length
+            chunked = client.post(url, content=iter([html[:1000].encode("utf-8"), html[1000:].encode("utf-8")]))
+            assert chunked.status_code == 200 and document(chunked.content) == document(raw.content)
+
+            # Form fields before the file are skipped
+            multipart = client.post(url, data={"note": "not the document"},
+                                    files={"file": ("book.html", html.encode("utf-8"), "text/html")})
+            assert multipart.status_code == 200 and document(multipart.content) == document(raw.content)
+            boundary = "form-boundary"
+            no_file = client.post(
+                url, content=f'--{boundary}\r\nContent-Disposition: form-data; name="note"\r\n\r\nno file\r\n'
+                             f"--{boundary}--\r\n".encode("utf-8"),
+                headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+            )
+            assert no_file.status_code == 400 and "no file part" in no_file.json()["detail"]
+
+            # Repeated query parameters reach pandoc as a list of filters
+            missing = client.post(url + "&filters=missing-one&filters=missing-two", content=b"<p>x</p>")
+            assert missing.status_code == 500 and "missing-one" in missing.json()["detail"]
+
+            monkeypatch.setattr(service, "MAX_BODY_BYTES", 1000)
+            declared = client.post(url, content=html.encode("utf-8"))
+            assert declared.status_code == 413 and "MAX_BODY_BYTES (1000)" in declared.json()["detail"]
+            streamed = client.post(url, content=iter([html[:800].encode("utf-8"), html[800:].encode("utf-8")]))
+            assert streamed.status_code == 413
+        assert service.metrics.requests[("docx", "rejected")] == 1
+        assert service.limiter.stats()["active"] == 0
+